@@ -25,6 +25,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 from pathlib import Path, os
+import tempfile
 # import os
 from django.utils.translation import gettext_lazy as _
 
@@ -33,6 +34,21 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 MEDIA_ROOT = '/upload/public/'
 MEDIA_URL = "/media/"
+# parts of resumable uploads, must be on the same filesystem as MEDIA_ROOT
+# so that the assembled file is moved in place with a rename
+CHUNKED_UPLOAD_DIR = '/upload/chunks/'
+INGEST_TEMP_DIR = '/upload/incoming/'
+# each content stored once, the files of MEDIA_ROOT are hardlinks of the blobs
+# of this directory (same filesystem as MEDIA_ROOT), see file_repo/storage.py
+CONTENT_ADDRESSED_STORAGE = False
+CONTENT_ADDRESSED_STORAGE_DIR = '/upload/blobs/'
+if CONTENT_ADDRESSED_STORAGE:
+    DEFAULT_FILE_STORAGE = 'file_repo.storage.ContentAddressedStorage'
+# spreadsheets read by /file_repo/v1/users/import/ (EMAIL and TOKEN columns)
+USER_IMPORT_DIR = os.path.join(BASE_DIR, 'file_repo', 'import', 'users')
+# files written by the jobs (archives of the admin), outside MEDIA_ROOT: only the
+# job_file view sends them to the admins, through JOB_OUTPUT_OFFLOAD_LOCATION
+JOB_OUTPUT_DIR = '/upload/jobs/'
 STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 # Quick-start development settings - unsuitable for production
@@ -80,6 +96,12 @@ if not DEBUG:
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 
+# downloads are sent by nginx (X-Accel-Redirect) from this internal location,
+# django only checks the permissions, see deployment/nginx/eUploader.conf-nginx
+DOWNLOAD_OFFLOAD = not DEBUG
+DOWNLOAD_OFFLOAD_LOCATION = '/protected_media/'
+JOB_OUTPUT_OFFLOAD_LOCATION = '/protected_jobs/'
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -102,7 +124,7 @@ INSTALLED_APPS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         # 'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'file_repo.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated', 
@@ -113,6 +135,9 @@ REST_FRAMEWORK = {
 
 MIDDLEWARE = [
     
+    'file_repo.metrics.MetricsMiddleware',
+    # first, to count the queries of the other middlewares
+    'file_repo.instrumentation.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -151,6 +176,13 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'eUploader.wsgi.application'
 
+# X-Query-Count, X-SQL-Time and X-Query-Budget response headers (see file_repo/instrumentation.py),
+# set it to True on the staging server
+QUERY_COUNT_HEADERS = DEBUG
+
+# counters of the uwsgi workers and the scanworker, read by /file_repo/api/metrics/ (see file_repo/metrics.py)
+METRICS_DB = '/var/tmp/eUploader_metrics.sqlite3'
+
 
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
@@ -161,8 +193,10 @@ if DEBUG:
 
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
+            'ENGINE': 'eUploader.sqlite3',
             'NAME': os.path.join(DB_DIR, 'db.sqlite3'),
+            # one connection kept by each uwsgi thread
+            'CONN_MAX_AGE': 600,
         }
     }
 else:
@@ -170,11 +204,27 @@ else:
 
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.sqlite3',
+            'ENGINE': 'eUploader.sqlite3',
             'NAME': os.path.join(DB_DIR, 'db.sqlite3'),
+            # one connection kept by each uwsgi thread
+            'CONN_MAX_AGE': 600,
         }
     }
 
+# the test database is created by the migrations, in a file so the tests can use threads
+DATABASES['default']['TEST'] = {
+    'NAME': os.path.join(tempfile.gettempdir(), 'eUploader_test.sqlite3'),
+}
+
+
+# shared by the uwsgi workers, holds the rendered pipelines (see file_repo/cache.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/var/tmp/eUploader_cache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
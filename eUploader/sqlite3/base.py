@@ -0,0 +1,71 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+SQLite backend for several uwsgi workers and threads sharing one database file:
+WAL journal so the readers don't block the writer, a busy timeout instead of
+failing at once on a locked database, and BEGIN IMMEDIATE transactions (see
+file_repo/db.py immediate_atomic) taking the write lock when they start.
+"""
+
+from django.db.backends.sqlite3 import base
+from django.db.utils import OperationalError
+import random
+import time
+
+PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    # with WAL, the commits are still durable against an application crash
+    'PRAGMA synchronous = NORMAL',
+    # in KiB when negative
+    'PRAGMA cache_size = -20000',
+    'PRAGMA temp_store = MEMORY',
+]
+
+# attempts to take the write lock once the busy timeout has expired
+BEGIN_RETRIES = 5
+BEGIN_RETRY_DELAY = 0.05
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # set by immediate_atomic for the next transaction
+        self.begin_immediate = False
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        # busy timeout in seconds
+        conn_params.setdefault('timeout', 20)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if not self.begin_immediate:
+            return super()._start_transaction_under_autocommit()
+        self.begin_immediate = False
+        for attempt in range(BEGIN_RETRIES):
+            try:
+                self.cursor().execute('BEGIN IMMEDIATE')
+                return
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == BEGIN_RETRIES - 1:
+                    raise
+                time.sleep(BEGIN_RETRY_DELAY * 2 ** attempt * (1 + random.random()))
@@ -35,21 +35,31 @@ from django.conf import settings
 
 from django.conf.urls import include, url
 from django.contrib.auth.decorators import login_required
-from django.views.static import serve
 from django.conf import settings
 
 from django.contrib.auth.decorators import permission_required
 
+from django.http import Http404, HttpResponseForbidden
+
 from file_repo import views
+from file_repo.models import FileUpload
+from file_repo.permissions import is_upload_validator_or_uploader
+from file_repo.streaming import file_response
 
 @login_required
 def protected_serve(request, path, document_root=None, show_indexes=False):
-    return serve(request, path, document_root, show_indexes)
+    file = FileUpload.objects.select_related('upload').filter(uploaded_file=path).first()
+    if file is None:
+        raise Http404
+    if not (request.user.is_staff or is_upload_validator_or_uploader(request.user, file.upload)):
+        return HttpResponseForbidden()
+    return file_response(request, file.uploaded_file.path, etag=file.sha256 or file.checksum)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('file_repo/', include('file_repo.urls')),
+    # before the gui, whose pattern matches every path
+    url(r'^%s(?P<path>.*)$' % settings.MEDIA_URL[1:], protected_serve, {'document_root': settings.MEDIA_ROOT}),
     url(r'', views.HomePageView.as_view(), name="gui"),
     url(r'/(?P<id>\w+)', views.HomePageView.as_view(), name="gui"),
-    url(r'^%s(?P<path>.*)$' % settings.MEDIA_URL[1:], protected_serve, {'document_root': settings.MEDIA_ROOT})
 ]
\ No newline at end of file
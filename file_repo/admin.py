@@ -18,12 +18,18 @@ from django.conf import settings
 from django.contrib.auth.models import User, Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.admin import GroupAdmin as BaseGroupAdmin
-from django.http import HttpResponse
-import os, io
-import zipfile
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.html import format_html
+from django import forms
+import os
 import datetime
-from .models import FileUpload, AllowedFileType, Config, Pipeline, MetadataFormsField, Custom, MetadataValue, Upload, FieldOption, Workflow, UploadValidation, Note
+import uuid
+from .models import FileUpload, FileUploadSession, AllowedFileType, Config, Pipeline, MetadataFormsField, Custom, MetadataValue, Upload, FieldOption, Workflow, UploadValidation, Note, ScanVerdict, UserImport, UserImportError, Job
 from nested_inline.admin import NestedModelAdmin, NestedTabularInline
+from .streaming import zip_stream
+from .jobs import TASKS, enqueue
 
 
 from modeltranslation.admin import TranslationAdmin
@@ -32,19 +38,30 @@ def download_multiple_files(FileUploadAdmin, request, queryset):
     date = datetime.datetime.now().strftime("%d%m%Y-%H%M%S")
     zip_subdir = f"eUploader_DL_{date}"
     zip_filename = zip_subdir + ".zip"
-    byte_stream = io.BytesIO()
-    zf = zipfile.ZipFile(byte_stream, "w")
 
-    for file in queryset:
-        zip_path = os.path.join(zip_subdir, file.uploaded_file.name)
-        zf.write(os.path.join(settings.MEDIA_ROOT, file.uploaded_file.name), zip_path)
+    names = queryset.values_list('uploaded_file', flat=True)
+    entries = [(os.path.join(settings.MEDIA_ROOT, name), os.path.join(zip_subdir, name)) for name in names]
 
-    zf.close()
-    response = HttpResponse(byte_stream.getvalue(), content_type="application/x-zip-compressed")
+    # the archive is written while it is sent
+    response = StreamingHttpResponse(zip_stream(entries), content_type="application/x-zip-compressed")
     response['Content-Disposition'] = 'attachment; filename=%s' % zip_filename
     return response        
 download_multiple_files.short_description = "Télécharger le(s) fichier(s) sélectionné(s)"
 
+def zip_files_in_background(FileUploadAdmin, request, queryset):
+    date = datetime.datetime.now().strftime("%d%m%Y-%H%M%S")
+    # the random part keeps apart two archives started in the same second
+    job = enqueue("zip_files", user=request.user, file_ids=list(queryset.values_list('id', flat=True)), filename=f"eUploader_DL_{date}_{uuid.uuid4().hex}.zip")
+    url = reverse('admin:file_repo_job_change', args=[job.id])
+    FileUploadAdmin.message_user(request, format_html('Archive en préparation, elle sera téléchargeable depuis la <a href="{}">tâche {}</a>', url, job.id))
+zip_files_in_background.short_description = "Préparer une archive ZIP du/des fichier(s) sélectionné(s) en arrière-plan"
+
+def rescan_files(FileUploadAdmin, request, queryset):
+    # without their cached verdict, the files are sent to clamd
+    ScanVerdict.objects.filter(sha256__in=queryset.exclude(sha256=None).values('sha256')).delete()
+    queryset.update(scan_state=FileUpload.ScanState.PENDING)
+rescan_files.short_description = "Analyser à nouveau le(s) fichier(s) sélectionné(s)"
+
 class MetadataValueInline(NestedTabularInline):
     model = MetadataValue
     extra = 1
@@ -71,9 +88,9 @@ class UploadAdmin(NestedModelAdmin):
 @admin.register(FileUpload)
 class FileUploadAdmin(admin.ModelAdmin):
     search_fields = ['uploaded_file', 'upload__user__username']
-    list_display = ['id', 'pipeline', 'user', 'checksum', 'name', 'uploaded_file', 'type']
-    list_filter = ['upload__pipeline__name', 'upload__user__username']
-    actions = [download_multiple_files]
+    list_display = ['id', 'pipeline', 'user', 'checksum', 'name', 'uploaded_file', 'size', 'type', 'detected_type', 'scan_state', 'scan_result']
+    list_filter = ['upload__pipeline__name', 'upload__user__username', 'scan_state', 'detected_type']
+    actions = [download_multiple_files, zip_files_in_background, rescan_files]
 
     inlines = [
         MetadataValueInline,
@@ -93,6 +110,63 @@ class FileUploadAdmin(admin.ModelAdmin):
                 choices.pop(i)
         return choices
 
+@admin.register(ScanVerdict)
+class ScanVerdictAdmin(admin.ModelAdmin):
+    search_fields = ['sha256', 'scan_result']
+    list_display = ['sha256', 'db_version', 'scan_state', 'scan_result', 'hits', 'scanned_at', 'last_hit_at']
+    list_filter = ['scan_state', 'db_version']
+
+class UserImportErrorInline(admin.TabularInline):
+    model = UserImportError
+    extra = 0
+    readonly_fields = ['file', 'row', 'email', 'error']
+
+@admin.register(UserImport)
+class UserImportAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'rows', 'created_users', 'created_tokens', 'updated_tokens', 'errors_count', 'created_at', 'finished_at']
+    list_filter = ['status']
+    inlines = [UserImportErrorInline]
+
+def retry_jobs(JobAdmin, request, queryset):
+    queryset.exclude(status=Job.Status.RUNNING).update(status=Job.Status.QUEUED, attempts=0, run_after=timezone.now(), lease_until=None, finished_at=None)
+retry_jobs.short_description = "Relancer la/les tâche(s) sélectionnée(s)"
+
+class JobForm(forms.ModelForm):
+    name = forms.ChoiceField(choices=[])
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['name'].choices = [(name, name) for name in sorted(TASKS)]
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    """
+    the jobs run by the runworker command, the management commands of tasks.COMMANDS can be queued from here
+    """
+    form = JobForm
+    search_fields = ['name', 'error']
+    list_display = ['id', 'name', 'status', 'attempts', 'user', 'created_at', 'started_at', 'finished_at', 'output_file']
+    list_filter = ['status', 'name']
+    readonly_fields = ['status', 'attempts', 'max_attempts', 'lease_until', 'worker', 'result', 'error', 'user', 'started_at', 'finished_at', 'output_file']
+    actions = [retry_jobs]
+
+    def output_file(self, obj):
+        if obj.status == Job.Status.DONE and isinstance(obj.result, dict) and obj.result.get('file'):
+            return format_html('<a href="{}">{}</a>', reverse('file_repo:job_file', args=[obj.id]), obj.result['file'])
+        return None
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.user = request.user
+            obj.max_attempts = TASKS[obj.name][1]
+        super().save_model(request, obj, form, change)
+
+@admin.register(FileUploadSession)
+class FileUploadSessionAdmin(admin.ModelAdmin):
+    search_fields = ['filename', 'upload__user__username']
+    list_display = ['id', 'upload', 'filename', 'size', 'status', 'created_at']
+    list_filter = ['status']
+
 @admin.register(AllowedFileType)
 class AllowedFileTypeAdmin(admin.ModelAdmin):
     search_fields = ['mime']
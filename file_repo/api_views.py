@@ -14,34 +14,45 @@ If not, see <https://www.gnu.org/licenses/>.
 
 from rest_framework import viewsets, mixins
 from django.contrib.auth.models import User, Group
-from .models import Pipeline, Upload, FileUpload, MetadataValue, Note, UploadValidation, MetadataFormsField, Workflow
+from .models import Pipeline, Upload, FileUpload, FileUploadSession, MetadataValue, Note, UploadValidation, MetadataFormsField, Workflow
 from rest_framework import status
 from rest_framework.response import Response
-from .serializers import PipelineSerializer, UserSerializer, UserMinimalSerializer, UploadSerializer, PipelineMinimalSerializer, NoteSerializer, UploadMinimalSerializer, FileUploadSerializer, MetadataValueSerializer, PipelineFormsFieldsNoScopeSerializer
+from .serializers import PipelineSerializer, UserSerializer, UserMinimalSerializer, UploadSerializer, PipelineMinimalSerializer, NoteSerializer, UploadMinimalSerializer, FileUploadSerializer, MetadataValueSerializer, PipelineFormsFieldsNoScopeSerializer, FileUploadSessionSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
-from rest_framework.pagination import PageNumberPagination
-from rest_framework.settings import api_settings
-from rest_framework.decorators import api_view, permission_classes
+from .pagination import get_paginator
+from rest_framework.decorators import api_view, permission_classes, action
+from rest_framework.exceptions import ValidationError
 from rest_framework.authtoken.models import Token
-import json, os
+from django.db.models import Prefetch
+from django.utils.http import parse_etags, quote_etag
+from django.utils import timezone
+import json, os, time
+from django.http import HttpResponse
 from .flex_serializers import UploadValidationForListSerializer, UploadValidationSerializer
 from rest_framework import mixins
-from .permissions import IsValidator, CanAutomate, is_upload_validator_or_uploader, IsUploaderOrValidatorForFileUpload, IsUploaderOrValidatorForUpload, IsUploaderOrValidatorForFileUpload
+from .permissions import IsValidator, CanAutomate, is_upload_validator_or_uploader, IsUploaderOrValidatorForFileUpload, IsUploaderOrValidatorForUpload, IsUploaderOrValidatorForFileUploadSession, get_roles, visible_uploads
+from .scanning import only_scanned, cached_scan_fields, cached_scan_fields_by_sha256
+from .cache import schema_etag, cached_schema
+from .uploads import write_part, assemble_parts, remove_parts, part_head, get_size_limit, get_allowed_mimes, get_user_allowed_mimes, sniff_mime, mime_error, StreamingIngestUploadHandler
 from rest_framework import filters
-from django.http import FileResponse
-from datetime import datetime
-
+from .streaming import file_response
+from .authentication import get_token
+from .db import immediate_atomic
+from .apps import FileRepoConfig
+from .instrumentation import query_budget
+from . import metrics
+from datetime import datetime, timezone as dt_timezone
+
+@query_budget(3)
 @api_view(['GET'])
 def download_file(request, id):
     try:
-        file = FileUpload.objects.get(id=id)
+        file = FileUpload.objects.select_related('upload').get(id=id)
         if is_upload_validator_or_uploader(request.user, file.upload):
             filename = os.path.basename(file.uploaded_file.path)
             path = file.uploaded_file.path
-            response = FileResponse(open(path, 'rb'))
-            response['Content-Disposition'] = f'attachment; filename="{filename}"'
-            return response
+            return file_response(request, path, filename=filename, etag=file.sha256 or file.checksum)
         else:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
     except FileUpload.DoesNotExist:
@@ -49,45 +60,62 @@ def download_file(request, id):
 
 
 class PipelineViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The rendered pipelines are cached until a pipeline definition changes,
+    a client sending back the ETag gets a 304 without any query
+    """
+    query_budget = 8
+
+    def get_queryset(self):
+        fields = MetadataFormsField.objects.select_related('scope').prefetch_related('options')
+        return Pipeline.objects.prefetch_related('mimes', Prefetch('fields', queryset=fields)).order_by('id')
+
+    def cached_response(self, request, pipeline_id, variant, render):
+        etag = schema_etag(pipeline_id, variant)
+        if quote_etag(etag) in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(cached_schema(etag, render))
+        response['ETag'] = quote_etag(etag)
+        return response
 
     def list(self, request):
         if(hasattr(request.user, 'custom')):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         else:
-            pipeline = Pipeline.objects.all().order_by('id')
-            serializer = PipelineSerializer(pipeline, many=True)
-            return Response(serializer.data)
+            return self.cached_response(request, "all", "full", lambda: PipelineSerializer(self.get_queryset(), many=True).data)
 
     def retrieve(self, request, pk=None):
         """
         An uploader can see only its own pipeline
         """
-        pipeline = Pipeline.objects.get(id=pk)
         if(hasattr(request.user, 'custom')):
-            if pipeline:
-                if pipeline != request.user.custom.pipeline:
-                    return Response(status=status.HTTP_401_UNAUTHORIZED)
-                else:
-                    """
-                    if the user is an uploader then he must get only no scope fields
-                    """
-                    serializer = PipelineFormsFieldsNoScopeSerializer(pipeline)
-                    return Response(serializer.data)
-            else:
-                return Response(status=status.HTTP_404_NOT_FOUND)
-
+            if str(request.user.custom.pipeline_id) != str(pk):
+                return Response(status=status.HTTP_401_UNAUTHORIZED)
+            """
+            if the user is an uploader then he must get only no scope fields
+            """
+            serializer_class, variant = PipelineFormsFieldsNoScopeSerializer, "no_scope"
         else:
-            if not pipeline:
-                return Response(status=status.HTTP_404_NOT_FOUND)
-            serializer = PipelineSerializer(pipeline)
-            return Response(serializer.data)
+            serializer_class, variant = PipelineSerializer, "full"
+
+        def render():
+            pipeline = self.get_queryset().filter(id=pk).first()
+            return serializer_class(pipeline).data if pipeline else None
+
+        response = self.cached_response(request, pk, variant, render)
+        if response.status_code == status.HTTP_200_OK and response.data is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return response
         
 class PipelineMinimalViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = Pipeline.objects.all().order_by('id')
+    query_budget = 4
+    queryset = Pipeline.objects.all().order_by('id').prefetch_related('fields')
     serializer_class = PipelineMinimalSerializer
 
 class NoteViewSet(viewsets.ModelViewSet, mixins.CreateModelMixin, mixins.ListModelMixin):
     permission_classes = [IsValidator]
+    query_budget = 4
     queryset = Note.objects.all().order_by('-created')
     serializer_class = NoteSerializer
     filter_backends = [DjangoFilterBackend]
@@ -97,36 +125,45 @@ class NoteViewSet(viewsets.ModelViewSet, mixins.CreateModelMixin, mixins.ListMod
 class UploadViewSet(viewsets.ModelViewSet):
     serializer_class = UploadSerializer
     permission_classes = [IsUploaderOrValidatorForUpload]
+    query_budget = {'list': 6, 'retrieve': 5, 'create': 8, 'update': 8, 'partial_update': 8}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = get_paginator(self.request)
+        return self._paginator
 
     def get_queryset(self):
         date_from = self.request.query_params.get('date_from')
+        queryset = Upload.objects.filter(visible_uploads(self.request.user)).order_by('id').prefetch_related('files__values')
         if date_from:
-            queryset = Upload.objects.filter(uploaded_at__gte=date_from).order_by('id')
-        else:
-            queryset = Upload.objects.all()
+            queryset = queryset.filter(uploaded_at__gte=date_from)
         return queryset
     
     def create(self, request):
-        # if the last upload has the state INIT we don't create a new one.
-        upload = Upload.objects.filter(user=request.user).last()
-        if upload:
-            if upload.status == Upload.Status.INIT or upload.status == Upload.Status.FILE_UPLOADED:
-                upload.uploaded_at = datetime.now()
-                upload.save()
-                serializer = UploadSerializer(upload)
-                return Response(serializer.data)
-        serializer = UploadSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(
-                user=self.request.user, 
-                pipeline=self.request.user.custom.pipeline, 
-                same_meta_for_each_file=self.request.user.custom.pipeline.default_same_metadata_for_each_file)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # the write lock is taken before reading the last upload, two requests can't both create one
+        with immediate_atomic():
+            # if the last upload has the state INIT we don't create a new one.
+            upload = Upload.objects.filter(user=request.user).last()
+            if upload:
+                if upload.status == Upload.Status.INIT or upload.status == Upload.Status.FILE_UPLOADED:
+                    upload.uploaded_at = timezone.now()
+                    upload.save()
+                    serializer = UploadSerializer(upload)
+                    return Response(serializer.data)
+            serializer = UploadSerializer(data=request.data)
+            if serializer.is_valid():
+                serializer.save(
+                    user=self.request.user, 
+                    pipeline=self.request.user.custom.pipeline, 
+                    same_meta_for_each_file=self.request.user.custom.pipeline.default_same_metadata_for_each_file)
+                return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 """
 Return only the validated uploads by pipeline
 """
+@query_budget(7)
 @api_view(['GET'])
 @permission_classes([CanAutomate])
 def validated_upload(request, pipeline_id):
@@ -136,23 +173,18 @@ def validated_upload(request, pipeline_id):
     except Pipeline.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
     
-    upload_ids = set()
+    # validation_state is kept up to date when an UploadValidation changes
+    uploads = Upload.objects.filter(pipeline=pipeline, validation_state=Upload.ValidationState.VALIDATED_OK).order_by('uploaded_at', 'id').prefetch_related('files__values')
+    uploads = only_scanned(uploads, "files")
 
-    for workflow in Workflow.objects.filter(pipeline=pipeline):
-        for validation in workflow.upload_validations.all():
-            if all(v.state == UploadValidation.State.VALIDATED_OK for v in UploadValidation.objects.filter(upload__id=validation.upload.id)):
-                upload_ids.add(validation.upload.id)
-
-    uploads = Upload.objects.filter(id__in=upload_ids)
-
-    paginator = PageNumberPagination()
-    paginator.page_size = api_settings.PAGE_SIZE
+    paginator = get_paginator(request)
     result_page = paginator.paginate_queryset(uploads, request)
     serializer = UploadSerializer(result_page, many=True)
     return paginator.get_paginated_response(serializer.data)
 
 
 class UploadsByPipeline(APIView):
+    query_budget = 7
 
     def get(self, request, pipeline_id):
 
@@ -164,29 +196,20 @@ class UploadsByPipeline(APIView):
         
         date_from = request.query_params.get('date_from')
         upload_status = request.query_params.get('status', "COMPLETED").upper()
-        uploads = []
-        
-        if request.user and request.user.groups.filter(name='Automation'):
 
-            # find the users which linked the requested pipeline
-            upload_users = []
-            for upload in Upload.objects.all():
-                if hasattr(upload.user, 'custom') and (str(upload.user.custom.pipeline.id) == str(pipeline_id)):
-                    upload_users.append(upload.user)
+        # served by the (pipeline, status, uploaded_at) index
+        uploads = Upload.objects.filter(pipeline=pipeline, status=upload_status)
 
-            if date_from:
-                uploads = Upload.objects.filter(user__in=upload_users).filter(status=upload_status).filter(uploaded_at__gte=date_from).order_by('id')
-            else:
-                uploads = Upload.objects.filter(user__in=upload_users).filter(status=upload_status).order_by('id')
-        else:
+        # the automation users get the uploads of every uploader of the pipeline
+        if not get_roles(request.user).is_automation:
+            uploads = uploads.filter(user=request.user)
 
-            if date_from:
-                uploads = Upload.objects.filter(user=request.user).filter(user__custom__pipeline=pipeline).filter(status=upload_status).filter(uploaded_at__gte=date_from).order_by('id')
-            else:
-                uploads = Upload.objects.filter(user=request.user).filter(user__custom__pipeline=pipeline).filter(status=upload_status).order_by('id')
+        if date_from:
+            uploads = uploads.filter(uploaded_at__gte=date_from)
+
+        uploads = uploads.order_by('uploaded_at', 'id').prefetch_related('files__values')
 
-        paginator = PageNumberPagination()
-        paginator.page_size = api_settings.PAGE_SIZE
+        paginator = get_paginator(request)
         result_page = paginator.paginate_queryset(uploads, request)
         serializer = UploadSerializer(result_page, many=True)
         return paginator.get_paginated_response(serializer.data)
@@ -195,12 +218,13 @@ class UploadValidationViewSet(viewsets.ModelViewSet):
     filter_backends = [DjangoFilterBackend]
     serializer_class = UploadValidationForListSerializer
     permission_classes = [IsValidator]
+    query_budget = {'list': 9, 'retrieve': 9, 'update': 8, 'partial_update': 8}
     filter_backends = [filters.OrderingFilter]
     ordering_fields = '__all__'
 
     def get_queryset(self):
 
-        user_groups = self.request.user.groups.all().order_by("id")
+        user_groups = get_roles(self.request.user).group_ids
 
         ordering = self.request.GET.get('ordering')
 
@@ -214,121 +238,456 @@ class UploadValidationViewSet(viewsets.ModelViewSet):
         else:
             validations = UploadValidation.objects.filter(group__in=user_groups).order_by("id")
 
-        return validations
+        # an upload is validated only once all its files are known as clean
+        return self.prefetch_expansions(only_scanned(validations))
+
+    def update(self, request, *args, **kwargs):
+        # the validation and the validation_state of its upload are written together
+        with immediate_atomic():
+            return super().update(request, *args, **kwargs)
+
+    # (select_related, prefetch_related) needed by each expandable field of UploadValidationForListSerializer
+    EXPANSIONS = {
+        'upload': ([], ['upload__files__values']),
+        'upload.user': (['upload__user'], []),
+        'group': (['group'], []),
+        'workflow': (['workflow'], ['workflow__validator_groups']),
+        'workflow.pipeline': (['workflow__pipeline'], []),
+        'workflow.validator_groups': ([], ['workflow__validator_groups']),
+    }
+
+    def prefetch_expansions(self, queryset):
+        """
+        Fetch what the requested ?expand= serializes with a constant number of queries
+        """
+        expand = {e.strip() for e in self.request.query_params.get('expand', '').split(',') if e.strip()}
+        if expand & {'*', '~all'}:
+            expand |= {name for name in self.EXPANSIONS if '.' not in name}
+
+        # the other validations of the upload are always serialized
+        queryset = queryset.select_related('upload').prefetch_related('upload__validations')
+        for name, (related, prefetch) in self.EXPANSIONS.items():
+            if name in expand:
+                queryset = queryset.select_related(*related).prefetch_related(*prefetch)
+        return queryset
 
 class FileUploadViewSet(viewsets.ModelViewSet):
     serializer_class = FileUploadSerializer
     filter_backends = [DjangoFilterBackend]
     permission_classes = [IsUploaderOrValidatorForFileUpload]
     filterset_fields = ['upload']
+    query_budget = {'list': 5, 'retrieve': 5, 'create': 9, 'batch': 14}
 
     def get_queryset(self):
-        queryset = FileUpload.objects.all().order_by('id')
+        queryset = FileUpload.objects.filter(visible_uploads(self.request.user, 'upload__')).order_by('id').prefetch_related('values')
         return queryset
     
     def create(self, request):
-        
+
+        started = time.perf_counter()
+
+        # hash, size and type checks while the file is received, before request.data is parsed
+        ingest = StreamingIngestUploadHandler(request, max_size=get_size_limit(request.user), allowed_mimes=get_user_allowed_mimes(request.user))
+        request.upload_handlers.insert(0, ingest)
+
+        serializer = self.get_serializer(data=request.data)
+
+        if ingest.rejected_reason == "type":
+            return Response({"detail": ingest.rejected}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        if ingest.rejected:
+            return Response({"detail": ingest.rejected}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        if serializer.is_valid():
+            uploaded_file = serializer.validated_data['uploaded_file']
+            sha256 = getattr(uploaded_file, 'sha256', None)
+            # a content already scanned is not scanned again
+            file = serializer.save(sha256=sha256, detected_type=getattr(uploaded_file, 'detected_type', None), **cached_scan_fields(sha256))
+            metrics.record_ingest(file, time.perf_counter() - started)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Create many files of one upload in a single request and transaction:
+        upload, the uploaded_file parts (with type and checksum in the same order, optional)
+        and session, the ids of resumable upload sessions whose parts are all received.
+        The files which can't be created are returned in errors, with their index in the
+        uploaded_file parts or their session, the other ones are created.
+        """
+        started = time.perf_counter()
+
+        # each file is hashed while it is received, a file too large or of a type not allowed is skipped
+        ingest = StreamingIngestUploadHandler(request, max_size=get_size_limit(request.user), allowed_mimes=get_user_allowed_mimes(request.user), skip_rejected=True)
+        request.upload_handlers.insert(0, ingest)
+
+        try:
+            upload = Upload.objects.select_related('user__custom__pipeline').get(id=request.data.get('upload'))
+        except (Upload.DoesNotExist, ValueError, TypeError):
+            return Response({"upload": "an upload id"}, status=status.HTTP_400_BAD_REQUEST)
+        if not is_upload_validator_or_uploader(request.user, upload):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+        uploaded_files = request.FILES.getlist('uploaded_file')
+        session_ids = data_list(request.data, 'session')
+        if len(uploaded_files) + len(session_ids) > FileRepoConfig.BATCH_UPLOAD_MAX_FILES:
+            return Response({"detail": f"at most {FileRepoConfig.BATCH_UPLOAD_MAX_FILES} files by request"}, status=status.HTTP_400_BAD_REQUEST)
+        types = data_list(request.data, 'type')
+        checksums = data_list(request.data, 'checksum')
+
+        fields = self.get_serializer().fields
+        # (key in the errors, incoming file, type, checksum, session)
+        entries = []
+        errors = []
+        for index, incoming in enumerate(uploaded_files):
+            file_errors = {}
+            if incoming.rejected:
+                file_errors['uploaded_file'] = [incoming.rejected]
+            values = {
+                'uploaded_file': incoming,
+                'type': types[index] if len(types) == len(uploaded_files) else incoming.content_type,
+                'checksum': checksums[index] if len(checksums) == len(uploaded_files) else None,
+            }
+            # the field validations of FileUploadSerializer, without its queries
+            for name, value in values.items():
+                try:
+                    values[name] = fields[name].run_validation(value)
+                except ValidationError as e:
+                    file_errors.setdefault(name, e.detail)
+            if file_errors:
+                errors.append({"index": index, "name": incoming.name, "errors": file_errors})
+            else:
+                entries.append(({"index": index}, incoming, values['type'], values['checksum'], None))
+
+        sessions = {session.id: session for session in FileUploadSession.objects.filter(id__in=[id for id in session_ids if str(id).isdigit()], upload=upload)}
+        try:
+            for session_id in session_ids:
+                session = sessions.get(int(session_id)) if str(session_id).isdigit() else None
+                error = None
+                if session is None:
+                    error = "not a session of the upload"
+                elif session.missing_parts():
+                    error = f"missing parts {session.missing_parts()}"
+                # only one request can assemble the parts
+                elif not FileUploadSession.objects.filter(id=session.id, status=FileUploadSession.Status.OPEN).update(status=FileUploadSession.Status.ASSEMBLING):
+                    error = f"session is {session.status}"
+                if error:
+                    errors.append({"session": session_id, "errors": {"session": [error]}})
+                    continue
+                incoming = assemble_parts(session)
+                # the part 0 was checked when received, the allowed types can have changed since
+                error = mime_error(session.filename, incoming.detected_type, get_allowed_mimes(upload.pipeline_id))
+                if error:
+                    incoming.close()
+                    abort_session(session)
+                    errors.append({"session": session_id, "errors": {"session": [error]}})
+                else:
+                    entries.append(({"session": session.id}, incoming, session.type, session.checksum, session))
+
+            files = []
+            scan_fields = cached_scan_fields_by_sha256([entry[1].sha256 for entry in entries])
+            for key, incoming, type, checksum, session in entries:
+                # the file is moved in place, it keeps its modification time
+                modified_at = datetime.fromtimestamp(os.stat(incoming.temporary_file_path()).st_mtime, tz=dt_timezone.utc)
+                file = FileUpload(upload=upload, type=type, detected_type=incoming.detected_type, checksum=checksum, sha256=incoming.sha256, size=incoming.size, modified_at=modified_at, **scan_fields.get(incoming.sha256, {}))
+                file.uploaded_file = incoming
+                files.append(file)
+
+            created = []
+            if files:
+                with immediate_atomic():
+                    # the write lock is held, the rows after the last id are the ones inserted here
+                    last_id = FileUpload.objects.order_by('-id').values_list('id', flat=True).first() or 0
+                    try:
+                        # the files are moved in place by the FileField pre_save
+                        FileUpload.objects.bulk_create(files, batch_size=FileRepoConfig.BATCH_UPLOAD_INSERT_SIZE)
+                    except BaseException:
+                        for file in files:
+                            if file.uploaded_file._committed:
+                                file.uploaded_file.storage.delete(file.uploaded_file.name)
+                        raise
+                    created = list(FileUpload.objects.filter(upload=upload, id__gt=last_id).order_by('id').prefetch_related('values'))
+                    for file in created:
+                        file.upload = upload
+        except BaseException:
+            FileUploadSession.objects.filter(id__in=[entry[4].id for entry in entries if entry[4]], status=FileUploadSession.Status.ASSEMBLING).update(status=FileUploadSession.Status.OPEN)
+            raise
+        finally:
+            for entry in entries:
+                entry[1].close()
+
+        for (key, incoming, type, checksum, session), file in zip(entries, created):
+            if session:
+                FileUploadSession.objects.filter(id=session.id).update(status=FileUploadSession.Status.COMPLETED, file=file)
+                remove_parts(session)
+            metrics.record_ingest(file)
+        if created:
+            metrics.observe("euploader_upload_duration_seconds", {"pipeline": upload.pipeline_id}, time.perf_counter() - started)
+
+        data = {"files": self.get_serializer(created, many=True).data, "errors": errors}
+        if not errors:
+            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(data, status=status.HTTP_207_MULTI_STATUS if created else status.HTTP_400_BAD_REQUEST)
+
+class FileUploadSessionViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    Resumable upload of a file: create a session, PUT the parts in any order
+    on part/<number>/, GET the session to know the received parts and the offset
+    then POST on finalize/ to create the FileUpload
+    """
+    serializer_class = FileUploadSessionSerializer
+    permission_classes = [IsUploaderOrValidatorForFileUploadSession]
+    query_budget = {'create': 5, 'retrieve': 4, 'destroy': 6, 'part': 4, 'finalize': 12}
+    queryset = FileUploadSession.objects.all()
+
+    def create(self, request):
         serializer = self.get_serializer(data=request.data)
-        
         if serializer.is_valid():
+            if not is_upload_validator_or_uploader(request.user, serializer.validated_data['upload']):
+                return Response(status=status.HTTP_401_UNAUTHORIZED)
             serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=True, methods=['put'], url_path=r'part/(?P<number>\d+)')
+    def part(self, request, pk=None, number=None):
+        session = self.get_object()
+        number = int(number)
+        if session.status != FileUploadSession.Status.OPEN:
+            return Response({"detail": f"session is {session.status}"}, status=status.HTTP_409_CONFLICT)
+        if number >= session.part_count():
+            return Response({"detail": f"the session has {session.part_count()} parts"}, status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:
+            return Response({"detail": "empty part"}, status=status.HTTP_400_BAD_REQUEST)
+
+        written = write_part(session, number, request.stream)
+        if written != session.part_length(number):
+            return Response({"detail": f"part {number} must be {session.part_length(number)} bytes"}, status=status.HTTP_400_BAD_REQUEST)
+        # the first part gives the type, a file not allowed is refused before the next parts are sent
+        if number == 0:
+            error = mime_error(session.filename, sniff_mime(part_head(session)), get_allowed_mimes(session.upload.pipeline_id))
+            if error:
+                abort_session(session)
+                return Response({"detail": error}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+        serializer = self.get_serializer(session)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def finalize(self, request, pk=None):
+        session = self.get_object()
+        if session.status != FileUploadSession.Status.OPEN:
+            return Response({"detail": f"session is {session.status}"}, status=status.HTTP_409_CONFLICT)
+        missing = session.missing_parts()
+        if missing:
+            return Response({"missing_parts": missing}, status=status.HTTP_409_CONFLICT)
+
+        # only one finalize can assemble the parts
+        if not FileUploadSession.objects.filter(id=session.id, status=FileUploadSession.Status.OPEN).update(status=FileUploadSession.Status.ASSEMBLING):
+            return Response({"detail": "session is not open"}, status=status.HTTP_409_CONFLICT)
+
+        incoming = None
+        try:
+            incoming = assemble_parts(session)
+            # the part 0 was checked when received, the allowed types can have changed since
+            error = mime_error(session.filename, incoming.detected_type, get_allowed_mimes(session.upload.pipeline_id))
+            if error:
+                incoming.close()
+                incoming = None
+                abort_session(session)
+                return Response({"detail": error}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+            file = FileUpload(upload=session.upload, checksum=session.checksum, sha256=incoming.sha256, type=session.type, detected_type=incoming.detected_type, **cached_scan_fields(incoming.sha256))
+            file.uploaded_file = incoming
+            file.save()
+        except BaseException:
+            FileUploadSession.objects.filter(id=session.id).update(status=FileUploadSession.Status.OPEN)
+            raise
+        finally:
+            if incoming:
+                incoming.close()
+
+        session.status = FileUploadSession.Status.COMPLETED
+        session.file = file
+        session.save()
+        remove_parts(session)
+        metrics.record_ingest(file)
+
+        serializer = FileUploadSerializer(file, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def perform_destroy(self, instance):
+        remove_parts(instance)
+        instance.delete()
+
+
+def abort_session(session):
+    """
+    a session whose file is refused, its parts are removed
+    """
+    FileUploadSession.objects.filter(id=session.id).update(status=FileUploadSession.Status.ABORTED)
+    remove_parts(session)
+
+def data_list(data, key):
+    """
+    the values of a key sent many times in a multipart request, or a list in JSON
+    """
+    if hasattr(data, 'getlist'):
+        return data.getlist(key)
+    value = data.get(key)
+    return value if isinstance(value, list) else [] if value is None else [value]
+
 
 class UserByToken(APIView):
+    query_budget = 3
 
     def get(self, request, token):
         try:
-            user=Token.objects.get(key=token).user
+            user=get_token(token).user
             serializer = UserMinimalSerializer(user)
             return Response(serializer.data)
-        except Pipeline.DoesNotExist:
+        except Token.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+METADATA_BATCH_SIZE = 500
+
+def metadata_values(data):
+    """
+    The {key: value} of a [{"key": ..., "value": ...}] payload,
+    ValueError when it isn't a list of such items with string keys and values
+    """
+    if not isinstance(data, list):
+        raise ValueError('values must be a list of {"key": ..., "value": ...}')
+    values = {}
+    for d in data:
+        if not isinstance(d, dict) or not isinstance(d.get("key"), str) or not isinstance(d.get("value"), str):
+            raise ValueError(f'each value must be {{"key": <string>, "value": <string>}}, not {json.dumps(d)}')
+        if not d["key"] or len(d["key"]) > MetadataValue._meta.get_field('key').max_length:
+            raise ValueError(f'invalid key "{d["key"]}"')
+        values[d["key"]] = d["value"]
+    return values
+
+def upsert_metadata_values(files, values):
+    """
+    Set the {key: value} of values (see metadata_values) on each file: the existing values
+    are read with one query per batch of files and compared in memory,
+    then only the new and changed values are written.
+    """
+    to_create = []
+    to_update = []
+
+    for i in range(0, len(files), METADATA_BATCH_SIZE):
+        batch = files[i:i + METADATA_BATCH_SIZE]
+        existing = {}
+        for m in MetadataValue.objects.filter(file__in=batch, key__in=values.keys()):
+            existing[(m.file_id, m.key)] = m
+
+        for f in batch:
+            for key, value in values.items():
+                m = existing.get((f.id, key))
+                if m is None:
+                    to_create.append(MetadataValue(file=f, key=key, value=value))
+                elif m.value != value:
+                    m.value = value
+                    to_update.append(m)
+
+    MetadataValue.objects.bulk_create(to_create, batch_size=METADATA_BATCH_SIZE)
+    MetadataValue.objects.bulk_update(to_update, ['value'], batch_size=METADATA_BATCH_SIZE)
+
+def create_validations(user, upload):
+    """
+    Create the validations of the upload if the user is an uploader
+    """
+    if not hasattr(user, "custom"):
+        return
+
+    # check if the upload already has a validation
+    if upload.validations.exists():
+        return
+
+    workflows = user.custom.pipeline.workflows.all()
+    groups = set()
+    for workflow in workflows:
+        for group in workflow.validator_groups.all():
+            groups.add(group)
+
+    # Create validations
+    for group in groups:
+        validation = UploadValidation()
+        validation.upload = upload
+        validation.group = group
+        validation.workflow = workflows[0]
+        validation.save()
+
+@query_budget(10)
 @api_view(['PUT'])
 def file_metadata(request, file_id):
-    
+
     try:
+        file = FileUpload.objects.select_related('upload').get(id=file_id)
+    except FileUpload.DoesNotExist:
+        return Response(status=status.HTTP_404_NOT_FOUND)
 
-        file = FileUpload.objects.get(id=file_id)
+    upload = file.upload
 
-        try:
+    if not is_upload_validator_or_uploader(request.user, upload):
+        return Response(status=status.HTTP_401_UNAUTHORIZED)
 
-            upload = Upload.objects.get(id=file.upload.id)
+    # the payload is checked before the write lock is taken
+    try:
+        values = metadata_values(json.loads(request.body))
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            if is_upload_validator_or_uploader(request.user, upload):
+    with immediate_atomic():
+        if upload.same_meta_for_each_file:
+            upsert_metadata_values(list(upload.files.all()), values)
+        else:
+            upsert_metadata_values([file], values)
+        create_validations(request.user, upload)
 
-                data = json.loads(request.body)
+    serializer = FileUploadSerializer(file)
+    return Response(serializer.data)
 
-                if upload.same_meta_for_each_file:
-                    for f in upload.files.all():
-                        for d in data:
-                            try:
-                                
-                                m = MetadataValue.objects.get(key=d["key"], file=f)
-                                if m.value != d["value"]:
-                                    m.value = d["value"]
-                                    m.save()
-                            except MetadataValue.DoesNotExist:
-                                m = MetadataValue()
-                                m.file = f
-                                m.key = d["key"]
-                                m.value = d["value"]
-                                m.save()
+@query_budget(12)
+@api_view(['PUT'])
+def files_metadata(request):
+    """
+    Same as file_metadata for many files at once:
+    {"files": [<file id>, ...], "values": [{"key": ..., "value": ...}, ...]}
+    """
+    try:
+        data = json.loads(request.body)
+        file_ids = [int(id) for id in data["files"]]
+    except (KeyError, TypeError, ValueError):
+        return Response({"detail": 'expected {"files": [<file id>, ...], "values": [...]}'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        values = metadata_values(data["values"])
+    except (KeyError, ValueError) as e:
+        return Response({"detail": str(e) if isinstance(e, ValueError) else "values are missing"}, status=status.HTTP_400_BAD_REQUEST)
 
-                else:
-                    for d in data:
-                        try:
-                            m = MetadataValue.objects.get(key=d["key"], file=file)
-                            if m.value != d["value"]:
-                                m.value = d["value"]
-                                m.save()
-                        except MetadataValue.DoesNotExist:
-                            m = MetadataValue()
-                            m.file = file
-                            m.key = d["key"]
-                            m.value = d["value"]
-                            m.save()
-
-                """
-                Create a validation if the user is an uploader
-                """
-                if hasattr(request.user, "custom"):
-
-                    # check if the upload already has a validation
-                    has_validation_already = upload.validations.count() > 0
-
-                    if not has_validation_already:
-
-                        groups = set()
-
-                        workflows = request.user.custom.pipeline.workflows.all()
-
-                        if not has_validation_already:
-
-                            for workflow in workflows:
-                                validator_groups = Group.objects.filter(workflow=workflow)
-                                for group in validator_groups:
-                                    groups.add(group)
-                                    
-                            # Create validations
-                            for group in groups:
-                                validation = UploadValidation()
-                                validation.upload = upload
-                                validation.group = group
-                                validation.workflow = workflows[0]
-                                validation.save()
-
-
-                serializer = FileUploadSerializer(file)
-                return Response(serializer.data)
-            
-            else:
-                return Response(status=status.HTTP_401_UNAUTHORIZED)
+    files = list(FileUpload.objects.select_related('upload').filter(id__in=file_ids).order_by('id'))
+    if len(files) != len(set(file_ids)):
+        return Response(status=status.HTTP_404_NOT_FOUND)
+
+    uploads = {f.upload_id: f.upload for f in files}
+    for upload in uploads.values():
+        if not is_upload_validator_or_uploader(request.user, upload):
+            return Response(status=status.HTTP_401_UNAUTHORIZED)
+
+    with immediate_atomic():
+        upsert_metadata_values(files, values)
+        for upload in uploads.values():
+            create_validations(request.user, upload)
+
+    serializer = FileUploadSerializer(FileUpload.objects.filter(id__in=file_ids).order_by('id').prefetch_related('values'), many=True)
+    return Response(serializer.data)
+
+@query_budget(4)
+@api_view(['GET'])
+@permission_classes([CanAutomate])
+def metrics_view(request):
+    """
+    Metrics in the Prometheus text format, see metrics.py
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
 
-        except Upload.DoesNotExist:
-            return Response(status=status.HTTP_404_NOT_FOUND)
-            
-    except FileUpload.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
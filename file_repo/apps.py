@@ -23,3 +23,28 @@ class FileRepoConfig(AppConfig):
     DEFAULT_SIZE_LIMIT_IN_BYTE = 209715200 # 200MB
     LANGUAGE_ACCEPTED = ["fr", "de"]
     VALIDATION_ITEMS_PER_PAGE = 10
+    # resumable uploads, size of the parts sent by the client
+    CHUNKED_UPLOAD_PART_SIZE_IN_BYTE = 8388608 # 8MB
+    CHUNKED_UPLOAD_MAX_PART_SIZE_IN_BYTE = 67108864 # 64MB
+    # files created by one request on /api/file/batch/, and inserted by one query
+    BATCH_UPLOAD_MAX_FILES = 1000
+    BATCH_UPLOAD_INSERT_SIZE = 200
+    # first bytes of a file given to libmagic, the Office formats need about 4KB
+    MIME_SNIFF_SIZE_IN_BYTE = 8192
+    # users resolved from their token, kept in memory by each process
+    TOKEN_CACHE_SIZE = 1024
+    TOKEN_CACHE_TIMEOUT_IN_SECOND = 300
+    # user import, rows imported in one transaction
+    USER_IMPORT_BATCH_SIZE = 500
+    USER_IMPORT_STALE_AFTER_IN_SECOND = 600
+    # user export, rows fetched at once from the database
+    USER_EXPORT_CHUNK_SIZE = 2000
+    # jobs run by the runworker command, a failed attempt is retried after
+    # JOB_RETRY_DELAY_IN_SECOND, doubled at each attempt
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY_IN_SECOND = 30
+    JOB_LEASE_IN_SECOND = 300
+
+    def ready(self):
+        from . import signals
+        from . import tasks
@@ -0,0 +1,155 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from collections import OrderedDict, namedtuple
+from django.contrib.auth.models import User, Group
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework import exceptions
+from django.utils.translation import gettext_lazy as _
+from .apps import FileRepoConfig
+from .cache import token_cache_version, bump_token_cache_version
+from .models import Custom, Pipeline
+from .permissions import get_roles
+from . import metrics
+import threading
+import time
+
+
+class TokenCache:
+    """
+    LRU of the CachedToken of the tokens, each entry expires
+    after a timeout or as soon as the shared token_cache_version changes
+    """
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            hit = entry is not None and entry[0] == version and entry[1] >= time.monotonic()
+            if hit:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        metrics.inc("euploader_token_cache_total", {"result": "hit" if hit else "miss"})
+        return entry[2] if hit else None
+
+    def set(self, key, cached, version):
+        evictions = 0
+        with self.lock:
+            self.entries[key] = (version, time.monotonic() + self.timeout, cached)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                evictions += 1
+            self.evictions += evictions
+        if evictions:
+            metrics.inc("euploader_token_cache_evictions_total", amount=evictions)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.entries)}
+
+
+token_cache = TokenCache(FileRepoConfig.TOKEN_CACHE_SIZE, FileRepoConfig.TOKEN_CACHE_TIMEOUT_IN_SECOND)
+
+
+# the field values of a token, its user, custom, pipeline and groups, and the roles of the user:
+# only immutable values, the model instances are built again for each request
+CachedToken = namedtuple('CachedToken', ['db', 'token', 'user', 'custom', 'pipeline', 'groups', 'roles'])
+
+def _row(instance):
+    return tuple((field.attname, getattr(instance, field.attname)) for field in instance._meta.concrete_fields)
+
+def _from_row(model, db, row):
+    return model.from_db(db, [name for name, value in row], [value for name, value in row])
+
+def _cache_token(token):
+    user = token.user
+    custom = getattr(user, 'custom', None)
+    pipeline = custom.pipeline if custom else None
+    return CachedToken(
+        token._state.db, _row(token), _row(user),
+        _row(custom) if custom else None, _row(pipeline) if pipeline else None,
+        tuple(_row(group) for group in user.groups.all()), get_roles(user))
+
+def _build_token(cached):
+    """
+    a new Token with its user, custom pipeline and groups loaded from a CachedToken
+    """
+    token = _from_row(Token, cached.db, cached.token)
+    user = _from_row(User, cached.db, cached.user)
+    token.user = user
+    if cached.custom:
+        custom = _from_row(Custom, cached.db, cached.custom)
+        custom.pipeline = _from_row(Pipeline, cached.db, cached.pipeline) if cached.pipeline else None
+        user.custom = custom
+    else:
+        # hasattr(user, 'custom') is False without a query
+        User.custom.related.set_cached_value(user, None)
+    # the same as prefetch_related('groups')
+    groups = user.groups.all()
+    groups._result_cache = [_from_row(Group, cached.db, row) for row in cached.groups]
+    groups._prefetch_done = True
+    user._prefetched_objects_cache = {'groups': groups}
+    user._roles = cached.roles
+    return token
+
+def get_token(key):
+    """
+    the Token of the key with its user, custom pipeline and groups already loaded,
+    raise Token.DoesNotExist. Each call returns new instances, which the request can modify.
+    """
+    version = token_cache_version()
+    cached = token_cache.get(key, version)
+    if cached is None:
+        token = Token.objects.select_related('user', 'user__custom__pipeline').prefetch_related('user__groups').get(key=key)
+        cached = _cache_token(token)
+        token_cache.set(key, cached, version)
+    return _build_token(cached)
+
+def invalidate_token_cache():
+    token_cache.clear()
+    bump_token_cache_version()
+
+def token_cache_stats():
+    return token_cache.stats()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication without the Token/User query on every request
+    """
+    def authenticate_credentials(self, key):
+        try:
+            token = get_token(key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        return (token.user, token)
@@ -0,0 +1,76 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.cache import cache
+from django.utils.translation import get_language
+import uuid
+
+SCHEMA_VERSION_KEY = "pipeline_schema_version"
+SCHEMA_TIMEOUT = 86400
+TOKEN_CACHE_VERSION_KEY = "token_cache_version"
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+def _bump_version(key):
+    cache.set(key, uuid.uuid4().hex, None)
+
+def schema_version():
+    """
+    changes on every save of a pipeline definition, see signals.py
+    """
+    return _version(SCHEMA_VERSION_KEY)
+
+def bump_schema_version():
+    _bump_version(SCHEMA_VERSION_KEY)
+
+def token_cache_version():
+    """
+    changes on every save of a token, a user, its groups, its Custom or a pipeline, see signals.py.
+    Shared by all the processes so each one drops its cached users.
+    """
+    return _version(TOKEN_CACHE_VERSION_KEY)
+
+def bump_token_cache_version():
+    _bump_version(TOKEN_CACHE_VERSION_KEY)
+
+def schema_etag(pipeline_id, variant):
+    return f"{pipeline_id}-{variant}-{get_language()}-{schema_version()}"
+
+def cached_allowed_mimes(pipeline_id, load):
+    """
+    the AllowedFileType of a pipeline, until its schema changes
+    """
+    key = f"pipeline_mimes:{pipeline_id}-{schema_version()}"
+    mimes = cache.get(key)
+    if mimes is None:
+        mimes = load()
+        cache.set(key, mimes, SCHEMA_TIMEOUT)
+    return mimes
+
+def cached_schema(etag, render):
+    """
+    the rendered schema of a pipeline for an etag given by schema_etag
+    """
+    key = f"pipeline_schema:{etag}"
+    data = cache.get(key)
+    if data is None:
+        data = render()
+        cache.set(key, data, SCHEMA_TIMEOUT)
+    return data
@@ -0,0 +1,35 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from contextlib import contextmanager
+from django.db import transaction
+
+
+@contextmanager
+def immediate_atomic(using=None):
+    """
+    transaction.atomic() starting with BEGIN IMMEDIATE on the eUploader.sqlite3 backend:
+    the write lock is taken at the start, waiting for the other writers, instead of
+    failing with "database is locked" when a read transaction tries to write.
+    Nested in another atomic block it is a savepoint like transaction.atomic().
+    """
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block and hasattr(connection, 'begin_immediate'):
+        connection.begin_immediate = True
+    try:
+        with transaction.atomic(using):
+            yield
+    finally:
+        if hasattr(connection, 'begin_immediate'):
+            connection.begin_immediate = False
@@ -93,10 +93,10 @@ class FileUploadSerializer(FlexFieldsModelSerializer):
     values = MetadataValueSerializer(many=True, read_only=True)
     class Meta:
         model = FileUpload
-        fields = ['id', 'upload', 'checksum', 'uploaded_file', 'name', 'type', 'values']
+        fields = ['id', 'upload', 'checksum', 'uploaded_file', 'name', 'type', 'detected_type', 'values']
     
     def get_size(self, obj):
-        return obj.uploaded_file.size if hasattr(obj, "uploaded_file") else None
+        return obj.size
 
 class UploadSerializer(FlexFieldsModelSerializer):
     files = FileUploadSerializer(many=True, read_only=True)
@@ -141,7 +141,8 @@ class UploadValidationForListSerializer(FlexFieldsModelSerializer):
 
     same_upload_validations = serializers.SerializerMethodField()
     def get_same_upload_validations(self, obj):
-        validations = UploadValidation.objects.filter(upload=obj.upload.id).exclude(id=obj.id)
+        # prefetched by UploadValidationViewSet
+        validations = [v for v in obj.upload.validations.all() if v.id != obj.id]
         serializer = OtherUploadValidationForListSerializer(validations, many=True)
         return serializer.data
     
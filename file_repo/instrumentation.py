@@ -0,0 +1,93 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.db import connection
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper counting the queries and their total time
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+def query_budget(budget):
+    """
+    Maximum number of SQL queries of a function view, above the @api_view decorator.
+    The class based views declare a query_budget attribute, an int or a dict by action:
+    query_budget = {'list': 4, 'retrieve': 3}
+    """
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+def get_query_budget(view_func, method):
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(getattr(view_func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        # ViewSet.as_view() maps the http methods to the actions
+        action = getattr(view_func, 'actions', {}).get(method.lower())
+        budget = budget.get(action)
+    return budget
+
+
+class QueryCountMiddleware:
+    """
+    Count the SQL queries of each request and compare them to the query budget of the view.
+    The counters are set on the response (query_count, sql_time, query_budget) for the tests
+    and sent as X-Query-Count, X-SQL-Time and X-Query-Budget headers when QUERY_COUNT_HEADERS is set.
+    The queries run while a streaming response is sent are not counted.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        request.query_budget = None
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        response.query_count = counter.count
+        response.sql_time = counter.time
+        response.query_budget = request.query_budget
+
+        if settings.QUERY_COUNT_HEADERS:
+            response['X-Query-Count'] = counter.count
+            response['X-SQL-Time'] = f"{counter.time * 1000:.1f}ms"
+            if request.query_budget is not None:
+                response['X-Query-Budget'] = request.query_budget
+
+        if request.query_budget is not None and counter.count > request.query_budget:
+            logger.warning(f"{request.method} {request.path}: {counter.count} queries, the budget is {request.query_budget}")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func, request.method)
@@ -0,0 +1,107 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+Jobs stored in the database and run by the runworker command, without any other service.
+A task is a function registered with @task (see tasks.py), enqueue() adds a Job with its
+keyword arguments (JSON). A worker claims the due jobs with a lease of JOB_LEASE_IN_SECOND
+which it renews while they run, so the jobs of a worker which died are claimed again once
+their lease expired. A failed attempt is retried with an exponential backoff.
+"""
+
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+from .apps import FileRepoConfig
+from .db import immediate_atomic
+from .models import Job
+import datetime
+import logging
+import traceback
+
+logger = logging.getLogger(__name__)
+
+# name: (function, max attempts)
+TASKS = {}
+
+
+def task(name=None, max_attempts=FileRepoConfig.JOB_MAX_ATTEMPTS):
+    def decorator(func):
+        TASKS[name or func.__name__] = (func, max_attempts)
+        return func
+    return decorator
+
+def enqueue(name, user=None, **kwargs):
+    """
+    queue a job of a task, the worker sees it once the transaction is committed
+    """
+    if name not in TASKS:
+        raise KeyError(f"unknown task {name}")
+    return Job.objects.create(name=name, kwargs=kwargs, user=user, max_attempts=TASKS[name][1])
+
+def lease_end():
+    return timezone.now() + datetime.timedelta(seconds=FileRepoConfig.JOB_LEASE_IN_SECOND)
+
+def claim(worker, limit):
+    """
+    take up to limit jobs which are due or whose lease expired, return their ids
+    """
+    now = timezone.now()
+    # BEGIN IMMEDIATE, two workers can't claim the same job
+    with immediate_atomic():
+        ids = list(Job.objects.filter(Q(status=Job.Status.QUEUED, run_after__lte=now) | Q(status=Job.Status.RUNNING, lease_until__lt=now))
+                   .order_by('run_after', 'id').values_list('id', flat=True)[:limit])
+        if ids:
+            Job.objects.filter(id__in=ids).update(status=Job.Status.RUNNING, worker=worker, lease_until=lease_end(), attempts=F('attempts') + 1, started_at=now)
+    return ids
+
+def renew_leases(ids, worker):
+    Job.objects.filter(id__in=ids, worker=worker, status=Job.Status.RUNNING).update(lease_until=lease_end())
+
+def run_job(job_id):
+    """
+    run one attempt of a claimed job and store its result, its error or its next attempt
+    """
+    job = Job.objects.get(id=job_id)
+    # the job can have been claimed again by another worker meanwhile
+    attempt = Job.objects.filter(id=job.id, worker=job.worker, attempts=job.attempts, status=Job.Status.RUNNING)
+
+    if job.attempts > job.max_attempts:
+        attempt.update(status=Job.Status.FAILED, error=f"{job.error or ''}\nthe worker stopped during the last attempt".strip(), lease_until=None, finished_at=timezone.now())
+        return
+
+    try:
+        if job.name not in TASKS:
+            raise KeyError(f"unknown task {job.name}")
+        result = TASKS[job.name][0](**job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = FileRepoConfig.JOB_RETRY_DELAY_IN_SECOND * 2 ** (job.attempts - 1)
+            logger.warning(f"job {job.id} {job.name} failed, attempt {job.attempts}/{job.max_attempts}, retried in {delay}s\n{error}")
+            attempt.update(status=Job.Status.QUEUED, run_after=timezone.now() + datetime.timedelta(seconds=delay), lease_until=None, error=error)
+        else:
+            logger.error(f"job {job.id} {job.name} failed\n{error}")
+            attempt.update(status=Job.Status.FAILED, lease_until=None, error=error, finished_at=timezone.now())
+    else:
+        attempt.update(status=Job.Status.DONE, lease_until=None, result=result, finished_at=timezone.now())
+
+def execute_job(job_id):
+    """
+    run_job in a thread or a process of the runworker pool
+    """
+    try:
+        run_job(job_id)
+    finally:
+        connection.close()
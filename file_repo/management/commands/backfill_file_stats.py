@@ -0,0 +1,53 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from file_repo.models import FileUpload
+import datetime
+import os
+
+BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = "Store the size and modification time of the files uploaded before they were recorded"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="refresh every file, not only the ones without size")
+
+    def handle(self, *args, **options):
+        files = FileUpload.objects.all() if options['all'] else FileUpload.objects.filter(size__isnull=True)
+        updated = 0
+        missing = 0
+        batch = []
+
+        for file in files.only('id', 'uploaded_file').iterator(chunk_size=BATCH_SIZE):
+            try:
+                stat = os.stat(file.uploaded_file.path)
+            except FileNotFoundError:
+                missing += 1
+                self.stderr.write(f"missing file {file.uploaded_file.name}")
+                continue
+            file.size = stat.st_size
+            file.modified_at = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
+            batch.append(file)
+            if len(batch) >= BATCH_SIZE:
+                FileUpload.objects.bulk_update(batch, ['size', 'modified_at'])
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            FileUpload.objects.bulk_update(batch, ['size', 'modified_at'])
+            updated += len(batch)
+
+        self.stdout.write(f"{updated} files updated, {missing} missing")
@@ -0,0 +1,229 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings, CaptureQueriesContext
+from django.urls import reverse
+from django.core.files.uploadedfile import SimpleUploadedFile
+from rest_framework.test import APIClient
+from file_repo import urls as file_repo_urls
+from file_repo.models import Upload, UploadValidation, Note
+from .generate_dataset import PREFIX
+import datetime
+import django
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+
+# (url name, method, url kwargs, user, data) the url kwargs and the user are names of the fixtures, see get_fixtures
+ENDPOINTS = [
+    ("export_users", "get", {}, "admin", None),
+    ("export_users?file_type=xlsx", "get", {}, "admin", None),
+    ("pipeline-list", "get", {}, "validator", None),
+    ("pipeline-detail", "get", {"pk": "pipeline"}, "uploader", None),
+    ("pipeline-minimal-list", "get", {}, "uploader", None),
+    ("pipeline-minimal-detail", "get", {"pk": "pipeline"}, "uploader", None),
+    ("upload-list", "get", {}, "uploader", None),
+    ("upload-list", "post", {}, "uploader", {}),
+    ("upload-detail", "get", {"pk": "upload"}, "uploader", None),
+    ("file-list", "get", {}, "uploader", None),
+    ("file-list", "post", {}, "uploader", "file"),
+    ("file-detail", "get", {"pk": "file"}, "uploader", None),
+    ("file-batch", "post", {}, "uploader", "batch"),
+    ("file-session-list", "post", {}, "uploader", "session"),
+    ("note-list", "get", {}, "validator", None),
+    ("note-list", "post", {}, "validator", "note"),
+    ("note-detail", "get", {"pk": "note"}, "validator", None),
+    ("upload-validation-list", "get", {}, "validator", None),
+    ("upload-validation-list?expand=upload,workflow,group", "get", {}, "validator", None),
+    ("upload-validation-detail", "patch", {"pk": "validation"}, "validator", "validation"),
+    ("pipeline-uploads", "get", {"pipeline_id": "pipeline"}, "uploader", None),
+    ("pipeline-uploads", "get", {"pipeline_id": "pipeline"}, "automation", None),
+    ("pipeline-uploads?cursor=", "get", {"pipeline_id": "pipeline"}, "automation", None),
+    ("user-by-token", "get", {"token": "token"}, "uploader", None),
+    ("file-metadata", "put", {"file_id": "file"}, "uploader", "metadata"),
+    ("files-metadata", "put", {}, "uploader", "files_metadata"),
+    ("download-file", "get", {"id": "file"}, "uploader", None),
+    ("api_token_auth", "post", {}, None, "credentials"),
+    ("validated-upload", "get", {"pipeline_id": "pipeline"}, "automation", None),
+    ("validated-upload?cursor=", "get", {"pipeline_id": "pipeline"}, "automation", None),
+    ("metrics", "get", {}, "automation", None),
+]
+
+# files sent by the file-batch request
+BATCH_FILES = 50
+
+# not timed, with the reason written in the report
+SKIPPED = {
+    "import_users": "starts the background import of the spreadsheets of a server directory",
+    "import_users_status": "needs an import started by import_users",
+    "job_file": "needs an archive written by a job",
+    "file-session-detail": "a session is created by file-session-list",
+    "file-session-part": "needs a session in progress",
+    "file-session-finalize": "needs a session with all its parts",
+    "api-root": "static",
+}
+
+
+class Command(BaseCommand):
+    help = ("Time every endpoint of file_repo/urls.py with its number of SQL queries, on a temporary database "
+            "filled by generate_dataset at each scale, and write the results in a JSON report")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default="1000,10000,100000", help="numbers of uploads, comma separated")
+        parser.add_argument('--repeat', type=int, default=5, help="timed requests per endpoint")
+        parser.add_argument('--output', default=f"benchmark-{datetime.date.today()}.json")
+
+    def handle(self, *args, **options):
+        scales = sorted(int(scale) for scale in options['scales'].split(','))
+        work_dir = tempfile.mkdtemp(prefix="eUploader_benchmark_")
+        report = {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "repeat": options['repeat'],
+            "skipped": SKIPPED,
+            "not_benchmarked": self.not_benchmarked(),
+            "scales": {},
+        }
+        if report["not_benchmarked"]:
+            self.stderr.write(f"endpoints without benchmark: {', '.join(report['not_benchmarked'])}")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(
+                    MEDIA_ROOT=os.path.join(work_dir, "media"),
+                    CHUNKED_UPLOAD_DIR=os.path.join(work_dir, "chunks"),
+                    INGEST_TEMP_DIR=os.path.join(work_dir, "media", "incoming"),
+                    METRICS_DB=os.path.join(work_dir, "metrics.sqlite3"),
+                    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+                for scale in scales:
+                    started = time.perf_counter()
+                    call_command('generate_dataset', uploads=scale - Upload.objects.count(), stdout=open(os.devnull, 'w'))
+                    generated_in = time.perf_counter() - started
+                    self.stdout.write(f"{scale} uploads generated in {generated_in:.1f}s")
+
+                    results = self.run_endpoints(self.get_fixtures(), options['repeat'])
+                    report["scales"][scale] = {"generated_in": round(generated_in, 3), "endpoints": results}
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"report written in {options['output']}")
+
+    def not_benchmarked(self):
+        names = {pattern.name for pattern in file_repo_urls.urlpatterns + file_repo_urls.router.urls if getattr(pattern, 'name', None)}
+        timed = {endpoint[0].split('?')[0] for endpoint in ENDPOINTS}
+        return sorted(names - timed - set(SKIPPED))
+
+    def get_fixtures(self):
+        """
+        the objects used in the urls and the requests: an uploader with its last upload,
+        a validator of its pipeline, an automation user and an admin
+        """
+        upload = Upload.objects.filter(user__username__startswith=f"{PREFIX}_uploader_", status=Upload.Status.COMPLETED).select_related('user').order_by('-id').first()
+        uploader = upload.user
+        file = upload.files.order_by('id').first()
+        # the files added to the upload by the benchmark are not scanned, the validations of their upload are hidden
+        validation = UploadValidation.objects.filter(upload__pipeline=upload.pipeline_id).exclude(upload=upload).order_by('-id').first()
+        return {
+            "uploader": uploader,
+            "validator": User.objects.get(username=f"{PREFIX}_validator_{upload.pipeline_id}"),
+            "automation": User.objects.get(username=f"{PREFIX}_automation"),
+            "admin": User.objects.get(username=f"{PREFIX}_admin"),
+            "pipeline": upload.pipeline_id,
+            "upload": upload.id,
+            "file": file.id,
+            "validation": validation.id,
+            "note": Note.objects.order_by('-id').first().id,
+            "token": uploader.auth_token.key,
+            "data": {
+                "file": lambda: {"upload": upload.id, "uploaded_file": SimpleUploadedFile("benchmark.txt", b"benchmark"), "type": "text/plain"},
+                "batch": lambda: {"upload": upload.id, "uploaded_file": [SimpleUploadedFile(f"benchmark_{i}.xml", b"<benchmark/>") for i in range(BATCH_FILES)], "type": "text/xml"},
+                "session": lambda: {"upload": upload.id, "filename": "benchmark.bin", "size": 1024},
+                "note": lambda: {"upload": upload.id, "note": "benchmark", "user": "benchmark"},
+                "validation": lambda: {"state": validation.state},
+                "metadata": lambda: [{"key": "field_0", "value": "benchmark"}],
+                "files_metadata": lambda: {"files": list(upload.files.values_list('id', flat=True)), "values": [{"key": "field_0", "value": "benchmark"}]},
+                "credentials": lambda: {"username": f"{PREFIX}_admin", "password": PREFIX},
+            },
+        }
+
+    def run_endpoints(self, fixtures, repeat):
+        results = {}
+        for endpoint in ENDPOINTS:
+            key, request = endpoint_request(endpoint, fixtures)
+
+            # the first request warms up the caches
+            response = request()
+            durations = []
+            for i in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = request()
+                    durations.append(time.perf_counter() - started)
+
+            results[key] = {
+                "status": response.status_code,
+                "queries": len(queries),
+                "query_budget": response.query_budget,
+                "sql_time": round(sum(float(query["time"]) for query in queries.captured_queries), 6),
+                "median": round(statistics.median(durations), 6),
+                "max": round(max(durations), 6),
+            }
+            self.stdout.write(f"{key}: {results[key]['median'] * 1000:.1f}ms, {results[key]['queries']} queries (budget {response.query_budget})")
+        return results
+
+
+def endpoint_request(endpoint, fixtures):
+    """
+    the name of an endpoint of ENDPOINTS in the report and a function sending its request
+    """
+    name, method, kwargs, user, data = endpoint
+    url_name, _, query = name.partition('?')
+    url = reverse(f"file_repo:{url_name}", kwargs={key: fixtures[value] for key, value in kwargs.items()})
+    if query:
+        url = f"{url}?{query}"
+
+    client = APIClient()
+    if user:
+        client.force_authenticate(fixtures[user])
+    if method == "get":
+        send = lambda: client.get(url)
+    else:
+        make_data = fixtures["data"][data] if isinstance(data, str) else (lambda: data)
+        send = lambda: getattr(client, method)(url, make_data(), format="multipart" if data in ("file", "batch") else "json")
+
+    def request():
+        response = send()
+        # the streamed responses are produced while they are read
+        if response.streaming:
+            for chunk in response.streaming_content:
+                pass
+        return response
+
+    key = f"{method.upper()} {name} ({user})" if user else f"{method.upper()} {name}"
+    return key, request
+
@@ -0,0 +1,56 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from file_repo.models import FileUpload
+from file_repo.storage import file_sha256, link_to_blob
+import os
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ("Move the files stored before CONTENT_ADDRESSED_STORAGE to the content addressed storage: "
+            "the identical files become hardlinks of one blob")
+
+    def handle(self, *args, **options):
+        linked = 0
+        saved = 0
+        missing = 0
+        hashed = []
+
+        for file in FileUpload.objects.only('id', 'uploaded_file', 'sha256').iterator(chunk_size=BATCH_SIZE):
+            path = file.uploaded_file.path
+            if not os.path.exists(path):
+                missing += 1
+                self.stderr.write(f"missing file {file.uploaded_file.name}")
+                continue
+
+            if not file.sha256:
+                with open(path, 'rb') as f:
+                    file.sha256 = file_sha256(f)
+                hashed.append(file)
+                if len(hashed) >= BATCH_SIZE:
+                    FileUpload.objects.bulk_update(hashed, ['sha256'])
+                    hashed = []
+
+            size = os.path.getsize(path)
+            if link_to_blob(path, file.sha256):
+                linked += 1
+                saved += size
+
+        if hashed:
+            FileUpload.objects.bulk_update(hashed, ['sha256'])
+
+        self.stdout.write(f"{linked} files replaced by a link, {saved} bytes saved, {missing} missing")
@@ -0,0 +1,43 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+import os
+
+
+class Command(BaseCommand):
+    help = "Remove the blobs of the content addressed storage which are not linked by any file anymore"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="only list the blobs to remove")
+
+    def handle(self, *args, **options):
+        removed = 0
+        freed = 0
+        for directory, _, names in os.walk(settings.CONTENT_ADDRESSED_STORAGE_DIR):
+            for name in names:
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                # the blob is the only link left to its content
+                if stat.st_nlink > 1:
+                    continue
+                if options['dry_run']:
+                    self.stdout.write(path)
+                else:
+                    os.remove(path)
+                removed += 1
+                freed += stat.st_size
+
+        self.stdout.write(f"{removed} blobs {'to remove' if options['dry_run'] else 'removed'}, {freed} bytes")
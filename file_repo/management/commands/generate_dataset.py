@@ -0,0 +1,181 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.contrib.auth.models import User, Group
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from file_repo.db import immediate_atomic
+from file_repo.models import Pipeline, Custom, AllowedFileType, MetadataFormsField, FieldOption, Workflow, Upload, FileUpload, MetadataValue, UploadValidation, Note
+import binascii
+import hashlib
+import os
+import random
+
+BATCH_SIZE = 1000
+PREFIX = "dataset"
+SAMPLE_FILE = f"{PREFIX}/sample.bin"
+SAMPLE_SIZE = 65536
+
+FIELD_TYPES = [MetadataFormsField.Type.TEXT, MetadataFormsField.Type.SELECT, MetadataFormsField.Type.DATE, MetadataFormsField.Type.TEXT_AREA, MetadataFormsField.Type.NUMBER]
+MIMES = ["application/pdf", "image/jpeg", "image/tiff", "text/plain"]
+
+
+class Command(BaseCommand):
+    help = ("Add synthetic data to the database: pipelines with their fields, options and workflow, "
+            "uploaders, validators and uploads with their files, metadata values and validations. "
+            "The pipelines and users are reused when the command runs again, only the uploads are added.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uploads', type=int, required=True, help="number of uploads to add")
+        parser.add_argument('--pipelines', type=int, default=5)
+        parser.add_argument('--uploaders', type=int, default=200)
+        parser.add_argument('--fields', type=int, default=8, help="metadata fields per pipeline")
+        parser.add_argument('--options', type=int, default=10, help="options per SELECT field")
+        parser.add_argument('--files', type=int, default=3, help="maximum number of files per upload")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'] + Upload.objects.count())
+
+        sample = self.create_sample_file()
+        pipelines = [self.get_pipeline(i, options['fields'], options['options']) for i in range(options['pipelines'])]
+        self.pipelines = {pipeline.id: pipeline for pipeline in pipelines}
+        uploaders = [self.get_uploader(i, pipelines[i % len(pipelines)]) for i in range(options['uploaders'])]
+        self.get_role_user(f"{PREFIX}_automation", "Automation")
+        for pipeline in pipelines:
+            self.get_role_user(f"{PREFIX}_validator_{pipeline.id}", "Validator", *pipeline.validator_groups)
+        admin = self.get_role_user(f"{PREFIX}_admin")
+        if not admin.is_superuser:
+            admin.is_staff = admin.is_superuser = True
+            admin.set_password(PREFIX)
+            admin.save()
+
+        created = 0
+        while created < options['uploads']:
+            count = min(BATCH_SIZE, options['uploads'] - created)
+            self.create_uploads(count, uploaders, options['files'], sample)
+            created += count
+            self.stdout.write(f"{created}/{options['uploads']} uploads")
+
+    def create_sample_file(self):
+        """
+        one file on the disk shared by every generated FileUpload
+        """
+        path = os.path.join(settings.MEDIA_ROOT, SAMPLE_FILE)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(os.urandom(SAMPLE_SIZE))
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def get_pipeline(self, i, fields, options):
+        pipeline, created = Pipeline.objects.get_or_create(name=f"{PREFIX} pipeline {i}", defaults={"description": f"{PREFIX} pipeline {i}"})
+        if created:
+            scope = Group.objects.create(name=f"{PREFIX} scope {i}")
+            for order in range(fields):
+                field = MetadataFormsField.objects.create(
+                    pipeline=pipeline, key=f"field_{order}", label=f"Field {order}", order=order,
+                    type=FIELD_TYPES[order % len(FIELD_TYPES)], required=order < 2,
+                    scope=scope if order % 4 == 3 else None)
+                if field.type == MetadataFormsField.Type.SELECT:
+                    FieldOption.objects.bulk_create([FieldOption(form_field=field, key=f"option_{n}", value=f"Option {n}", order=n, dflt=n == 0) for n in range(options)])
+            for mime in MIMES:
+                AllowedFileType.objects.get_or_create(mime=mime)[0].pipeline.add(pipeline)
+            workflow = Workflow.objects.create(name=f"{PREFIX} workflow {i}", pipeline=pipeline)
+            workflow.validator_groups.add(
+                Group.objects.create(name=f"{PREFIX} validators {i}"),
+                Group.objects.create(name=f"{PREFIX} reviewers {i}"))
+        workflow = pipeline.workflows.first()
+        pipeline.workflow = workflow
+        pipeline.validator_groups = list(workflow.validator_groups.all())
+        pipeline.keys = list(pipeline.fields.values_list('key', flat=True))
+        return pipeline
+
+    def get_uploader(self, i, pipeline):
+        user, created = User.objects.get_or_create(username=f"{PREFIX}_uploader_{i}", defaults={"email": f"{PREFIX}_uploader_{i}@example.org"})
+        if created:
+            Custom.objects.create(user=user, pipeline=pipeline)
+            Token.objects.create(user=user)
+        user.pipeline = pipeline
+        return user
+
+    def get_role_user(self, username, *groups):
+        user, created = User.objects.get_or_create(username=username)
+        if created:
+            Token.objects.create(user=user)
+            user.groups.add(*[group if isinstance(group, Group) else Group.objects.get_or_create(name=group)[0] for group in groups])
+        return user
+
+    def create_uploads(self, count, uploaders, max_files, sample):
+        rng = self.rng
+        with immediate_atomic():
+            # the write lock is held, the rows after the last id are the ones inserted here
+            last_upload_id = Upload.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            last_file_id = FileUpload.objects.order_by('-id').values_list('id', flat=True).first() or 0
+            # bulk_create doesn't call Upload.save which gives the change sequence
+            last_change_seq = Upload.objects.order_by('-change_seq').values_list('change_seq', flat=True).first() or 0
+
+            uploads = []
+            states = []
+            for n in range(count):
+                uploader = rng.choice(uploaders)
+                status = rng.choices([Upload.Status.COMPLETED, Upload.Status.FILE_UPLOADED, Upload.Status.INIT], [90, 5, 5])[0]
+                validations = []
+                if status == Upload.Status.COMPLETED:
+                    validations = rng.choices(
+                        [UploadValidation.State.VALIDATED_OK, UploadValidation.State.NOT_VALIDATED, UploadValidation.State.VALIDATED_NOK],
+                        [70, 25, 5], k=len(uploader.pipeline.validator_groups))
+                uploads.append(Upload(user=uploader, pipeline=uploader.pipeline, status=status, validation_state=validation_state(validations), change_seq=last_change_seq + n + 1))
+                states.append(validations)
+            Upload.objects.bulk_create(uploads)
+            uploads = list(Upload.objects.filter(id__gt=last_upload_id).select_related('user').order_by('id'))
+
+            files = []
+            validations = []
+            notes = []
+            for upload, upload_states in zip(uploads, states):
+                for n in range(rng.randint(1, max_files)):
+                    files.append(FileUpload(
+                        upload=upload, uploaded_file=SAMPLE_FILE, type=rng.choice(MIMES),
+                        checksum=binascii.hexlify(rng.randbytes(16)).decode(), sha256=sample,
+                        scan_state=FileUpload.ScanState.CLEAN, size=SAMPLE_SIZE, modified_at=timezone.now()))
+                for group, state in zip(self.pipelines[upload.pipeline_id].validator_groups, upload_states):
+                    validations.append(UploadValidation(upload=upload, group=group, workflow=self.pipelines[upload.pipeline_id].workflow, state=state))
+                if rng.random() < 0.1:
+                    notes.append(Note(upload=upload, user=upload.user.username, note="checked"))
+            FileUpload.objects.bulk_create(files, batch_size=BATCH_SIZE)
+            UploadValidation.objects.bulk_create(validations, batch_size=BATCH_SIZE)
+            Note.objects.bulk_create(notes, batch_size=BATCH_SIZE)
+
+            values = []
+            for file in FileUpload.objects.filter(id__gt=last_file_id).only('id', 'upload__pipeline').select_related('upload'):
+                for key in self.pipelines[file.upload.pipeline_id].keys:
+                    values.append(MetadataValue(file_id=file.id, key=key, value=f"{key} {rng.randint(0, 10000)}"))
+            MetadataValue.objects.bulk_create(values, batch_size=BATCH_SIZE)
+
+
+def validation_state(states):
+    """
+    the Upload.validation_state of validations in these states, see signals.refresh_validation_state
+    """
+    if not states:
+        return Upload.ValidationState.NONE
+    if UploadValidation.State.VALIDATED_NOK in states:
+        return Upload.ValidationState.VALIDATED_NOK
+    if all(state == UploadValidation.State.VALIDATED_OK for state in states):
+        return Upload.ValidationState.VALIDATED_OK
+    return Upload.ValidationState.PENDING
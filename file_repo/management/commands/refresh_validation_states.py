@@ -0,0 +1,27 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from file_repo.models import Upload
+from file_repo.signals import refresh_validation_state
+
+class Command(BaseCommand):
+    help = "Compute Upload.validation_state of the existing uploads"
+
+    def handle(self, *args, **options):
+        count = 0
+        for upload_id in Upload.objects.values_list('id', flat=True).iterator():
+            refresh_validation_state(upload_id)
+            count += 1
+        self.stdout.write(f"{count} uploads refreshed")
@@ -0,0 +1,72 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from file_repo.apps import FileRepoConfig
+from file_repo.jobs import claim, renew_leases, execute_job
+import django
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Run the queued jobs (user imports, archives, backfills), run it next to uwsgi"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="number of jobs run in parallel")
+        parser.add_argument('--processes', action='store_true', help="run the jobs in a pool of processes instead of threads")
+        parser.add_argument('--interval', type=float, default=5, help="seconds between two polls when no job is due")
+        parser.add_argument('--once', action='store_true', help="run the due jobs then exit")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        workers = options['workers']
+        if options['processes']:
+            # spawned processes, they don't share the sqlite connections of this one
+            connections.close_all()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(max_workers=workers)
+
+        # future: job id
+        running = {}
+        renewed = time.monotonic()
+        with pool:
+            while True:
+                if len(running) < workers:
+                    for job_id in claim(worker, workers - len(running)):
+                        running[pool.submit(execute_job, job_id)] = job_id
+
+                if running and time.monotonic() - renewed > FileRepoConfig.JOB_LEASE_IN_SECOND / 3:
+                    renew_leases(list(running.values()), worker)
+                    renewed = time.monotonic()
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    if future.exception():
+                        # the job stays RUNNING, it is claimed again once its lease expired
+                        logger.error(f"job {job_id} not run: {future.exception()}")
@@ -0,0 +1,48 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum, Max
+from file_repo.models import ScanVerdict
+
+
+class Command(BaseCommand):
+    help = ("Report the size of the scan verdict cache and its hit ratio: the files which took the verdict "
+            "of an identical content against the contents sent to clamd, by signature version")
+
+    def handle(self, *args, **options):
+        versions = ScanVerdict.objects.values('db_version').annotate(
+            verdicts=Count('id'), hits=Sum('hits'), last_hit_at=Max('last_hit_at')).order_by('-verdicts')
+        if not versions:
+            self.stdout.write("no verdict cached")
+            return
+
+        total_verdicts = 0
+        total_hits = 0
+        for version in versions:
+            self.stdout.write(f"{version['db_version']}: {version['verdicts']} verdicts, {version['hits']} hits "
+                              f"({ratio(version['hits'], version['verdicts'])}), last hit {version['last_hit_at'] or 'never'}")
+            total_verdicts += version['verdicts']
+            total_hits += version['hits']
+
+        states = dict(ScanVerdict.objects.values_list('scan_state').annotate(Count('id')).order_by())
+        self.stdout.write(f"{total_verdicts} verdicts ({', '.join(f'{count} {state}' for state, count in sorted(states.items()))}), "
+                          f"{total_hits} hits, hit ratio {ratio(total_hits, total_verdicts)}")
+
+
+def ratio(hits, verdicts):
+    """
+    each verdict was a scan, the hits are the scans saved
+    """
+    return f"{hits / (hits + verdicts):.1%}"
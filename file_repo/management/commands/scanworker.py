@@ -0,0 +1,71 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from file_repo.models import FileUpload
+from file_repo.scanning import clamd_version, scan_files, purge_verdicts
+from file_repo import metrics
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = "Scan the pending files with clamd, run it next to uwsgi"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2, help="number of files scanned in parallel")
+        parser.add_argument('--interval', type=float, default=5, help="seconds between two polls when nothing is pending")
+        parser.add_argument('--once', action='store_true', help="scan the pending files then exit")
+
+    def handle(self, *args, **options):
+        version = None
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            while True:
+                pending = list(FileUpload.objects.filter(scan_state=FileUpload.ScanState.PENDING).order_by('id')[:options['threads'] * 10])
+
+                # asked even when nothing is pending, the new files take the verdicts of the last version
+                try:
+                    current = clamd_version()
+                except OSError as e:
+                    # clamd is down or still loading its database, the files stay pending
+                    if pending:
+                        logger.warning(f"clamd not available: {e}")
+                    pending = []
+                else:
+                    if current != version:
+                        purged = purge_verdicts(current)
+                        logger.info(f"clamd signatures {current}, {purged} verdicts of the previous versions purged")
+                        version = current
+
+                if pending:
+                    # the files with the same content are scanned once
+                    by_content = defaultdict(list)
+                    for file in pending:
+                        by_content[file.sha256 or f"file {file.id}"].append(file)
+                    list(pool.map(lambda files: self.scan(files, version), by_content.values()))
+                else:
+                    metrics.store.flush()
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+
+    def scan(self, files, version):
+        try:
+            return scan_files(files, version)
+        finally:
+            connection.close()
@@ -0,0 +1,205 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+Prometheus metrics shared by the uwsgi workers and the scanworker: each process adds
+its samples in memory and writes them at most every FLUSH_INTERVAL seconds in the
+METRICS_DB SQLite file, the metrics view reads the sum of all the processes from it.
+"""
+
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import Count
+import atexit
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 1
+
+REQUEST_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+UPLOAD_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+SCAN_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300]
+
+# name: (type, help, buckets of the histograms)
+METRICS = {
+    "euploader_ingested_bytes_total": ("counter", "Bytes of the uploaded files by pipeline", None),
+    "euploader_ingested_files_total": ("counter", "Number of uploaded files by pipeline", None),
+    "euploader_upload_duration_seconds": ("histogram", "Duration of the file upload requests by pipeline", UPLOAD_BUCKETS),
+    "euploader_download_bytes_total": ("counter", "Bytes of the downloaded files", None),
+    "euploader_request_duration_seconds": ("histogram", "Duration of the requests by view, method and status", REQUEST_BUCKETS),
+    "euploader_scan_duration_seconds": ("histogram", "Duration of the clamd scans by result", SCAN_BUCKETS),
+    "euploader_scan_verdict_cache_total": ("counter", "Files which took the verdict of an identical content (hit) or were scanned (miss)", None),
+    "euploader_validation_backlog": ("gauge", "Number of upload validations by group and state", None),
+    "euploader_scan_pending_files": ("gauge", "Number of files waiting for the antivirus scan", None),
+    "euploader_token_cache_total": ("counter", "Authenticated requests which found their token in the cache (hit) or read it from the database (miss)", None),
+    "euploader_token_cache_evictions_total": ("counter", "Tokens dropped from a full token cache", None),
+    "euploader_token_cache_entries": ("gauge", "Number of tokens in the token cache of the process which answered the scrape", None),
+}
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class MetricsStore:
+
+    def __init__(self):
+        # (sample name, labels) -> value added since the last flush
+        self.pending = defaultdict(float)
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, labels=None, amount=1):
+        with self.lock:
+            self.pending[(name, _labels(labels or {}))] += amount
+        self.flush_if_due()
+
+    def observe(self, name, labels, value):
+        labels = _labels(labels or {})
+        with self.lock:
+            for bound in METRICS[name][2] + [math.inf]:
+                if value <= bound:
+                    # le is the last label, see _sort_key
+                    le = 'le="+Inf"' if bound == math.inf else f'le="{bound}"'
+                    self.pending[(f"{name}_bucket", f"{labels},{le}" if labels else le)] += 1
+            self.pending[(f"{name}_sum", labels)] += value
+            self.pending[(f"{name}_count", labels)] += 1
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if time.monotonic() - self.last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def connect(self):
+        db = sqlite3.connect(settings.METRICS_DB, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode = WAL")
+        # the metrics don't have to survive a power loss
+        db.execute("PRAGMA synchronous = OFF")
+        db.execute("CREATE TABLE IF NOT EXISTS sample (name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (name, labels))")
+        return db
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(float)
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            db = self.connect()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                db.executemany(
+                    "INSERT INTO sample (name, labels, value) VALUES (?, ?, ?) ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value",
+                    [(name, labels, value) for (name, labels), value in pending.items()])
+                db.execute("COMMIT")
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            # the metrics must never break a request
+            logger.warning(f"metrics not written: {e}")
+
+    def samples(self):
+        self.flush()
+        db = self.connect()
+        try:
+            return db.execute("SELECT name, labels, value FROM sample").fetchall()
+        finally:
+            db.close()
+
+
+store = MetricsStore()
+atexit.register(store.flush)
+
+def inc(name, labels=None, amount=1):
+    store.inc(name, labels, amount)
+
+def observe(name, labels, value):
+    store.observe(name, labels, value)
+
+
+def record_ingest(file, duration=None):
+    """
+    a FileUpload received, duration is the time of the upload request
+    """
+    labels = {"pipeline": file.upload.pipeline_id}
+    inc("euploader_ingested_files_total", labels)
+    inc("euploader_ingested_bytes_total", labels, file.size or 0)
+    if duration is not None:
+        observe("euploader_upload_duration_seconds", labels, duration)
+
+
+def gauges():
+    """
+    the gauges read from the database when the metrics are scraped
+    """
+    from .models import UploadValidation, FileUpload
+    from .authentication import token_cache_stats
+    samples = []
+    for row in UploadValidation.objects.values('group__name', 'state').annotate(count=Count('id')).order_by():
+        samples.append(("euploader_validation_backlog", _labels({"group": row['group__name'], "state": row['state']}), row['count']))
+    pending = FileUpload.objects.filter(scan_state=FileUpload.ScanState.PENDING).count()
+    samples.append(("euploader_scan_pending_files", "", pending))
+    samples.append(("euploader_token_cache_entries", _labels({"pid": os.getpid()}), token_cache_stats()["size"]))
+    return samples
+
+def render():
+    """
+    the metrics in the Prometheus text format
+    """
+    by_metric = defaultdict(list)
+    for name, labels, value in store.samples() + gauges():
+        metric = next((m for m in METRICS if name == m or (name.startswith(m) and name[len(m):] in ("_bucket", "_sum", "_count"))), None)
+        if metric:
+            by_metric[metric].append((name, labels, value))
+
+    lines = []
+    for metric, (metric_type, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for name, labels, value in sorted(by_metric[metric], key=_sort_key):
+            value = int(value) if float(value).is_integer() else value
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+def _sort_key(sample):
+    # the buckets of a histogram in the order of their bound
+    name, labels, value = sample
+    other, _, le = labels.partition('le="')
+    bound = math.inf if le.startswith("+Inf") else float(le.split('"')[0]) if le else 0
+    return (other, name, bound)
+
+
+class MetricsMiddleware:
+    """
+    duration of each request by view name, method and status
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else "unmatched"
+        observe("euploader_request_duration_seconds", {"view": view, "method": request.method, "status": response.status_code}, time.perf_counter() - started)
+        return response
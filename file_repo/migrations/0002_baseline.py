@@ -0,0 +1,123 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class AddAuthField(migrations.AddField):
+    """
+    AddField on a model of django.contrib.auth: Group.description is added by
+    models.py with add_to_class, so its migration can't live in the auth app
+    """
+    def state_forwards(self, app_label, state):
+        super().state_forwards('auth', state)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        super().database_forwards('auth', schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        super().database_backwards('auth', schema_editor, from_state, to_state)
+
+    def references_model(self, name, app_label):
+        return super().references_model(name, 'auth')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('file_repo', '0001_initial'),
+    ]
+
+    operations = [
+        AddAuthField(
+            model_name='group',
+            name='description',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.RemoveField(
+            model_name='validatorgroup',
+            name='group',
+        ),
+        migrations.AddField(
+            model_name='pipeline',
+            name='can_edit_same_metadata_for_each_file',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='pipeline',
+            name='default_same_metadata_for_each_file',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='upload',
+            name='pipeline',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='file_repo.pipeline'),
+        ),
+        migrations.AlterField(
+            model_name='custom',
+            name='pipeline',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='file_repo.pipeline'),
+        ),
+        migrations.AlterField(
+            model_name='custom',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='metadataformsfield',
+            name='label',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='metadataformsfield',
+            name='label_de',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='metadataformsfield',
+            name='label_fr',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='upload',
+            name='same_meta_for_each_file',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='upload',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='uploadvalidation',
+            name='group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='auth.group'),
+        ),
+        migrations.AlterField(
+            model_name='workflow',
+            name='validator_groups',
+            field=models.ManyToManyField(to='auth.Group'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='fieldoption',
+            unique_together=set(),
+        ),
+        migrations.AlterUniqueTogether(
+            name='metadataformsfield',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='fieldoption',
+            constraint=models.UniqueConstraint(fields=('form_field', 'key'), name='key_per_form_field'),
+        ),
+        migrations.AddConstraint(
+            model_name='metadataformsfield',
+            constraint=models.UniqueConstraint(fields=('key', 'pipeline'), name='key_per_pipeline'),
+        ),
+        migrations.DeleteModel(
+            name='ValidatorGroup',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0002_baseline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileUploadSession',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.BigIntegerField()),
+                ('part_size', models.IntegerField(default=8388608)),
+                ('checksum', models.CharField(blank=True, max_length=255, null=True)),
+                ('type', models.CharField(blank=True, max_length=255, null=True, verbose_name='file type from frontend')),
+                ('status', models.CharField(choices=[('OPEN', 'OPEN'), ('ASSEMBLING', 'ASSEMBLING'), ('COMPLETED', 'COMPLETED'), ('ABORTED', 'ABORTED')], default='OPEN', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='file_repo.fileupload')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sessions', to='file_repo.upload')),
+            ],
+        ),
+    ]
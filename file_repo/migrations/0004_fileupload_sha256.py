@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0003_fileuploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True, verbose_name='SHA-256 computed by the server'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0004_fileupload_sha256'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='scan_db_version',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='clamd signature version'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='scan_result',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='signature found or scan error'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='scan_state',
+            field=models.CharField(choices=[('PENDING', 'PENDING'), ('CLEAN', 'CLEAN'), ('INFECTED', 'INFECTED'), ('ERROR', 'ERROR')], db_index=True, default='PENDING', max_length=8),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='scanned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0005_fileupload_scan_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='validation_state',
+            field=models.CharField(choices=[('NONE', 'NONE'), ('PENDING', 'PENDING'), ('VALIDATED_OK', 'VALIDATED_OK'), ('VALIDATED_NOK', 'VALIDATED_NOK')], default='NONE', max_length=13),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['pipeline', 'validation_state'], name='upload_pipeline_validation'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0006_upload_validation_state'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['pipeline', 'status', 'uploaded_at'], name='upload_pipeline_status_date'),
+        ),
+    ]
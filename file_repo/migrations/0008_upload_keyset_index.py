@@ -0,0 +1,25 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0007_upload_pipeline_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='upload',
+            name='upload_pipeline_validation',
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['uploaded_at'], name='upload_date'),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['pipeline', 'validation_state', 'uploaded_at'], name='upload_pipeline_validation'),
+        ),
+    ]
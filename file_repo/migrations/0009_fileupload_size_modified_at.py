@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0008_upload_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='modified_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='file modification time'),
+        ),
+        migrations.AddField(
+            model_name='fileupload',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0009_fileupload_size_modified_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScanVerdict',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64)),
+                ('db_version', models.CharField(max_length=255, verbose_name='clamd signature version')),
+                ('scan_state', models.CharField(choices=[('PENDING', 'PENDING'), ('CLEAN', 'CLEAN'), ('INFECTED', 'INFECTED'), ('ERROR', 'ERROR')], max_length=8)),
+                ('scan_result', models.CharField(blank=True, max_length=255, null=True, verbose_name='signature found')),
+                ('hits', models.IntegerField(default=0)),
+                ('scanned_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='scanverdict',
+            constraint=models.UniqueConstraint(fields=('sha256', 'db_version'), name='scan_verdict_sha256_version'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('file_repo', '0010_scanverdict'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserImport',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('PENDING', 'PENDING'), ('RUNNING', 'RUNNING'), ('COMPLETED', 'COMPLETED'), ('FAILED', 'FAILED')], default='PENDING', max_length=9)),
+                ('file', models.CharField(blank=True, max_length=255, null=True)),
+                ('rows', models.IntegerField(default=0)),
+                ('created_users', models.IntegerField(default=0)),
+                ('created_tokens', models.IntegerField(default=0)),
+                ('updated_tokens', models.IntegerField(default=0)),
+                ('errors_count', models.IntegerField(default=0)),
+                ('message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserImportError',
+            fields=[
+                ('id', models.AutoField(primary_key=True, serialize=False)),
+                ('file', models.CharField(max_length=255)),
+                ('row', models.IntegerField()),
+                ('email', models.CharField(blank=True, max_length=255, null=True)),
+                ('error', models.CharField(max_length=255)),
+                ('user_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='file_repo.userimport')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0012_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileupload',
+            name='detected_type',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='file type detected by the server'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.16 on 2026-10-18 08:01
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def number_uploads(apps, schema_editor):
+    # the existing uploads keep the order of their creation
+    apps.get_model('file_repo', 'Upload').objects.update(change_seq=F('id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('file_repo', '0013_fileupload_detected_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='upload',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(number_uploads, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['change_seq'], name='upload_change_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['pipeline', 'validation_state', 'change_seq'], name='upload_pipeline_validation_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='upload',
+            index=models.Index(fields=['pipeline', 'status', 'change_seq'], name='upload_pipeline_status_seq'),
+        ),
+    ]
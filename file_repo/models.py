@@ -13,11 +13,13 @@ If not, see <https://www.gnu.org/licenses/>.
 """
 
 from django.db import models
+from django.db.models.expressions import RawSQL
+from django.conf import settings
 from django.utils import timezone, dateformat
 from django.contrib.auth.models import User, Group
 import os
+import datetime
 from .apps import FileRepoConfig
-from django_clamd.validators import validate_file_infection
 
 Group.add_to_class('description', models.TextField(null=True, blank=True))
 
@@ -51,6 +53,13 @@ class Pipeline(models.Model):
     def __str__(self):
         return self.name
     
+def next_change_seq():
+    """
+    SQL expression of the next Upload.change_seq. It is evaluated by the statement writing it,
+    which holds the SQLite write lock, so the sequences are committed in increasing order.
+    """
+    return RawSQL(f"SELECT COALESCE(MAX(change_seq), 0) + 1 FROM {Upload._meta.db_table}", [])
+
 class Upload(models.Model):
 
     class Status(models.TextChoices):
@@ -60,6 +69,12 @@ class Upload(models.Model):
         ERROR = 'ERROR', 'ERROR'
         ABORTED = 'ABORTED', 'ABORTED'
 
+    class ValidationState(models.TextChoices):
+        NONE = 'NONE', 'NONE'
+        PENDING = 'PENDING', 'PENDING'
+        VALIDATED_OK = 'VALIDATED_OK', 'VALIDATED_OK'
+        VALIDATED_NOK = 'VALIDATED_NOK', 'VALIDATED_NOK'
+
     id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     pipeline = models.ForeignKey(Pipeline, on_delete=models.SET_NULL, null=True, blank=True)
@@ -70,24 +85,172 @@ class Upload(models.Model):
         choices=Status.choices,
         default=Status.INIT,
     )
+    # aggregate of the upload validations, kept up to date by signals.py
+    validation_state = models.CharField(
+        max_length=13,
+        choices=ValidationState.choices,
+        default=ValidationState.NONE,
+    )
+    # increases on every save of the upload, change of its validation_state or scan of its files,
+    # the keyset pagination is ordered on it so a harvester gets again the uploads which changed
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.change_seq = next_change_seq()
+        super().save(*args, **kwargs)
+        # the value is loaded again when it is read
+        del self.change_seq
 
     def __str__(self):
         return f"{self.user} {self.uploaded_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['uploaded_at'], name="upload_date"),
+            models.Index(fields=['change_seq'], name="upload_change_seq"),
+            models.Index(fields=['pipeline', 'validation_state', 'uploaded_at'], name="upload_pipeline_validation"),
+            models.Index(fields=['pipeline', 'validation_state', 'change_seq'], name="upload_pipeline_validation_seq"),
+            models.Index(fields=['pipeline', 'status', 'uploaded_at'], name="upload_pipeline_status_date"),
+            models.Index(fields=['pipeline', 'status', 'change_seq'], name="upload_pipeline_status_seq"),
+        ]
     
 class FileUpload(models.Model):
+
+    class ScanState(models.TextChoices):
+        PENDING = 'PENDING', 'PENDING'
+        CLEAN = 'CLEAN', 'CLEAN'
+        INFECTED = 'INFECTED', 'INFECTED'
+        ERROR = 'ERROR', 'ERROR'
+
     id = models.AutoField(primary_key=True)
     upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name="files")
-    uploaded_file = models.FileField(null=False, blank=False, upload_to=user_directory_path) # use this to test without antivirus
-    # uploaded_file = models.FileField(validators=[validate_file_infection], null=False, blank=False, upload_to=user_directory_path)
+    # the antivirus scan is done by the scanworker command, see scanning.py
+    uploaded_file = models.FileField(null=False, blank=False, upload_to=user_directory_path)
     checksum = models.CharField(null=True, blank=True, max_length=255)
+    sha256 = models.CharField(null=True, blank=True, max_length=64, db_index=True, verbose_name="SHA-256 computed by the server")
     type = models.CharField(null=True, blank=True, max_length=255, verbose_name="file type from frontend")
+    detected_type = models.CharField(null=True, blank=True, max_length=255, verbose_name="file type detected by the server")
+    scan_state = models.CharField(
+        max_length=8,
+        choices=ScanState.choices,
+        default=ScanState.PENDING,
+        db_index=True,
+    )
+    scan_result = models.CharField(null=True, blank=True, max_length=255, verbose_name="signature found or scan error")
+    scan_db_version = models.CharField(null=True, blank=True, max_length=255, verbose_name="clamd signature version")
+    scanned_at = models.DateTimeField(null=True, blank=True)
+    # stored when the file is written, the serializers don't stat the media volume
+    size = models.BigIntegerField(null=True, blank=True)
+    modified_at = models.DateTimeField(null=True, blank=True, verbose_name="file modification time")
     
     def name(self):
         return os.path.basename(self.uploaded_file.name)
 
+    def refresh_file_stat(self):
+        stat = os.stat(self.uploaded_file.path)
+        self.size = stat.st_size
+        self.modified_at = datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
+        FileUpload.objects.filter(id=self.id).update(size=self.size, modified_at=self.modified_at)
+
+    def save(self, *args, **kwargs):
+        new_file = self.uploaded_file and (not self.uploaded_file._committed or self.size is None)
+        super().save(*args, **kwargs)
+        if new_file:
+            self.refresh_file_stat()
+
     def __str__(self):
         return self.uploaded_file.name
 
+class ScanVerdict(models.Model):
+    """
+    Result of the clamd scan of a content for one signature version: the files with
+    the same SHA-256 take it instead of being scanned again, see scanning.py
+    """
+    id = models.AutoField(primary_key=True)
+    sha256 = models.CharField(null=False, blank=False, max_length=64)
+    db_version = models.CharField(null=False, blank=False, max_length=255, verbose_name="clamd signature version")
+    scan_state = models.CharField(max_length=8, choices=FileUpload.ScanState.choices)
+    scan_result = models.CharField(null=True, blank=True, max_length=255, verbose_name="signature found")
+    # files which got the verdict without scan
+    hits = models.IntegerField(default=0)
+    scanned_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.sha256} {self.scan_state}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['sha256', 'db_version'], name="scan_verdict_sha256_version"),
+        ]
+
+class FileUploadSession(models.Model):
+    """
+    Resumable upload of one file: the parts are PUT in any order
+    in CHUNKED_UPLOAD_DIR/<id>/ and assembled into a FileUpload on finalize
+    """
+
+    class Status(models.TextChoices):
+        OPEN = 'OPEN', 'OPEN'
+        ASSEMBLING = 'ASSEMBLING', 'ASSEMBLING'
+        COMPLETED = 'COMPLETED', 'COMPLETED'
+        ABORTED = 'ABORTED', 'ABORTED'
+
+    id = models.AutoField(primary_key=True)
+    upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name="sessions")
+    filename = models.CharField(null=False, blank=False, max_length=255)
+    size = models.BigIntegerField(null=False, blank=False)
+    part_size = models.IntegerField(default=FileRepoConfig.CHUNKED_UPLOAD_PART_SIZE_IN_BYTE)
+    checksum = models.CharField(null=True, blank=True, max_length=255)
+    type = models.CharField(null=True, blank=True, max_length=255, verbose_name="file type from frontend")
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.OPEN,
+    )
+    file = models.ForeignKey(FileUpload, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def part_count(self):
+        return max(1, -(-self.size // self.part_size))
+
+    def part_length(self, number):
+        if number < self.part_count() - 1:
+            return self.part_size
+        return self.size - self.part_size * (self.part_count() - 1)
+
+    def part_dir(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, str(self.id))
+
+    def part_path(self, number):
+        return os.path.join(self.part_dir(), f"{number:06d}.part")
+
+    def received_parts(self):
+        try:
+            names = os.listdir(self.part_dir())
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-5]) for name in names if name.endswith(".part"))
+
+    def missing_parts(self):
+        received = set(self.received_parts())
+        return [number for number in range(self.part_count()) if number not in received]
+
+    def offset(self):
+        """
+        number of bytes received without gap from the start of the file
+        """
+        received = set(self.received_parts())
+        offset = 0
+        for number in range(self.part_count()):
+            if number not in received:
+                break
+            offset += self.part_length(number)
+        return offset
+
+    def __str__(self):
+        return f"{self.upload_id} {self.filename}"
+
 # Custom user class using django base user class
 class Custom(models.Model):
     id = models.AutoField(primary_key=True)
@@ -196,3 +359,93 @@ class Note(models.Model):
 
     def __str__(self):
         return self.note
+
+class UserImport(models.Model):
+    """
+    Import of the users of the spreadsheets of USER_IMPORT_DIR, run in the background
+    by user_import.py, the rows which can't be imported are kept in UserImportError
+    """
+
+    class Status(models.TextChoices):
+        PENDING = 'PENDING', 'PENDING'
+        RUNNING = 'RUNNING', 'RUNNING'
+        COMPLETED = 'COMPLETED', 'COMPLETED'
+        FAILED = 'FAILED', 'FAILED'
+
+    id = models.AutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    status = models.CharField(
+        max_length=9,
+        choices=Status.choices,
+        default=Status.PENDING,
+    )
+    # file being read
+    file = models.CharField(null=True, blank=True, max_length=255)
+    rows = models.IntegerField(default=0)
+    created_users = models.IntegerField(default=0)
+    created_tokens = models.IntegerField(default=0)
+    updated_tokens = models.IntegerField(default=0)
+    errors_count = models.IntegerField(default=0)
+    # why a FAILED import stopped
+    message = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # set at each batch, an import without progress was stopped with its process
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.created_at} {self.status}"
+
+class UserImportError(models.Model):
+    id = models.AutoField(primary_key=True)
+    user_import = models.ForeignKey(UserImport, on_delete=models.CASCADE, related_name="errors")
+    file = models.CharField(null=False, blank=False, max_length=255)
+    # row of the spreadsheet, the header is the row 1
+    row = models.IntegerField()
+    email = models.CharField(null=True, blank=True, max_length=255)
+    error = models.CharField(null=False, blank=False, max_length=255)
+
+    def __str__(self):
+        return f"{self.file}:{self.row} {self.error}"
+
+class Job(models.Model):
+    """
+    Long operation run by the runworker command, see jobs.py: a job is QUEUED until
+    run_after, RUNNING while a worker holds its lease, then DONE or FAILED.
+    A job whose lease expired (the worker died) is taken again by another worker.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = 'QUEUED', 'QUEUED'
+        RUNNING = 'RUNNING', 'RUNNING'
+        DONE = 'DONE', 'DONE'
+        FAILED = 'FAILED', 'FAILED'
+
+    id = models.AutoField(primary_key=True)
+    # name of the task, see jobs.TASKS
+    name = models.CharField(null=False, blank=False, max_length=255)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=7,
+        choices=Status.choices,
+        default=Status.QUEUED,
+    )
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=FileRepoConfig.JOB_MAX_ATTEMPTS)
+    run_after = models.DateTimeField(default=timezone.now)
+    lease_until = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(null=True, blank=True, max_length=255)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.name} {self.status}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name="job_status_run_after"),
+        ]
@@ -0,0 +1,98 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from collections import OrderedDict
+import base64
+
+
+class KeysetPagination(BasePagination):
+    """
+    Uploads paginated on (change_seq, id): no COUNT and no OFFSET, so a deep page
+    costs the same as the first one and the pages don't shift when uploads arrive.
+    The watermark is the cursor of the last upload returned, a harvester keeps it
+    to get on its next run the uploads created or changed since (status, validation,
+    scan), an upload can so come again.
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    since_query_param = 'since'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        queryset = queryset.order_by('change_seq', 'id')
+
+        since = request.query_params.get(self.since_query_param)
+        if since:
+            since = parse_datetime(since)
+            if since is None:
+                raise NotFound(f'Invalid {self.since_query_param}')
+            queryset = queryset.filter(uploaded_at__gte=since)
+
+        self.position = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        if self.position:
+            change_seq, id = self.position
+            queryset = queryset.filter(Q(change_seq__gt=change_seq) | Q(change_seq=change_seq, id__gt=id))
+
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        if page:
+            self.position = (page[-1].change_seq, page[-1].id)
+        return page
+
+    def encode_cursor(self, position):
+        change_seq, id = position
+        return base64.urlsafe_b64encode(f"{change_seq}|{id}".encode()).decode()
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            change_seq, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return int(change_seq), int(id)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        # since stays in the link, the next pages are filtered like the first one
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('watermark', self.encode_cursor(self.position) if self.position else None),
+            ('results', data),
+        ]))
+
+
+def get_paginator(request):
+    """
+    the keyset pagination is opt-in with ?cursor= (empty for the first page)
+    """
+    if KeysetPagination.cursor_query_param in request.query_params:
+        return KeysetPagination()
+    paginator = PageNumberPagination()
+    paginator.page_size = api_settings.PAGE_SIZE
+    return paginator
@@ -12,46 +12,65 @@ You should have received a copy of the GNU General Public License along with eUp
 If not, see <https://www.gnu.org/licenses/>.
 """
 
+from collections import namedtuple
+from django.db.models import Exists, OuterRef, Q
 from rest_framework import permissions
 
+Roles = namedtuple('Roles', ['group_ids', 'is_validator', 'is_automation'])
+
+def get_roles(user):
+    """
+    the group ids of the user and whether it is in the Validator/Automation groups,
+    resolved with one query and memoized on the user for the rest of the request
+    """
+    roles = getattr(user, '_roles', None)
+    if roles is None:
+        # groups.all() uses the groups prefetched by CachedTokenAuthentication
+        groups = {group.id: group.name for group in user.groups.all()} if user and user.is_authenticated else {}
+        roles = Roles(frozenset(groups), 'Validator' in groups.values(), 'Automation' in groups.values())
+        user._roles = roles
+    return roles
+
+def visible_uploads(user, upload_lookup=''):
+    """
+    Q of the uploads the user can see: its own uploads and the uploads it has to validate,
+    the Automation users see every upload. upload_lookup is the path to the upload, e.g. "upload__"
+    """
+    from .models import UploadValidation
+    roles = get_roles(user)
+    if roles.is_automation:
+        return Q()
+    validated_by_user = UploadValidation.objects.filter(upload=OuterRef(f"{upload_lookup}pk" if upload_lookup else "pk"), group_id__in=roles.group_ids)
+    return Q(**{f"{upload_lookup}user": user}) | Q(Exists(validated_by_user))
+
 class IsValidator(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='Validator')
+        return get_roles(request.user).is_validator
     
 class CanAutomate(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user and request.user.groups.filter(name='Automation')
+        return get_roles(request.user).is_automation
     
 class IsUploaderOrValidatorForUpload(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if hasattr(request.user, 'custom') and (str(request.user) == str(obj.user)):
-            return True
-        for validation in obj.validations.all():
-            if validation.group.id in [x.id for x in request.user.groups.all()]:
-                return True
-        if request.user and request.user.groups.filter(name='Automation'):
-            return True
+        return is_upload_validator_or_uploader(request.user, obj)
         
 class IsUploaderOrValidatorForFileUpload(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
-        if hasattr(request.user, 'custom') and (str(request.user) == str(obj.upload.user)):
-            return True
-        for validation in obj.upload.validations.all():
-            if validation.group.id in [x.id for x in request.user.groups.all()]:
-                return True
-        if request.user and request.user.groups.filter(name='Automation'):
-            return True
+        return is_upload_validator_or_uploader(request.user, obj.upload)
+
+class IsUploaderOrValidatorForFileUploadSession(permissions.BasePermission):
+    def has_object_permission(self, request, view, obj):
+        return is_upload_validator_or_uploader(request.user, obj.upload)
 
 def is_upload_validator_or_uploader(user, upload):
+    from .models import UploadValidation
     # check if the user is the uploader
-    if str(upload.user) == str(user.username):
+    if upload.user_id == user.id:
         return True
-    # check if the the user is pipeline validator
-    for validation in upload.validations.all():
-        if validation.group.id in [x.id for x in user.groups.all()]:
-            return True
-    # check if the user is part of Automation group    
-    if user and user.groups.filter(name='Automation'):
+    # check if the user is part of Automation group
+    roles = get_roles(user)
+    if roles.is_automation:
         return True
-
-    return False
\ No newline at end of file
+    # check if the the user is pipeline validator
+    return bool(roles.group_ids) and UploadValidation.objects.filter(upload_id=upload.id, group_id__in=roles.group_ids).exists()
@@ -0,0 +1,183 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.db.models import F
+from django.utils import timezone
+from django_clamd import conf as clamd_conf
+from .models import Upload, FileUpload, ScanVerdict, next_change_seq
+from collections import Counter
+from contextlib import closing
+from . import metrics
+import logging
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+SCAN_CHUNK_SIZE = 65536
+SCAN_TIMEOUT = 600
+
+NOT_CLEAN_STATES = [FileUpload.ScanState.PENDING, FileUpload.ScanState.INFECTED, FileUpload.ScanState.ERROR]
+
+
+def _connect():
+    if clamd_conf.CLAMD_USE_TCP:
+        return socket.create_connection((clamd_conf.CLAMD_TCP_ADDR, clamd_conf.CLAMD_TCP_SOCKET), timeout=SCAN_TIMEOUT)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(SCAN_TIMEOUT)
+    sock.connect(clamd_conf.CLAMD_SOCKET)
+    return sock
+
+def _receive(sock):
+    reply = b""
+    while not reply.endswith(b"\0"):
+        data = sock.recv(4096)
+        if not data:
+            break
+        reply += data
+    return reply.rstrip(b"\0").decode("utf-8", "replace").strip()
+
+def clamd_version():
+    """
+    e.g. "ClamAV 1.1.2/27060/Mon Oct 14 08:25:15 2026", the signature version changes with freshclam
+    """
+    with closing(_connect()) as sock:
+        sock.sendall(b"zVERSION\0")
+        return _receive(sock)
+
+def clamd_instream(f):
+    """
+    stream the file to clamd with the INSTREAM command, return the clamd reply
+    """
+    with closing(_connect()) as sock:
+        sock.sendall(b"zINSTREAM\0")
+        while True:
+            chunk = f.read(SCAN_CHUNK_SIZE)
+            if not chunk:
+                break
+            sock.sendall(struct.pack("!L", len(chunk)) + chunk)
+        sock.sendall(struct.pack("!L", 0))
+        return _receive(sock)
+
+def scan_file(file_upload):
+    """
+    scan one stored file, return its scan state and result
+    """
+    started = time.perf_counter()
+    try:
+        with open(file_upload.uploaded_file.path, "rb") as f:
+            reply = clamd_instream(f)
+    except OSError as e:
+        state, result = FileUpload.ScanState.ERROR, str(e)[:255]
+    else:
+        # "stream: OK", "stream: <signature> FOUND" or "<message> ERROR"
+        reply = reply[len("stream: "):] if reply.startswith("stream: ") else reply
+        if reply.endswith("FOUND"):
+            state, result = FileUpload.ScanState.INFECTED, reply[:-len("FOUND")].strip()[:255]
+        elif reply == "OK":
+            state, result = FileUpload.ScanState.CLEAN, None
+        else:
+            state, result = FileUpload.ScanState.ERROR, reply[:255]
+
+    metrics.observe("euploader_scan_duration_seconds", {"state": state}, time.perf_counter() - started)
+    return state, result
+
+def scan_files(file_uploads, version):
+    """
+    scan files having the same content and save their scan state: clamd is asked
+    only when the content has no verdict for this signature version
+    """
+    sha256 = file_uploads[0].sha256
+    verdict = get_verdict(sha256, version)
+    cached = verdict is not None
+    if cached:
+        state, result = verdict.scan_state, verdict.scan_result
+        count_hits(verdict, len(file_uploads))
+    else:
+        state, result = scan_file(file_uploads[0])
+        metrics.inc("euploader_scan_verdict_cache_total", {"result": "miss"})
+        if sha256 and state != FileUpload.ScanState.ERROR:
+            # another thread may have scanned the same content
+            ScanVerdict.objects.bulk_create([ScanVerdict(sha256=sha256, db_version=version, scan_state=state, scan_result=result)], ignore_conflicts=True)
+            verdict = get_verdict(sha256, version)
+            if len(file_uploads) > 1:
+                count_hits(verdict, len(file_uploads) - 1)
+
+    FileUpload.objects.filter(id__in=[file_upload.id for file_upload in file_uploads]).update(
+        scan_state=state, scan_result=result, scan_db_version=version, scanned_at=timezone.now())
+    # the uploads can now be listed as validated
+    Upload.objects.filter(id__in={file_upload.upload_id for file_upload in file_uploads}).update(change_seq=next_change_seq())
+
+    for file_upload in file_uploads:
+        if state == FileUpload.ScanState.CLEAN:
+            logger.info(f"scan {file_upload}: clean{' (cached verdict)' if cached else ''}")
+        else:
+            logger.warning(f"scan {file_upload}: {state} {result}")
+    return state
+
+def get_verdict(sha256, version=None):
+    """
+    the verdict of a content for a signature version, by default for the last one
+    known by the scanworker (the verdicts of the previous versions are purged)
+    """
+    if not sha256:
+        return None
+    verdicts = ScanVerdict.objects.filter(sha256=sha256)
+    if version:
+        verdicts = verdicts.filter(db_version=version)
+    return verdicts.order_by('-id').first()
+
+def count_hits(verdict, hits=1):
+    ScanVerdict.objects.filter(id=verdict.id).update(hits=F('hits') + hits, last_hit_at=timezone.now())
+    metrics.inc("euploader_scan_verdict_cache_total", {"result": "hit"}, hits)
+
+def cached_scan_fields(sha256):
+    """
+    the scan fields of a new file whose content already has a verdict, it is then not
+    scanned by the scanworker; empty when the content is unknown
+    """
+    verdict = get_verdict(sha256)
+    if not verdict:
+        return {}
+    count_hits(verdict)
+    return {"scan_state": verdict.scan_state, "scan_result": verdict.scan_result, "scan_db_version": verdict.db_version, "scanned_at": timezone.now()}
+
+def cached_scan_fields_by_sha256(sha256s):
+    """
+    cached_scan_fields of many new files, with one query: {sha256: scan fields}
+    """
+    verdicts = {}
+    # the last verdict of each content
+    for verdict in ScanVerdict.objects.filter(sha256__in={sha256 for sha256 in sha256s if sha256}).order_by('id'):
+        verdicts[verdict.sha256] = verdict
+    hits = Counter(sha256 for sha256 in sha256s if sha256 in verdicts)
+    for sha256, count in hits.items():
+        count_hits(verdicts[sha256], count)
+    return {sha256: {"scan_state": verdict.scan_state, "scan_result": verdict.scan_result, "scan_db_version": verdict.db_version, "scanned_at": timezone.now()}
+            for sha256, verdict in verdicts.items()}
+
+def purge_verdicts(version):
+    """
+    drop the verdicts of the previous signature versions, once freshclam loaded new signatures
+    """
+    return ScanVerdict.objects.exclude(db_version=version).delete()[0]
+
+def only_scanned(queryset, files_lookup="upload__files"):
+    """
+    exclude from the queryset the uploads having a file which is not known as clean
+    """
+    if not clamd_conf.CLAMD_ENABLED:
+        return queryset
+    return queryset.exclude(**{f"{files_lookup}__scan_state__in": NOT_CLEAN_STATES})
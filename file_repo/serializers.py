@@ -12,11 +12,12 @@ You should have received a copy of the GNU General Public License along with eUp
 If not, see <https://www.gnu.org/licenses/>.
 """
 
-from .models import Pipeline, Custom, Upload, FileUpload, MetadataFormsField, FieldOption, MetadataValue, AllowedFileType, Note, UploadValidation
+from .models import Pipeline, Custom, Upload, FileUpload, FileUploadSession, MetadataFormsField, FieldOption, MetadataValue, AllowedFileType, Note, UploadValidation, UserImport, UserImportError
 from django.contrib.auth.models import User, Group
 from rest_framework import serializers
 from django.db.models import Q
 from rest_flex_fields import FlexFieldsModelSerializer
+from .apps import FileRepoConfig
 
 class AllowedFileTypeSerializer(serializers.ModelSerializer):
     class Meta:
@@ -37,9 +38,7 @@ class MetadataFormsFieldSerializer(serializers.ModelSerializer):
 
     def get_groupe_scope_name(self, obj):
         if obj.scope:
-            for q in Group.objects.all():
-                if str(obj.scope) == str(q.id):
-                    return q.description        
+            return obj.scope.description
         return None
 
 class PipelineFormsFieldsNoScopeSerializer(serializers.ModelSerializer):
@@ -47,7 +46,7 @@ class PipelineFormsFieldsNoScopeSerializer(serializers.ModelSerializer):
     fields = serializers.SerializerMethodField("get_no_scope_fields")
 
     def get_no_scope_fields(self, obj):
-        qs = MetadataFormsField.objects.filter(pipeline=obj, scope=None)
+        qs = MetadataFormsField.objects.filter(pipeline=obj, scope=None).prefetch_related('options')
         serializer = MetadataFormsFieldSerializer(instance=qs, many=True)
         return serializer.data
 
@@ -110,20 +109,46 @@ class NoteSerializer(serializers.ModelSerializer):
 
 class FileUploadSerializer(serializers.ModelSerializer):
     values = MetadataValueSerializer(many=True, read_only=True)
-    size = serializers.SerializerMethodField("get_size")
     class Meta:
         model = FileUpload
-        fields = ['id', 'upload', 'checksum', 'uploaded_file', 'name', 'size', 'type', 'values']
-    
-    def get_size(self, obj):
-        return obj.uploaded_file.size if hasattr(obj, "uploaded_file") else None
+        fields = ['id', 'upload', 'checksum', 'sha256', 'uploaded_file', 'name', 'size', 'modified_at', 'type', 'detected_type', 'scan_state', 'values']
+        read_only_fields = ['sha256', 'size', 'modified_at', 'detected_type', 'scan_state']
+
+class FileUploadSessionSerializer(serializers.ModelSerializer):
+    part_count = serializers.SerializerMethodField("get_part_count")
+    received_parts = serializers.SerializerMethodField("get_received_parts")
+    offset = serializers.SerializerMethodField("get_offset")
+    class Meta:
+        model = FileUploadSession
+        fields = ['id', 'upload', 'filename', 'size', 'part_size', 'checksum', 'type', 'status', 'file', 'created_at', 'part_count', 'received_parts', 'offset']
+        read_only_fields = ['status', 'file', 'created_at']
+
+    def get_part_count(self, obj):
+        return obj.part_count()
+
+    def get_received_parts(self, obj):
+        return obj.received_parts()
+
+    def get_offset(self, obj):
+        return obj.offset()
+
+    def validate(self, data):
+        if data['size'] < 0:
+            raise serializers.ValidationError({"size": "must be positive"})
+        part_size = data.get('part_size', FileRepoConfig.CHUNKED_UPLOAD_PART_SIZE_IN_BYTE)
+        if part_size <= 0 or part_size > FileRepoConfig.CHUNKED_UPLOAD_MAX_PART_SIZE_IN_BYTE:
+            raise serializers.ValidationError({"part_size": f"must be between 1 and {FileRepoConfig.CHUNKED_UPLOAD_MAX_PART_SIZE_IN_BYTE}"})
+        pipeline = data['upload'].pipeline
+        if pipeline and data['size'] > pipeline.max_size_in_byte:
+            raise serializers.ValidationError({"size": f"exceeds the pipeline limit of {pipeline.max_size_in_byte} bytes"})
+        return data
 
 class UploadSerializer(serializers.ModelSerializer):
     files = FileUploadSerializer(many=True, read_only=True)
     class Meta:
         model = Upload
-        fields = ['id', 'uploaded_at', 'same_meta_for_each_file', 'status', 'files']
-        read_only_fields = ['files']
+        fields = ['id', 'uploaded_at', 'same_meta_for_each_file', 'status', 'validation_state', 'files']
+        read_only_fields = ['files', 'validation_state']
 
 class UploadMinimalSerializer(serializers.ModelSerializer):
     class Meta:
@@ -142,4 +167,15 @@ class UploadValidationSerializer(serializers.ModelSerializer):
 class UploadValidationForListSerializer(FlexFieldsModelSerializer):
     class Meta:
         model = UploadValidation
-        fields = ['id', 'state', 'upload', 'workflow', 'group']
\ No newline at end of file
+        fields = ['id', 'state', 'upload', 'workflow', 'group']
+
+class UserImportErrorSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserImportError
+        fields = ['file', 'row', 'email', 'error']
+
+class UserImportSerializer(serializers.ModelSerializer):
+    errors = UserImportErrorSerializer(many=True, read_only=True)
+    class Meta:
+        model = UserImport
+        fields = ['id', 'status', 'file', 'rows', 'created_users', 'created_tokens', 'updated_tokens', 'errors_count', 'message', 'created_at', 'updated_at', 'finished_at', 'errors']
@@ -0,0 +1,94 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from django.conf import settings
+from .models import Upload, UploadValidation, Pipeline, MetadataFormsField, FieldOption, AllowedFileType, Custom, Job, next_change_seq
+import os
+from .cache import bump_schema_version
+from .authentication import invalidate_token_cache
+
+
+def refresh_validation_state(upload_id):
+    """
+    store on the upload whether all its validations are OK, one is NOK or some are pending
+    """
+    states = set(UploadValidation.objects.filter(upload_id=upload_id).values_list('state', flat=True).distinct())
+    if not states:
+        state = Upload.ValidationState.NONE
+    elif UploadValidation.State.VALIDATED_NOK in states:
+        state = Upload.ValidationState.VALIDATED_NOK
+    elif states == {UploadValidation.State.VALIDATED_OK}:
+        state = Upload.ValidationState.VALIDATED_OK
+    else:
+        state = Upload.ValidationState.PENDING
+    # a new state is a change for the keyset pagination
+    Upload.objects.filter(id=upload_id).exclude(validation_state=state).update(validation_state=state, change_seq=next_change_seq())
+
+
+# UploadValidation.objects.update() and bulk_create() don't send these signals, call
+# refresh_validation_state after them (or the refresh_validation_states command to repair)
+@receiver(post_save, sender=UploadValidation)
+@receiver(post_delete, sender=UploadValidation)
+def upload_validation_changed(sender, instance, **kwargs):
+    refresh_validation_state(instance.upload_id)
+
+
+@receiver(post_save, sender=Pipeline)
+@receiver(post_delete, sender=Pipeline)
+@receiver(post_save, sender=MetadataFormsField)
+@receiver(post_delete, sender=MetadataFormsField)
+@receiver(post_save, sender=FieldOption)
+@receiver(post_delete, sender=FieldOption)
+@receiver(post_save, sender=AllowedFileType)
+@receiver(post_delete, sender=AllowedFileType)
+@receiver(m2m_changed, sender=AllowedFileType.pipeline.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def pipeline_schema_changed(sender, **kwargs):
+    # once committed, so the schema can't be cached again from the previous data
+    transaction.on_commit(bump_schema_version)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Custom)
+@receiver(post_delete, sender=Custom)
+@receiver(post_save, sender=Pipeline)
+@receiver(post_delete, sender=Pipeline)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def token_user_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_token_cache)
+
+
+@receiver(post_delete, sender=Job)
+def job_deleted(sender, instance, **kwargs):
+    # the archive written by the job goes with it
+    if isinstance(instance.result, dict) and instance.result.get('file'):
+        path = os.path.join(settings.JOB_OUTPUT_DIR, os.path.basename(instance.result['file']))
+        transaction.on_commit(lambda: remove_file(path))
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,92 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+import hashlib
+import os
+import tempfile
+
+HASH_BUFFER_SIZE = 65536
+
+
+def blob_path(sha256):
+    """
+    CONTENT_ADDRESSED_STORAGE_DIR/ab/cd/abcd...
+    """
+    return os.path.join(settings.CONTENT_ADDRESSED_STORAGE_DIR, sha256[:2], sha256[2:4], sha256)
+
+def file_sha256(f):
+    sha256 = hashlib.sha256()
+    if hasattr(f, 'seek'):
+        f.seek(0)
+    for chunk in f.chunks() if hasattr(f, 'chunks') else iter(lambda: f.read(HASH_BUFFER_SIZE), b''):
+        sha256.update(chunk)
+    if hasattr(f, 'seek'):
+        f.seek(0)
+    return sha256.hexdigest()
+
+def link_to_blob(path, sha256):
+    """
+    Make the file at path a hardlink of the blob of its content, the blob is created from
+    the file when it doesn't exist yet. Return True if path was replaced by the existing blob.
+    """
+    blob = blob_path(sha256)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        os.link(path, blob)
+        return False
+    except FileExistsError:
+        pass
+    if os.path.samefile(path, blob):
+        return False
+    # link then rename, the path always has a content
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.link')
+    os.close(fd)
+    os.remove(tmp_path)
+    os.link(blob, tmp_path)
+    os.replace(tmp_path, path)
+    return True
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Store each content once: the files keep their usual name in MEDIA_ROOT but are hardlinks
+    of a blob named by their SHA-256 in CONTENT_ADDRESSED_STORAGE_DIR (on the same filesystem).
+    Deleting a file (django_cleanup) removes one link, the gc_blobs command removes the
+    blobs left without any file. The stored files must not be modified in place.
+    """
+
+    def _save(self, name, content):
+        sha256 = getattr(content, 'sha256', None) or file_sha256(content)
+        blob = blob_path(sha256)
+
+        # the content is already stored, only the link is created
+        while os.path.exists(blob):
+            name = self.get_available_name(name)
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(blob, path)
+                return name.replace('\\', '/')
+            except FileExistsError:
+                # another file took the name, try the next available one
+                continue
+            except FileNotFoundError:
+                # removed by gc_blobs in the meantime
+                break
+
+        name = super()._save(name, content)
+        link_to_blob(self.path(name), sha256)
+        return name
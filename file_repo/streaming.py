@@ -0,0 +1,199 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
+from urllib.parse import quote
+from . import metrics
+import csv
+import io
+import mimetypes
+import os
+import pyexcel
+import re
+import tempfile
+import zipfile
+
+STREAM_CHUNK_SIZE = 1048576 # 1MB
+CSV_CHUNK_ROWS = 1000
+# larger spreadsheets are written on the disk
+SPREADSHEET_SPOOL_SIZE = 16777216 # 16MB
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _WriteBuffer:
+    """
+    Unseekable file object receiving what zipfile writes, emptied after each chunk
+    so the archive is never held in memory
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(entries):
+    """
+    Yield a ZIP archive of the (path, name in the archive) entries.
+    Files are STORED as the uploaded media are mostly compressed already,
+    and ZIP64 is used for the files and archives larger than 4GB.
+    """
+    buffer = _WriteBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for path, arcname in entries:
+            # the size known in advance lets zipfile switch to ZIP64 headers for large files
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(path, "rb") as src, zf.open(zinfo, mode="w") as dest:
+                while True:
+                    chunk = src.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield buffer.drain()
+            yield buffer.drain()
+    yield buffer.drain()
+
+
+def csv_stream(rows):
+    """
+    Yield a CSV of the rows by chunks of CSV_CHUNK_ROWS lines
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for number, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if number % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def spreadsheet_file(rows, file_type):
+    """
+    The rows written in a spreadsheet of file_type (e.g. xlsx, through the pyexcel plugins)
+    in a temporary file, kept in memory up to SPREADSHEET_SPOOL_SIZE
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=SPREADSHEET_SPOOL_SIZE)
+    pyexcel.isave_as(array=rows, dest_file_type=file_type, dest_file_stream=f)
+    pyexcel.free_resources()
+    f.seek(0)
+    return f
+
+
+def _file_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _requested_range(request, size, etag):
+    """
+    (start, end) of a single "Range: bytes=" request, None to send the whole file,
+    or False when the range can't be satisfied
+    """
+    header = request.META.get("HTTP_RANGE")
+    if not header:
+        return None
+    # a range on a file which changed since the client got its first part is not usable
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and (not etag or if_range != quote_etag(etag)):
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def file_response(request, path, filename=None, etag=None, root=None, offload_location=None):
+    """
+    Send a file of MEDIA_ROOT, or of another root, once the permissions are checked.
+    With DOWNLOAD_OFFLOAD nginx sends the bytes from its internal location
+    (DOWNLOAD_OFFLOAD_LOCATION or offload_location for root), otherwise the file
+    is streamed with Range and If-None-Match support.
+    """
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    disposition = f'attachment; filename="{filename}"' if filename else None
+
+    if settings.DOWNLOAD_OFFLOAD:
+        name = os.path.relpath(path, root or settings.MEDIA_ROOT)
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = quote((offload_location or settings.DOWNLOAD_OFFLOAD_LOCATION) + name)
+        if disposition:
+            response["Content-Disposition"] = disposition
+        # nginx may send only a range, the whole file is counted
+        metrics.inc("euploader_download_bytes_total", amount=os.path.getsize(path))
+        return response
+
+    if etag and request.META.get("HTTP_IF_NONE_MATCH"):
+        if_none_match = parse_etags(request.META["HTTP_IF_NONE_MATCH"])
+        if "*" in if_none_match or quote_etag(etag) in if_none_match:
+            response = HttpResponseNotModified()
+            response["ETag"] = quote_etag(etag)
+            return response
+
+    size = os.path.getsize(path)
+    requested = _requested_range(request, size, etag)
+
+    if requested is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    if requested:
+        start, end = requested
+        response = StreamingHttpResponse(_file_range(path, start, end - start + 1), status=206, content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(end - start + 1)
+        metrics.inc("euploader_download_bytes_total", amount=end - start + 1)
+    else:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+        metrics.inc("euploader_download_bytes_total", amount=size)
+
+    response["Accept-Ranges"] = "bytes"
+    if etag:
+        response["ETag"] = quote_etag(etag)
+    if disposition:
+        response["Content-Disposition"] = disposition
+    return response
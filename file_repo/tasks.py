@@ -0,0 +1,62 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+The tasks which can be queued as jobs, see jobs.py
+"""
+
+from django.conf import settings
+from django.core.management import call_command
+from .jobs import task
+from .models import FileUpload
+from .streaming import zip_stream
+from .user_import import run_import
+import functools
+import io
+import os
+
+# management commands which can be queued from the admin
+COMMANDS = ["backfill_file_stats", "refresh_validation_states", "dedupe_files", "gc_blobs"]
+COMMAND_OUTPUT_SIZE = 10000
+
+# a new attempt starts the import again from the first row
+task("import_users")(run_import)
+
+
+@task()
+def zip_files(file_ids, filename):
+    """
+    the archive of the files selected in the admin, written in JOB_OUTPUT_DIR
+    """
+    names = FileUpload.objects.filter(id__in=file_ids).order_by('id').values_list('uploaded_file', flat=True)
+    subdir = os.path.splitext(filename)[0]
+    entries = [(os.path.join(settings.MEDIA_ROOT, name), os.path.join(subdir, name)) for name in names]
+
+    os.makedirs(settings.JOB_OUTPUT_DIR, exist_ok=True)
+    path = os.path.join(settings.JOB_OUTPUT_DIR, filename)
+    with open(f"{path}.part", "wb") as f:
+        for chunk in zip_stream(entries):
+            f.write(chunk)
+    os.replace(f"{path}.part", path)
+    return {"file": filename, "files": len(entries), "size": os.path.getsize(path)}
+
+
+def run_command(name, **options):
+    out = io.StringIO()
+    call_command(name, stdout=out, **options)
+    # the end of the output, with the totals
+    return {"output": out.getvalue()[-COMMAND_OUTPUT_SIZE:]}
+
+for name in COMMANDS:
+    task(name)(functools.partial(run_command, name))
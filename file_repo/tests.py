@@ -1,3 +1,1345 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, OperationalError
+from django.contrib.auth.models import User, Group
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db.migrations.loader import MigrationLoader
+from rest_framework.test import APIClient
+from rest_framework.authtoken.models import Token
+from .authentication import get_token, token_cache_stats
+from . import metrics, scanning
+from .management.commands.benchmark import ENDPOINTS, Command as Benchmark, endpoint_request
+from .models import Pipeline, Custom, Upload, FileUpload, FileUploadSession, AllowedFileType, MetadataValue, MetadataFormsField, UploadValidation, Workflow, ScanVerdict, UserImport, Job
+from .apps import FileRepoConfig
+from .jobs import TASKS, enqueue, claim, run_job
+from .pagination import KeysetPagination
+from .streaming import zip_stream
+import hashlib
+import importlib.metadata
+import io
+import magic
+import os
+import pyexcel
+import shutil
+import tempfile
+import urllib.parse
+import threading
+import zipfile
+import datetime
+import socket
+import sys
+from django.utils import timezone
+from unittest import mock
 
-# Create your tests here.
+MEDIA_ROOT = tempfile.mkdtemp()
+METRICS_DB = os.path.join(tempfile.mkdtemp(), "metrics.sqlite3")
+CHUNKED_UPLOAD_DIR = os.path.join(MEDIA_ROOT, "chunks")
+INGEST_TEMP_DIR = os.path.join(MEDIA_ROOT, "incoming")
+
+
+class UploadTestMixin:
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def create_uploader(self, username, pipeline):
+        user = User.objects.create(username=username)
+        Custom.objects.create(user=user, pipeline=pipeline)
+        return user
+
+    def create_upload(self, user, pipeline, status=Upload.Status.COMPLETED, files=2):
+        upload = Upload.objects.create(user=user, pipeline=pipeline, status=status)
+        for i in range(files):
+            file = FileUpload(upload=upload, type="text/plain")
+            file.uploaded_file.save(f"file_{i}.txt", ContentFile(b"content"))
+            MetadataValue.objects.create(file=file, key="title", value=f"title {i}")
+        return upload
+
+    def count_queries(self, client, url):
+        # the roles are memoized on the force authenticated user, a first request resolves them
+        client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def assertWithinQueryBudget(self, response):
+        """
+        the query_budget of the view is declared in api_views.py, see instrumentation.py
+        """
+        self.assertIsNotNone(response.query_budget, "the view has no query budget")
+        self.assertLessEqual(response.query_count, response.query_budget, "the view exceeds its query budget")
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CHUNKED_UPLOAD_DIR=CHUNKED_UPLOAD_DIR, INGEST_TEMP_DIR=INGEST_TEMP_DIR, METRICS_DB=METRICS_DB)
+class UploadTestCase(UploadTestMixin, TestCase):
+    pass
+
+
+class FileUploadSessionTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+        # the ids of the sessions are reused by the next test
+        self.addCleanup(shutil.rmtree, CHUNKED_UPLOAD_DIR, ignore_errors=True)
+        self.content = b"0123456789abcdefghij!"
+        response = self.client.post("/file_repo/api/file-session/", {"upload": self.upload.id, "filename": "session.bin", "size": len(self.content), "part_size": 8})
+        self.assertEqual(response.status_code, 201)
+        self.url = f"/file_repo/api/file-session/{response.json()['id']}/"
+
+    def put_part(self, number, content=None):
+        if content is None:
+            content = self.content[number * 8:(number + 1) * 8]
+        return self.client.put(f"{self.url}part/{number}/", content, content_type="application/octet-stream")
+
+    def test_parts_out_of_order_and_offset(self):
+        self.assertEqual(self.client.get(self.url).json()["part_count"], 3)
+        self.assertEqual(self.put_part(2).status_code, 200)
+        data = self.client.get(self.url).json()
+        self.assertEqual((data["received_parts"], data["offset"]), ([2], 0))
+
+        self.put_part(0)
+        data = self.client.get(self.url).json()
+        self.assertEqual((data["received_parts"], data["offset"]), ([0, 2], 8))
+
+        # a part sent again replaces the previous one
+        self.assertEqual(self.put_part(0, b"ABCDEFGH").status_code, 200)
+        self.assertEqual(self.put_part(1, b"short").status_code, 400)
+        self.put_part(1)
+        data = self.client.get(self.url).json()
+        self.assertEqual((data["received_parts"], data["offset"]), ([0, 1, 2], len(self.content)))
+
+        response = self.client.post(f"{self.url}finalize/")
+        self.assertEqual(response.status_code, 201)
+        self.assertWithinQueryBudget(response)
+        file = FileUpload.objects.get(id=response.json()["id"])
+        self.assertEqual(file.uploaded_file.read(), b"ABCDEFGH" + self.content[8:])
+        self.assertEqual((file.size, file.sha256), (len(self.content), hashlib.sha256(b"ABCDEFGH" + self.content[8:]).hexdigest()))
+        self.assertEqual(self.client.get(self.url).json()["status"], FileUploadSession.Status.COMPLETED)
+        self.assertEqual(os.listdir(CHUNKED_UPLOAD_DIR), [])
+        self.assertEqual(self.put_part(0).status_code, 409)
+
+    def test_finalize_with_a_missing_part(self):
+        self.put_part(0)
+        self.put_part(2)
+        response = self.client.post(f"{self.url}finalize/")
+        self.assertEqual((response.status_code, response.json()), (409, {"missing_parts": [1]}))
+        self.assertEqual(self.client.get(self.url).json()["status"], FileUploadSession.Status.OPEN)
+        self.assertFalse(self.upload.files.exists())
+
+    def test_abort_removes_the_parts(self):
+        self.put_part(0)
+        session = FileUploadSession.objects.get()
+        self.assertTrue(os.path.exists(session.part_dir()))
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(os.path.exists(session.part_dir()))
+        self.assertFalse(FileUploadSession.objects.exists())
+
+
+class StreamingIngestTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline", max_size_in_byte=100)
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def post_file(self, content, **data):
+        file = io.BytesIO(content)
+        file.name = "file.txt"
+        return self.client.post("/file_repo/api/file/", {"upload": self.upload.id, "uploaded_file": file, **data}, format="multipart")
+
+    def stored_files(self):
+        return {os.path.join(root, name) for root, _, names in os.walk(MEDIA_ROOT) for name in names}
+
+    def test_sha256_is_computed_by_the_server(self):
+        response = self.post_file(b"content", checksum="sent by the client")
+        self.assertEqual(response.status_code, 201)
+        file = FileUpload.objects.get(id=response.json()["id"])
+        self.assertEqual((file.sha256, file.checksum), (hashlib.sha256(b"content").hexdigest(), "sent by the client"))
+        self.assertEqual(os.listdir(INGEST_TEMP_DIR), [])
+
+    def test_file_over_the_limit_is_refused_and_not_stored(self):
+        stored = self.stored_files()
+        response = self.post_file(b"x" * 101)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.json()["detail"], "file.txt exceeds the limit of 100 bytes")
+        self.assertFalse(self.upload.files.exists())
+        self.assertEqual(os.listdir(INGEST_TEMP_DIR), [])
+        self.assertEqual(self.stored_files(), stored)
+        self.assertEqual(self.post_file(b"x" * 100).status_code, 201)
+
+
+class ZipStreamTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.upload = self.create_upload(self.create_uploader("uploader", self.pipeline), self.pipeline, files=0)
+        self.contents = [os.urandom(1000), b"content"]
+        for i, content in enumerate(self.contents):
+            FileUpload(upload=self.upload, type="application/octet-stream").uploaded_file.save(f"file_{i}.bin", ContentFile(content))
+        self.entries = [(file.uploaded_file.path, os.path.basename(file.uploaded_file.name)) for file in self.upload.files.order_by("id")]
+
+    def test_entries_are_stored_and_streamed_by_chunks(self):
+        with mock.patch("file_repo.streaming.STREAM_CHUNK_SIZE", 100):
+            chunks = [chunk for chunk in zip_stream(self.entries) if chunk]
+        # the archive is sent while the files are read
+        self.assertGreater(len(chunks), 10)
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+            self.assertEqual([info.compress_type for info in archive.infolist()], [zipfile.ZIP_STORED] * 2)
+            self.assertEqual([archive.read(name) for _, name in self.entries], self.contents)
+            self.assertIsNone(archive.testzip())
+
+    def test_large_entries_have_zip64_headers(self):
+        # the 4GB limit of the ZIP headers brought down to 500 bytes
+        with mock.patch("zipfile.ZIP64_LIMIT", 500):
+            data = b"".join(zip_stream(self.entries))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            large, small = archive.infolist()
+            # the ZIP64 extra field (0x0001) holds the sizes of the large file, the offset of the other one
+            self.assertEqual((large.extra[:2], small.extra[:2]), (b"\x01\x00", b"\x01\x00"))
+            self.assertEqual(large.file_size, 1000)
+            self.assertEqual([archive.read(info) for info in (large, small)], self.contents)
+        # the local header of the large file has the extra field too, and the archive a ZIP64 end record
+        self.assertEqual(data[30 + len(large.filename):][:2], b"\x01\x00")
+        self.assertIn(b"PK\x06\x06", data)
+
+    def test_admin_downloads_the_selected_files(self):
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        client = APIClient()
+        client.force_login(admin)
+        response = client.post("/admin/file_repo/fileupload/", {"action": "download_multiple_files", "_selected_action": list(self.upload.files.values_list('id', flat=True))})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-zip-compressed")
+        self.assertRegex(response["Content-Disposition"], r"^attachment; filename=eUploader_DL_[0-9-]+\.zip$")
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+            subdir = response["Content-Disposition"][len("attachment; filename="):-len(".zip")]
+            names = [os.path.join(subdir, file.uploaded_file.name) for file in self.upload.files.order_by("id")]
+            self.assertEqual(sorted(archive.namelist()), sorted(names))
+            self.assertEqual({archive.read(name) for name in names}, set(self.contents))
+            self.assertEqual({info.compress_type for info in archive.infolist()}, {zipfile.ZIP_STORED})
+
+
+class DownloadTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.file = FileUpload(upload=upload, sha256=hashlib.sha256(b"content").hexdigest())
+        self.file.uploaded_file.save("my file é.txt", ContentFile(b"content"))
+        self.url = f"/file_repo/api/download-file/{self.file.id}/"
+        self.etag = f'"{self.file.sha256}"'
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    @override_settings(DOWNLOAD_OFFLOAD=True, DOWNLOAD_OFFLOAD_LOCATION="/protected_media/")
+    def test_offload_to_nginx(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected_media/" + urllib.parse.quote(self.file.uploaded_file.name))
+        self.assertIn("my_file_%C3%A9", response["X-Accel-Redirect"])
+        self.assertEqual(response["Content-Disposition"], f'attachment; filename="{os.path.basename(self.file.uploaded_file.name)}"')
+        self.assertEqual(response.content, b"")
+
+    @override_settings(DOWNLOAD_OFFLOAD=False)
+    def test_ranges(self):
+        response = self.client.get(self.url)
+        self.assertEqual((response.status_code, b"".join(response.streaming_content), response["ETag"], response["Accept-Ranges"]), (200, b"content", self.etag, "bytes"))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1-3")
+        self.assertEqual((response.status_code, b"".join(response.streaming_content)), (206, b"ont"))
+        self.assertEqual((response["Content-Range"], response["Content-Length"]), ("bytes 1-3/7", "3"))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-3")
+        self.assertEqual((response.status_code, b"".join(response.streaming_content), response["Content-Range"]), (206, b"ent", "bytes 4-6/7"))
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5-")
+        self.assertEqual((response.status_code, b"".join(response.streaming_content), response["Content-Range"]), (206, b"nt", "bytes 5-6/7"))
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=7-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, "bytes */7"))
+
+    @override_settings(DOWNLOAD_OFFLOAD=False)
+    def test_conditional_requests(self):
+        # the file changed since the client got its first part
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1-3", HTTP_IF_RANGE='"other"')
+        self.assertEqual((response.status_code, b"".join(response.streaming_content)), (200, b"content"))
+        response = self.client.get(self.url, HTTP_RANGE="bytes=1-3", HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual((response.status_code, response["ETag"]), (304, self.etag))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    @override_settings(DOWNLOAD_OFFLOAD=False)
+    def test_media_url_checks_the_permissions(self):
+        url = f"/media/{self.file.uploaded_file.name}"
+        client = APIClient()
+        self.assertEqual(client.get(url).status_code, 302)
+        client.force_login(self.create_uploader("other", self.pipeline))
+        self.assertEqual(client.get(url).status_code, 403)
+        client.force_login(self.uploader)
+        response = client.get(url, HTTP_RANGE="bytes=0-2")
+        self.assertEqual((response.status_code, b"".join(response.streaming_content)), (206, b"con"))
+
+    @override_settings(DOWNLOAD_OFFLOAD=True, DOWNLOAD_OFFLOAD_LOCATION="/protected_media/")
+    def test_media_url_is_offloaded_once_checked(self):
+        url = f"/media/{self.file.uploaded_file.name}"
+        client = APIClient()
+        client.force_login(self.create_uploader("other", self.pipeline))
+        response = client.get(url)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.has_header("X-Accel-Redirect"))
+        client.force_login(self.uploader)
+        self.assertEqual(client.get(url)["X-Accel-Redirect"], "/protected_media/" + urllib.parse.quote(self.file.uploaded_file.name))
+
+
+class ValidationStateTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.upload = self.create_upload(self.create_uploader("uploader", self.pipeline), self.pipeline, files=0)
+
+    def assertValidationState(self, state):
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.validation_state, state)
+
+    def test_state_follows_the_validations(self):
+        self.assertValidationState(Upload.ValidationState.NONE)
+        first = UploadValidation.objects.create(upload=self.upload)
+        second = UploadValidation.objects.create(upload=self.upload, state=UploadValidation.State.VALIDATED_OK)
+        self.assertValidationState(Upload.ValidationState.PENDING)
+
+        first.state = UploadValidation.State.VALIDATED_OK
+        first.save()
+        self.assertValidationState(Upload.ValidationState.VALIDATED_OK)
+
+        second.state = UploadValidation.State.VALIDATED_NOK
+        second.save()
+        self.assertValidationState(Upload.ValidationState.VALIDATED_NOK)
+
+        second.delete()
+        self.assertValidationState(Upload.ValidationState.VALIDATED_OK)
+        first.delete()
+        self.assertValidationState(Upload.ValidationState.NONE)
+
+    def test_update_without_signal_is_repaired_by_the_command(self):
+        UploadValidation.objects.create(upload=self.upload)
+        UploadValidation.objects.filter(upload=self.upload).update(state=UploadValidation.State.VALIDATED_OK)
+        self.assertValidationState(Upload.ValidationState.PENDING)
+
+        call_command('refresh_validation_states', stdout=io.StringIO())
+        self.assertValidationState(Upload.ValidationState.VALIDATED_OK)
+
+
+class UploadsByPipelineTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.other_pipeline = Pipeline.objects.create(name="other", description="other")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.automation = User.objects.create(username="automation")
+        self.automation.groups.add(Group.objects.create(name="Automation"))
+        self.url = f"/file_repo/api/pipeline-uploads/{self.pipeline.id}/"
+
+    def test_automation_gets_uploads_of_every_uploader(self):
+        other_uploader = self.create_uploader("other_uploader", self.pipeline)
+        self.create_upload(self.uploader, self.pipeline)
+        self.create_upload(other_uploader, self.pipeline)
+        self.create_upload(self.uploader, self.pipeline, status=Upload.Status.INIT)
+        self.create_upload(self.create_uploader("elsewhere", self.other_pipeline), self.other_pipeline)
+
+        client = APIClient()
+        client.force_authenticate(self.automation)
+        _, data = self.count_queries(client, self.url)
+        self.assertEqual(data["count"], 2)
+
+    def test_uploader_gets_only_own_uploads(self):
+        own = self.create_upload(self.uploader, self.pipeline)
+        self.create_upload(self.create_uploader("other_uploader", self.pipeline), self.pipeline)
+
+        client = APIClient()
+        client.force_authenticate(self.uploader)
+        _, data = self.count_queries(client, self.url)
+        self.assertEqual([upload["id"] for upload in data["results"]], [own.id])
+
+    def test_query_count_does_not_grow_with_uploads(self):
+        client = APIClient()
+        client.force_authenticate(self.automation)
+
+        self.create_upload(self.uploader, self.pipeline)
+        queries_for_one, _ = self.count_queries(client, self.url)
+
+        for i in range(10):
+            self.create_upload(self.create_uploader(f"uploader_{i}", self.pipeline), self.pipeline)
+        queries_for_many, data = self.count_queries(client, self.url)
+
+        self.assertEqual(data["count"], 11)
+        self.assertEqual(queries_for_one, queries_for_many)
+
+
+class KeysetPaginationTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        automation = User.objects.create(username="automation")
+        automation.groups.add(Group.objects.create(name="Automation"))
+        self.client = APIClient()
+        self.client.force_authenticate(automation)
+        self.url = f"/file_repo/api/pipeline-uploads/{self.pipeline.id}/?cursor="
+
+    def test_pages_are_stable_while_uploads_arrive(self):
+        uploads = [self.create_upload(self.uploader, self.pipeline, files=0) for i in range(20)]
+
+        with CaptureQueriesContext(connection) as queries:
+            first = self.client.get(self.url).json()
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+        self.assertNotIn("count", first)
+
+        arrived = self.create_upload(self.uploader, self.pipeline, files=0)
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(second["next"])
+
+        ids = [upload["id"] for upload in first["results"] + second["results"]]
+        self.assertEqual(ids, [upload.id for upload in uploads] + [arrived.id])
+
+        # the watermark gives only the uploads made since
+        self.assertEqual(self.client.get(self.url + second["watermark"]).json()["results"], [])
+        newer = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.assertEqual([upload["id"] for upload in self.client.get(self.url + second["watermark"]).json()["results"]], [newer.id])
+
+    def test_watermark_gets_the_uploads_completed_or_validated_since(self):
+        started = self.create_upload(self.uploader, self.pipeline, status=Upload.Status.INIT, files=0)
+        validated = self.create_upload(self.uploader, self.pipeline, files=0)
+        validation = UploadValidation.objects.create(upload=validated)
+        validated_url = f"/file_repo/api/validated-upload/{self.pipeline.id}/?cursor="
+        completed_watermark = self.client.get(self.url).json()["watermark"]
+        self.assertEqual(self.client.get(validated_url).json()["results"], [])
+
+        # both uploads are older than the watermark
+        started.status = Upload.Status.COMPLETED
+        started.save()
+        validation.state = UploadValidation.State.VALIDATED_OK
+        validation.save()
+
+        # every change of an upload gives it again, the validated one too
+        self.assertEqual([upload["id"] for upload in self.client.get(self.url + completed_watermark).json()["results"]], [started.id, validated.id])
+        self.assertEqual([upload["id"] for upload in self.client.get(validated_url).json()["results"]], [validated.id])
+
+    def test_scan_is_a_change(self):
+        upload = self.create_upload(self.uploader, self.pipeline, files=1)
+        change_seq = Upload.objects.get(id=upload.id).change_seq
+        with mock.patch("file_repo.scanning.scan_file", return_value=(FileUpload.ScanState.CLEAN, None)):
+            scanning.scan_files(list(upload.files.all()), "ClamAV")
+        self.assertGreater(Upload.objects.get(id=upload.id).change_seq, change_seq)
+
+    def test_since_filters_every_page(self):
+        uploads = [self.create_upload(self.uploader, self.pipeline, files=0) for i in range(6)]
+        Upload.objects.filter(id__in=[upload.id for upload in uploads[::2]]).update(uploaded_at=timezone.now() - datetime.timedelta(days=10))
+        url = self.url + "&since=" + urllib.parse.quote((timezone.now() - datetime.timedelta(days=1)).isoformat())
+
+        ids = []
+        with mock.patch.object(KeysetPagination, "page_size", 2):
+            while url:
+                data = self.client.get(url).json()
+                ids += [upload["id"] for upload in data["results"]]
+                url = data["next"]
+        self.assertEqual(ids, [upload.id for upload in uploads[1::2]])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url + "not-a-cursor").status_code, 404)
+
+
+class FileMetadataTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def put_metadata(self, url, data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(url, data, format="json")
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def values(self, upload):
+        return sorted(MetadataValue.objects.filter(file__upload=upload).values_list("file_id", "key", "value"))
+
+    def test_same_metadata_for_each_file(self):
+        small = self.create_upload(self.uploader, self.pipeline, files=2)
+        large = self.create_upload(self.uploader, self.pipeline, files=20)
+        data = [{"key": "title", "value": "new title"}, {"key": "author", "value": "author"}]
+
+        queries_small = self.put_metadata(f"/file_repo/api/file/{small.files.first().id}/metadata/", data)
+        queries_large = self.put_metadata(f"/file_repo/api/file/{large.files.first().id}/metadata/", data)
+
+        self.assertEqual(queries_small, queries_large)
+        for file in large.files.all():
+            self.assertEqual(dict(file.values.values_list("key", "value")), {"title": "new title", "author": "author"})
+
+    def test_unchanged_values_are_not_written(self):
+        upload = self.create_upload(self.uploader, self.pipeline, files=3)
+        before = self.values(upload)
+        self.put_metadata(f"/file_repo/api/file/{upload.files.first().id}/metadata/", [{"key": "title", "value": "title 0"}])
+        after = self.values(upload)
+        self.assertEqual(len(before), len(after))
+        self.assertEqual([value for value in after if value[2] == "title 0"], [(file.id, "title", "title 0") for file in upload.files.order_by("id")])
+
+    def test_many_files_at_once(self):
+        self.create_upload(self.uploader, self.pipeline, files=2)
+        self.create_upload(self.uploader, self.pipeline, files=2)
+        files = [file.id for file in FileUpload.objects.all()]
+
+        response = self.client.put("/file_repo/api/files-metadata/", {"files": files, "values": [{"key": "title", "value": "batch"}]}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+        self.assertEqual(set(MetadataValue.objects.filter(key="title").values_list("value", flat=True)), {"batch"})
+
+    def test_many_files_of_another_uploader(self):
+        other = self.create_uploader("other", self.pipeline)
+        upload = self.create_upload(other, self.pipeline, files=1)
+        response = self.client.put("/file_repo/api/files-metadata/", {"files": [upload.files.first().id], "values": []}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_malformed_values_are_refused(self):
+        upload = self.create_upload(self.uploader, self.pipeline, files=1)
+        before = self.values(upload)
+        url = f"/file_repo/api/file/{upload.files.first().id}/metadata/"
+
+        response = self.client.put(url, "not json", content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        for data in [{"key": "title", "value": "title"}, ["title"], [{"value": "title"}], [{"key": "title", "value": 1}], [{"key": "", "value": "title"}]]:
+            response = self.client.put(url, data, format="json")
+            self.assertEqual(response.status_code, 400, data)
+            self.assertIn("detail", response.json())
+
+        for data in [{"values": []}, {"files": [upload.files.first().id]}, {"files": [upload.files.first().id], "values": [{"key": "title", "value": None}]}]:
+            response = self.client.put("/file_repo/api/files-metadata/", data, format="json")
+            self.assertEqual(response.status_code, 400, data)
+        self.assertEqual(self.values(upload), before)
+
+
+class FileSizeTest(UploadTestCase):
+
+    def test_size_is_stored_at_ingest_and_served_without_the_file(self):
+        pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        uploader = self.create_uploader("uploader", pipeline)
+        upload = self.create_upload(uploader, pipeline, files=1)
+        file = upload.files.get()
+        self.assertEqual(file.size, len(b"content"))
+        self.assertIsNotNone(file.modified_at)
+
+        os.remove(file.uploaded_file.path)
+
+        client = APIClient()
+        client.force_authenticate(uploader)
+        _, data = self.count_queries(client, f"/file_repo/api/pipeline-uploads/{pipeline.id}/")
+        self.assertEqual(data["results"][0]["files"][0]["size"], len(b"content"))
+
+    def test_backfill(self):
+        pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        upload = self.create_upload(self.create_uploader("uploader", pipeline), pipeline, files=2)
+        upload.files.update(size=None, modified_at=None)
+
+        call_command("backfill_file_stats", stdout=io.StringIO())
+
+        self.assertEqual(list(upload.files.values_list("size", flat=True)), [len(b"content")] * 2)
+
+
+class PipelineSchemaCacheTest(UploadTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        MetadataFormsField.objects.create(pipeline=self.pipeline, key="title", label="Title")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+        self.url = f"/file_repo/api/pipeline/{self.pipeline.id}/"
+
+    def test_not_modified_without_query(self):
+        etag = self.client.get(self.url)["ETag"]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_change_invalidates_the_schema(self):
+        first = self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            MetadataFormsField.objects.create(pipeline=self.pipeline, key="author", label="Author")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], first["ETag"])
+        self.assertEqual([field["key"] for field in response.json()["fields"]], ["title", "author"])
+
+    def test_other_pipeline(self):
+        other = Pipeline.objects.create(name="other", description="other")
+        self.assertEqual(self.client.get(f"/file_repo/api/pipeline/{other.id}/").status_code, 401)
+
+
+class UploadValidationListTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.workflow = Workflow.objects.create(name="workflow", pipeline=self.pipeline)
+        self.group = Group.objects.create(name="group")
+        self.other_group = Group.objects.create(name="other group")
+        self.workflow.validator_groups.add(self.group, self.other_group)
+        self.validator = User.objects.create(username="validator")
+        self.validator.groups.add(Group.objects.create(name="Validator"), self.group)
+        self.client = APIClient()
+        self.client.force_authenticate(self.validator)
+
+    def create_validated_uploads(self, count):
+        for i in range(count):
+            upload = self.create_upload(self.create_uploader(f"uploader_{Upload.objects.count()}", self.pipeline), self.pipeline)
+            UploadValidation.objects.create(upload=upload, group=self.group, workflow=self.workflow)
+            UploadValidation.objects.create(upload=upload, group=self.other_group, workflow=self.workflow)
+        FileUpload.objects.update(scan_state=FileUpload.ScanState.CLEAN)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        url = "/file_repo/api/upload-validation/?expand=upload,upload.user,workflow,group"
+
+        self.create_validated_uploads(2)
+        queries_for_two, data = self.count_queries(self.client, url)
+        self.assertEqual(len(data["results"]), 2)
+
+        self.create_validated_uploads(8)
+        queries_for_ten, data = self.count_queries(self.client, url)
+        self.assertEqual(len(data["results"]), 10)
+        self.assertEqual(queries_for_two, queries_for_ten)
+
+        result = data["results"][0]
+        self.assertEqual(len(result["same_upload_validations"]), 1)
+        self.assertEqual(result["upload"]["file_count"], 2)
+        self.assertEqual(result["group"]["name"], "group")
+
+
+class VisibleUploadsTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.group = Group.objects.create(name="group")
+        self.workflow = Workflow.objects.create(name="workflow", pipeline=self.pipeline)
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.own_upload = self.create_upload(self.uploader, self.pipeline, files=1)
+        self.other_upload = self.create_upload(self.create_uploader("other", self.pipeline), self.pipeline, files=1)
+        UploadValidation.objects.create(upload=self.other_upload, group=self.group, workflow=self.workflow)
+
+    def get_upload_ids(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get("/file_repo/api/upload/")
+        self.assertEqual(response.status_code, 200)
+        return {upload["id"] for upload in response.json()["results"]}
+
+    def test_uploader_sees_its_uploads(self):
+        self.assertEqual(self.get_upload_ids(self.uploader), {self.own_upload.id})
+
+        client = APIClient()
+        client.force_authenticate(self.uploader)
+        other_file = self.other_upload.files.first()
+        self.assertEqual(client.get(f"/file_repo/api/file/{other_file.id}/").status_code, 404)
+        self.assertEqual(client.get(f"/file_repo/api/download-file/{other_file.id}/").status_code, 401)
+
+    def test_validator_sees_the_uploads_to_validate(self):
+        validator = User.objects.create(username="validator")
+        validator.groups.add(self.group)
+        self.assertEqual(self.get_upload_ids(validator), {self.other_upload.id})
+
+    def test_automation_sees_every_upload(self):
+        automation = User.objects.create(username="automation")
+        automation.groups.add(Group.objects.create(name="Automation"))
+        self.assertEqual(self.get_upload_ids(automation), {self.own_upload.id, self.other_upload.id})
+
+
+class CachedTokenAuthenticationTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.user = self.create_uploader("uploader", self.pipeline)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def get_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/file_repo/api/user-by-token/{self.token.key}/")
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_user_is_resolved_once(self):
+        hits = token_cache_stats()["hits"]
+        self.get_user()
+        queries, data = self.get_user()
+        self.assertEqual(queries, 0)
+        self.assertEqual(data["pipeline"], self.pipeline.id)
+        self.assertEqual(token_cache_stats()["hits"], hits + 3)
+
+    def test_group_change_invalidates_the_cache(self):
+        self.get_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(Group.objects.create(name="Validator"))
+        queries, data = self.get_user()
+        self.assertGreater(queries, 0)
+        self.assertEqual(len(data["groups"]), 1)
+
+    def test_pipeline_change_invalidates_the_cache(self):
+        self.assertEqual(get_token(self.token.key).user.custom.pipeline.max_size_in_byte, self.pipeline.max_size_in_byte)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pipeline.max_size_in_byte = 5
+            self.pipeline.save()
+        self.assertEqual(get_token(self.token.key).user.custom.pipeline.max_size_in_byte, 5)
+
+    def test_unknown_token(self):
+        self.assertEqual(self.client.get("/file_repo/api/user-by-token/unknown/").status_code, 404)
+
+    def test_each_request_gets_its_own_user(self):
+        get_token(self.token.key)
+        with self.assertNumQueries(0):
+            first = get_token(self.token.key)
+            second = get_token(self.token.key)
+            self.assertEqual(second.user.custom.pipeline.name, "pipeline")
+            self.assertEqual(list(second.user.groups.all()), [])
+        self.assertIsNot(first.user, second.user)
+        self.assertIsNot(first.user.custom.pipeline, second.user.custom.pipeline)
+        self.assertFalse(first.user._state.adding)
+
+        first.user.first_name = "changed"
+        first.user._roles = None
+        third = get_token(self.token.key)
+        self.assertEqual(third.user.first_name, "")
+        self.assertIsNotNone(third.user._roles)
+
+    def test_user_without_custom(self):
+        user = User.objects.create(username="admin")
+        key = Token.objects.create(user=user).key
+        get_token(key)
+        with self.assertNumQueries(0):
+            self.assertFalse(hasattr(get_token(key).user, "custom"))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CHUNKED_UPLOAD_DIR=CHUNKED_UPLOAD_DIR, INGEST_TEMP_DIR=INGEST_TEMP_DIR, METRICS_DB=METRICS_DB)
+class ConcurrentWritesTest(UploadTestMixin, TransactionTestCase):
+    """
+    the write paths hammered from many threads, each one with its own connection to the database file
+    """
+    THREADS = 8
+    ITERATIONS = 10
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.workflow = Workflow.objects.create(name="workflow", pipeline=self.pipeline)
+        self.group = Group.objects.create(name="group")
+        self.workflow.validator_groups.add(self.group)
+        self.validator = User.objects.create(username="validator")
+        self.validator.groups.add(Group.objects.create(name="Validator"), self.group)
+        self.uploads = [self.create_upload(self.create_uploader(f"uploader_{i}", self.pipeline), self.pipeline, status=Upload.Status.FILE_UPLOADED) for i in range(self.THREADS)]
+        self.validations = [UploadValidation.objects.create(upload=upload, group=self.group, workflow=self.workflow) for upload in self.uploads]
+        FileUpload.objects.update(scan_state=FileUpload.ScanState.CLEAN)
+
+    def write(self, i, errors):
+        upload = self.uploads[i]
+        file = upload.files.first()
+        uploader = APIClient()
+        uploader.force_authenticate(upload.user)
+        validator = APIClient()
+        validator.force_authenticate(self.validator)
+        try:
+            for n in range(self.ITERATIONS):
+                responses = [
+                    uploader.put(f"/file_repo/api/file/{file.id}/metadata/", [{"key": "title", "value": f"title {n}"}], format="json"),
+                    uploader.post("/file_repo/api/upload/", {}, format="json"),
+                    validator.patch(f"/file_repo/api/upload-validation/{self.validations[i].id}/", {"state": UploadValidation.State.VALIDATED_OK}, format="json"),
+                ]
+                for response in responses:
+                    if response.status_code >= 300:
+                        errors.append(f"{response.status_code} {response.content[:200]}")
+        except OperationalError as e:
+            errors.append(str(e))
+        finally:
+            connection.close()
+
+    def test_no_lock_error(self):
+        errors = []
+        threads = [threading.Thread(target=self.write, args=(i, errors)) for i in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(MetadataValue.objects.filter(key="title", value=f"title {self.ITERATIONS - 1}").count(), self.THREADS * 2)
+        self.assertEqual(Upload.objects.filter(validation_state=Upload.ValidationState.VALIDATED_OK).count(), self.THREADS)
+
+
+
+class GenerateDatasetTest(UploadTestCase):
+
+    def test_dataset_is_consistent(self):
+        call_command('generate_dataset', uploads=30, pipelines=2, uploaders=4, stdout=io.StringIO())
+        call_command('generate_dataset', uploads=20, pipelines=2, uploaders=4, stdout=io.StringIO())
+
+        self.assertEqual(Upload.objects.count(), 50)
+        self.assertEqual(Pipeline.objects.count(), 2)
+        self.assertFalse(FileUpload.objects.filter(values__isnull=True).exists())
+
+        # the stored validation states are the ones computed from the validations
+        states = dict(Upload.objects.values_list('id', 'validation_state'))
+        call_command('refresh_validation_states', stdout=io.StringIO())
+        self.assertEqual(dict(Upload.objects.values_list('id', 'validation_state')), states)
+
+
+class MigrationsTest(TestCase):
+
+    def test_models_have_their_migrations(self):
+        output = io.StringIO()
+        try:
+            call_command('makemigrations', 'file_repo', check=True, dry_run=True, stdout=output)
+        except SystemExit:
+            self.fail(f"models changed without migration:\n{output.getvalue()}")
+
+    def test_migrations_of_other_apps_are_installed_with_them(self):
+        # makemigrations run for django.contrib.auth writes into site-packages: such a
+        # migration is missing from every other install, the image build included
+        distributions = importlib.metadata.packages_distributions()
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        for node in loader.graph.forwards_plan(loader.graph.leaf_nodes('file_repo')[0]):
+            module = sys.modules[type(loader.graph.nodes[node]).__module__]
+            package = module.__name__.split(".")[0]
+            if package == "file_repo":
+                continue
+            root = os.path.dirname(os.path.dirname(sys.modules[package].__file__))
+            installed = {str(path) for name in distributions[package] for path in importlib.metadata.files(name)}
+            self.assertTrue(os.path.relpath(module.__file__, root).replace(os.sep, "/") in installed, f"{node} is not installed with {package}")
+
+
+class QueryBudgetTest(UploadTestCase):
+
+    # views which are not in file_repo
+    WITHOUT_BUDGET = ["api_token_auth"]
+
+    def test_endpoints_are_within_their_budget(self):
+        call_command('generate_dataset', uploads=60, pipelines=2, uploaders=4, stdout=io.StringIO())
+        fixtures = Benchmark().get_fixtures()
+
+        for endpoint in ENDPOINTS:
+            key, request = endpoint_request(endpoint, fixtures)
+            with self.subTest(key):
+                # the pipelines are rendered again
+                cache.clear()
+                response = request()
+                self.assertLess(response.status_code, 400)
+                if endpoint[0] not in self.WITHOUT_BUDGET:
+                    self.assertWithinQueryBudget(response)
+
+
+class MetricsTest(UploadTestCase):
+
+    def setUp(self):
+        # the samples of the other tests stay in their store
+        metrics.store.flush()
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir, True)
+        settings = self.settings(METRICS_DB=os.path.join(metrics_dir, "metrics.sqlite3"))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_metrics(self):
+        pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        workflow = Workflow.objects.create(name="workflow", pipeline=pipeline)
+        group = Group.objects.create(name="metrics group")
+        uploader = self.create_uploader("uploader", pipeline)
+        upload = self.create_upload(uploader, pipeline, files=0)
+        UploadValidation.objects.create(upload=upload, group=group, workflow=workflow)
+
+        client = APIClient()
+        client.force_authenticate(uploader)
+        response = client.post("/file_repo/api/file/", {"upload": upload.id, "uploaded_file": io.BytesIO(b"0123456789"), "type": "text/plain"}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(client.get(f"/file_repo/api/download-file/{response.json()['id']}/").status_code, 200)
+
+        automation = User.objects.create(username="automation")
+        automation.groups.add(Group.objects.create(name="Automation"))
+        client.force_authenticate(automation)
+        response = client.get("/file_repo/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+
+        self.assertIn("# TYPE euploader_upload_duration_seconds histogram", lines)
+        self.assertIn(f'euploader_ingested_files_total{{pipeline="{pipeline.id}"}} 1', lines)
+        self.assertIn(f'euploader_ingested_bytes_total{{pipeline="{pipeline.id}"}} 10', lines)
+        self.assertIn(f'euploader_upload_duration_seconds_count{{pipeline="{pipeline.id}"}} 1', lines)
+        self.assertIn('euploader_validation_backlog{group="metrics group",state="NOT_VALIDATED"} 1', lines)
+        self.assertIn('euploader_scan_pending_files 1', lines)
+        self.assertTrue(any(line.startswith('euploader_request_duration_seconds_bucket{method="POST",status="201",view="file_repo:file-list",le="+Inf"}') for line in lines))
+        self.assertTrue(any(line.startswith('euploader_download_bytes_total ') for line in lines))
+
+    def test_token_cache_metrics(self):
+        automation = User.objects.create(username="automation")
+        automation.groups.add(Group.objects.create(name="Automation"))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=automation).key}")
+        self.assertEqual(client.get("/file_repo/api/metrics/").status_code, 200)
+        lines = client.get("/file_repo/api/metrics/").content.decode().splitlines()
+
+        self.assertIn('euploader_token_cache_total{result="miss"} 1', lines)
+        self.assertIn('euploader_token_cache_total{result="hit"} 1', lines)
+        self.assertIn(f'euploader_token_cache_entries{{pid="{os.getpid()}"}} {token_cache_stats()["size"]}', lines)
+
+
+
+class ContentAddressedStorageTest(UploadTestCase):
+
+    def setUp(self):
+        self.blobs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.blobs, True)
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def post_file(self, upload, content):
+        response = self.client.post("/file_repo/api/file/", {"upload": upload.id, "uploaded_file": io.BytesIO(content), "type": "text/plain"}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        return FileUpload.objects.get(id=response.json()["id"])
+
+    def test_identical_files_are_stored_once(self):
+        with self.settings(DEFAULT_FILE_STORAGE="file_repo.storage.ContentAddressedStorage", CONTENT_ADDRESSED_STORAGE_DIR=self.blobs):
+            first = self.post_file(self.create_upload(self.uploader, self.pipeline, files=0), b"same content")
+            second = self.post_file(self.create_upload(self.uploader, self.pipeline, files=0), b"same content")
+            other = self.post_file(self.create_upload(self.uploader, self.pipeline, files=0), b"other content")
+
+            self.assertNotEqual(first.uploaded_file.name, second.uploaded_file.name)
+            self.assertTrue(os.path.samefile(first.uploaded_file.path, second.uploaded_file.path))
+            self.assertFalse(os.path.samefile(first.uploaded_file.path, other.uploaded_file.path))
+            self.assertEqual(os.stat(first.uploaded_file.path).st_nlink, 3)
+
+            # django_cleanup removes one link, the blob is kept while a file uses it
+            with self.captureOnCommitCallbacks(execute=True):
+                first.delete()
+                other.delete()
+            with open(second.uploaded_file.path, "rb") as f:
+                self.assertEqual(f.read(), b"same content")
+
+            out = io.StringIO()
+            call_command('gc_blobs', stdout=out)
+            self.assertIn("1 blobs removed", out.getvalue())
+            self.assertEqual(os.stat(second.uploaded_file.path).st_nlink, 2)
+
+    def test_existing_files_are_deduplicated(self):
+        first = self.create_upload(self.uploader, self.pipeline, files=1).files.get()
+        second = self.create_upload(self.uploader, self.pipeline, files=1).files.get()
+
+        with self.settings(CONTENT_ADDRESSED_STORAGE_DIR=self.blobs):
+            out = io.StringIO()
+            call_command('dedupe_files', stdout=out)
+
+        self.assertIn("1 files replaced by a link", out.getvalue())
+        self.assertTrue(os.path.samefile(first.uploaded_file.path, second.uploaded_file.path))
+        self.assertTrue(FileUpload.objects.filter(id=first.id, sha256__isnull=False).exists())
+
+
+class FakeClamd:
+    """
+    a clamd socket sending a given reply, keeps what it was sent
+    """
+
+    def __init__(self, reply):
+        self.sent = b""
+        self.reply = reply
+
+    def sendall(self, data):
+        self.sent += data
+
+    def recv(self, size):
+        reply, self.reply = self.reply[:size], self.reply[size:]
+        return reply
+
+    def close(self):
+        pass
+
+
+class ScanningTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+
+    def scan(self, reply):
+        file = self.create_upload(self.uploader, self.pipeline, files=1).files.get()
+        with mock.patch("file_repo.scanning._connect", return_value=FakeClamd(reply)):
+            return scanning.scan_file(file)
+
+    def test_instream_framing(self):
+        clamd = FakeClamd(b"stream: OK\0")
+        with mock.patch("file_repo.scanning._connect", return_value=clamd), mock.patch("file_repo.scanning.SCAN_CHUNK_SIZE", 4):
+            self.assertEqual(scanning.clamd_instream(io.BytesIO(b"0123456789")), "stream: OK")
+        self.assertEqual(clamd.sent, b"zINSTREAM\0" + b"\0\0\0\x040123" + b"\0\0\0\x044567" + b"\0\0\0\x0289" + b"\0\0\0\0")
+
+    def test_clamd_replies(self):
+        self.assertEqual(self.scan(b"stream: OK\0"), (FileUpload.ScanState.CLEAN, None))
+        self.assertEqual(self.scan(b"stream: Eicar-Test-Signature FOUND\0"), (FileUpload.ScanState.INFECTED, "Eicar-Test-Signature"))
+        self.assertEqual(self.scan(b"INSTREAM size limit exceeded. ERROR\0"), (FileUpload.ScanState.ERROR, "INSTREAM size limit exceeded. ERROR"))
+        # clamd closed the connection without a reply
+        self.assertEqual(self.scan(b""), (FileUpload.ScanState.ERROR, ""))
+        with mock.patch("file_repo.scanning._connect", side_effect=ConnectionRefusedError("Connection refused")):
+            self.assertEqual(scanning.scan_file(FileUpload.objects.first()), (FileUpload.ScanState.ERROR, "Connection refused"))
+
+    def test_only_the_clean_uploads_are_validated(self):
+        workflow = Workflow.objects.create(name="workflow", pipeline=self.pipeline)
+        group = Group.objects.create(name="group")
+        validator = User.objects.create(username="validator")
+        validator.groups.add(Group.objects.create(name="Validator"), group)
+        automation = User.objects.create(username="automation")
+        automation.groups.add(Group.objects.create(name="Automation"))
+
+        uploads = {}
+        for state in [FileUpload.ScanState.CLEAN, FileUpload.ScanState.PENDING, FileUpload.ScanState.INFECTED]:
+            upload = self.create_upload(self.uploader, self.pipeline)
+            # one clean file does not make the upload clean
+            upload.files.update(scan_state=state)
+            upload.files.filter(id=upload.files.first().id).update(scan_state=FileUpload.ScanState.CLEAN)
+            UploadValidation.objects.create(upload=upload, group=group, workflow=workflow, state=UploadValidation.State.VALIDATED_OK)
+            uploads[state] = upload
+
+        client = APIClient()
+        client.force_authenticate(validator)
+        results = client.get("/file_repo/api/upload-validation/").json()["results"]
+        self.assertEqual([validation["upload"] for validation in results], [uploads[FileUpload.ScanState.CLEAN].id])
+
+        client.force_authenticate(automation)
+        results = client.get(f"/file_repo/api/validated-upload/{self.pipeline.id}/").json()["results"]
+        self.assertEqual([upload["id"] for upload in results], [uploads[FileUpload.ScanState.CLEAN].id])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CHUNKED_UPLOAD_DIR=CHUNKED_UPLOAD_DIR, INGEST_TEMP_DIR=INGEST_TEMP_DIR, METRICS_DB=METRICS_DB)
+class ScanVerdictCacheTest(UploadTestMixin, TransactionTestCase):
+    """
+    the scanworker threads have their own connection, the files must be committed
+    """
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def post_file(self, content):
+        response = self.client.post("/file_repo/api/file/", {"upload": self.upload.id, "uploaded_file": io.BytesIO(content), "type": "text/plain"}, format="multipart")
+        self.assertEqual(response.status_code, 201)
+        return FileUpload.objects.get(id=response.json()["id"])
+
+    def scanworker(self, version, replies):
+        with mock.patch("file_repo.management.commands.scanworker.clamd_version", return_value=version), \
+                mock.patch("file_repo.scanning.clamd_instream", side_effect=lambda f: replies[f.read()]) as instream:
+            call_command('scanworker', once=True)
+        return instream.call_count
+
+    def test_identical_contents_are_scanned_once(self):
+        replies = {b"same content": "stream: OK", b"eicar": "stream: Eicar-Signature FOUND"}
+        first = self.post_file(b"same content")
+        second = self.post_file(b"same content")
+        infected = self.post_file(b"eicar")
+
+        self.assertEqual(self.scanworker("ClamAV 1.1.2/27060/Mon Oct 12", replies), 2)
+        self.assertEqual(FileUpload.objects.filter(id__in=[first.id, second.id], scan_state=FileUpload.ScanState.CLEAN).count(), 2)
+        self.assertEqual(FileUpload.objects.get(id=infected.id).scan_result, "Eicar-Signature")
+
+        # a known content takes its verdict at once
+        self.assertEqual(self.post_file(b"same content").scan_state, FileUpload.ScanState.CLEAN)
+        self.assertEqual(self.post_file(b"eicar").scan_state, FileUpload.ScanState.INFECTED)
+        self.assertEqual(ScanVerdict.objects.get(sha256=first.sha256).hits, 2)
+
+        out = io.StringIO()
+        call_command('scan_verdict_stats', stdout=out)
+        self.assertIn("2 verdicts (1 CLEAN, 1 INFECTED), 3 hits, hit ratio 60.0%", out.getvalue())
+
+        # new signatures, the verdicts are purged and the contents scanned again
+        self.assertEqual(self.scanworker("ClamAV 1.1.2/27061/Tue Oct 13", replies), 0)
+        self.assertFalse(ScanVerdict.objects.exists())
+        self.assertEqual(self.post_file(b"same content").scan_state, FileUpload.ScanState.PENDING)
+        self.assertEqual(self.scanworker("ClamAV 1.1.2/27061/Tue Oct 13", replies), 1)
+        self.assertEqual(ScanVerdict.objects.get().db_version, "ClamAV 1.1.2/27061/Tue Oct 13")
+
+
+class UserImportTest(UploadTestCase):
+
+    def setUp(self):
+        self.import_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.import_dir, True)
+        existing = User.objects.create(username="existing@example.org", email="existing@example.org")
+        Token.objects.create(user=existing, key="old")
+        Token.objects.create(user=User.objects.create(username="other"), key="taken")
+        with open(os.path.join(self.import_dir, "users.csv"), "w") as f:
+            f.write("Email,Token\n"
+                    "new@example.org,\n"
+                    "with.token@example.org,given\n"
+                    ",\n"
+                    "existing@example.org,new\n"
+                    "not an email,\n"
+                    "thief@example.org,taken\n")
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_import_by_batches(self):
+        with self.settings(USER_IMPORT_DIR=self.import_dir), mock.patch.object(FileRepoConfig, "USER_IMPORT_BATCH_SIZE", 2):
+            response = self.client.post("/file_repo/v1/users/import/")
+            self.assertEqual(response.status_code, 202)
+            self.assertWithinQueryBudget(response)
+            self.assertEqual(self.client.post("/file_repo/v1/users/import/").status_code, 409)
+
+            # as the runworker command
+            job_ids = claim("worker", 1)
+            self.assertEqual(Job.objects.get(id__in=job_ids).kwargs, {"user_import_id": response.json()["id"]})
+            run_job(job_ids[0])
+
+        response = self.client.get(response.json()["url"])
+        self.assertWithinQueryBudget(response)
+        report = response.json()
+        self.assertEqual(report["status"], UserImport.Status.COMPLETED)
+        self.assertEqual([report[key] for key in ["rows", "created_users", "created_tokens", "updated_tokens", "errors_count"]], [6, 2, 2, 1, 2])
+        self.assertEqual([(error["row"], error["error"]) for error in report["errors"]], [(6, "invalid email"), (7, "token already used by another user")])
+
+        self.assertEqual(Token.objects.get(user__username="with.token@example.org").key, "given")
+        self.assertEqual(len(Token.objects.get(user__username="new@example.org").key), 40)
+        self.assertEqual(Token.objects.get(user__username="existing@example.org").key, "new")
+        self.assertFalse(User.objects.get(username="new@example.org").has_usable_password())
+        self.assertFalse(User.objects.filter(username="thief@example.org").exists())
+
+
+class ExportUsersTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        self.group = Group.objects.create(name="Validator")
+        for i in range(5):
+            user = self.create_uploader(f"uploader_{i}", self.pipeline if i % 2 else None)
+            user.email = f"uploader_{i}@example.org" if i < 4 else ""
+            user.save()
+            if i < 3:
+                Token.objects.create(user=user, key=f"token_{i}")
+        User.objects.get(username="uploader_1").groups.add(self.group)
+        self.admin = User.objects.create(username="admin", is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, query=""):
+        response = self.client.get(f"/file_repo/v1/users/export/{query}")
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_csv_is_streamed(self):
+        with CaptureQueriesContext(connection) as queries:
+            content = self.export().decode()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(content.splitlines(), ["Email,Token", "uploader_0@example.org,token_0", "uploader_1@example.org,token_1", "uploader_2@example.org,token_2", "uploader_3@example.org,"])
+
+        self.assertEqual(self.export(f"?pipeline={self.pipeline.id}").decode().splitlines()[1:], ["uploader_1@example.org,token_1", "uploader_3@example.org,"])
+        self.assertEqual(self.export("?group=Validator").decode().splitlines()[1:], ["uploader_1@example.org,token_1"])
+        # uploader_4 and the admin
+        self.assertEqual(self.export("?has_email=false").decode().splitlines()[1:], [",", ","])
+        self.assertEqual(self.client.get("/file_repo/v1/users/export/?has_email=maybe").status_code, 400)
+
+    def test_xlsx(self):
+        content = self.export(f"?file_type=xlsx&group={self.group.id}")
+        self.assertEqual(pyexcel.get_array(file_content=content, file_type="xlsx"), [["Email", "Token"], ["uploader_1@example.org", "token_1"]])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CHUNKED_UPLOAD_DIR=CHUNKED_UPLOAD_DIR, INGEST_TEMP_DIR=INGEST_TEMP_DIR, METRICS_DB=METRICS_DB)
+class JobTest(UploadTestMixin, TransactionTestCase):
+    """
+    the runworker threads have their own connection, the jobs must be committed
+    """
+
+    def setUp(self):
+        self.calls = []
+        tasks = mock.patch.dict(TASKS, {"flaky": (self.flaky, 3)})
+        tasks.start()
+        self.addCleanup(tasks.stop)
+
+    def flaky(self, fail):
+        self.calls.append(fail)
+        if len(self.calls) <= fail:
+            raise OSError("flaky")
+        return {"calls": len(self.calls)}
+
+    def test_retry_with_backoff(self):
+        job = enqueue("flaky", fail=5)
+        for attempt in range(1, 4):
+            run_job(claim("worker", 1)[0])
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            if attempt < 3:
+                self.assertEqual(job.status, Job.Status.QUEUED)
+                self.assertAlmostEqual((job.run_after - timezone.now()).total_seconds(), FileRepoConfig.JOB_RETRY_DELAY_IN_SECOND * 2 ** (attempt - 1), delta=5)
+                self.assertEqual(claim("worker", 1), [])
+                Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn("OSError: flaky", job.error)
+
+    def test_expired_lease_is_claimed_again(self):
+        job = enqueue("flaky", fail=0)
+        self.assertEqual(claim("dead", 1), [job.id])
+        self.assertEqual(claim("alive", 1), [])
+        Job.objects.filter(id=job.id).update(lease_until=timezone.now() - datetime.timedelta(seconds=1))
+
+        call_command('runworker', once=True, workers=2)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts, job.result), (Job.Status.DONE, f"{socket.gethostname()}:{os.getpid()}", 2, {"calls": 1}))
+
+    def test_zip_files_in_background(self):
+        pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        upload = self.create_upload(self.create_uploader("uploader", pipeline), pipeline)
+        admin = User.objects.create(username="admin", is_staff=True, is_superuser=True)
+        client = APIClient()
+        client.force_login(admin)
+
+        job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_dir, True)
+
+        with self.settings(JOB_OUTPUT_DIR=job_dir, DOWNLOAD_OFFLOAD=False):
+            response = client.post("/admin/file_repo/fileupload/", {"action": "zip_files_in_background", "_selected_action": list(upload.files.values_list('id', flat=True))})
+            self.assertEqual(response.status_code, 302)
+            call_command('runworker', once=True)
+
+            job = Job.objects.get(name="zip_files")
+            self.assertEqual((job.status, job.result["files"]), (Job.Status.DONE, 2))
+            response = client.get(f"/file_repo/v1/jobs/{job.id}/file/")
+            self.assertEqual(response.status_code, 200)
+            self.assertWithinQueryBudget(response)
+            with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as archive:
+                self.assertEqual(len(archive.namelist()), 2)
+
+            with self.settings(DOWNLOAD_OFFLOAD=True, JOB_OUTPUT_OFFLOAD_LOCATION="/protected_jobs/"):
+                response = client.get(f"/file_repo/v1/jobs/{job.id}/file/")
+                self.assertEqual(response["X-Accel-Redirect"], "/protected_jobs/" + job.result["file"])
+                client.force_login(upload.user)
+                self.assertEqual(client.get(f"/file_repo/v1/jobs/{job.id}/file/").status_code, 403)
+
+
+class FileBatchTest(UploadTestCase):
+
+    def setUp(self):
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline", max_size_in_byte=1000)
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def test_files_and_sessions_in_one_request(self):
+        ScanVerdict.objects.create(sha256=hashlib.sha256(b"known").hexdigest(), db_version="ClamAV", scan_state=FileUpload.ScanState.CLEAN)
+        session = FileUploadSession.objects.create(upload=self.upload, filename="session.bin", size=7)
+        self.client.put(f"/file_repo/api/file-session/{session.id}/part/0/", b"session", content_type="application/octet-stream")
+        files = [io.BytesIO(content) for content in [b"first", b"x" * 1001, b"known", b""]]
+        for i, file in enumerate(files):
+            file.name = f"file_{i}.xml"
+
+        response = self.client.post("/file_repo/api/file/batch/", {"upload": self.upload.id, "uploaded_file": files, "type": ["text/xml"] * 4, "session": [session.id, 0]}, format="multipart")
+        self.assertEqual(response.status_code, 207)
+        self.assertWithinQueryBudget(response)
+
+        data = response.json()
+        self.assertEqual([(file["name"], file["size"], file["scan_state"]) for file in data["files"]], [
+            ("file_0.xml", 5, FileUpload.ScanState.PENDING), ("file_2.xml", 5, FileUpload.ScanState.CLEAN), ("session.bin", 7, FileUpload.ScanState.PENDING)])
+        self.assertEqual([error.get("index", error.get("session")) for error in data["errors"]], [1, 3, "0"])
+        self.assertIn("exceeds the limit of 1000 bytes", data["errors"][0]["errors"]["uploaded_file"][0])
+
+        session.refresh_from_db()
+        self.assertEqual((session.status, session.file_id), (FileUploadSession.Status.COMPLETED, data["files"][2]["id"]))
+        file = FileUpload.objects.get(id=data["files"][0]["id"])
+        self.assertEqual((file.type, file.sha256, file.uploaded_file.read()), ("text/xml", hashlib.sha256(b"first").hexdigest(), b"first"))
+        self.assertAlmostEqual(file.modified_at.timestamp(), os.stat(file.uploaded_file.path).st_mtime, places=5)
+
+    def test_other_upload_is_refused(self):
+        other = self.create_upload(self.create_uploader("other", self.pipeline), self.pipeline, files=0)
+        response = self.client.post("/file_repo/api/file/batch/", {"upload": other.id, "uploaded_file": [io.BytesIO(b"content")]}, format="multipart")
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(other.files.exists())
+
+
+class MimeSniffTest(UploadTestCase):
+    PDF = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n1 0 obj\n<<>>\nendobj\n"
+    XML = b'<?xml version="1.0"?><a/>'
+
+    def setUp(self):
+        # the allowed types are cached with the schema version, bumped on commit only
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.pipeline = Pipeline.objects.create(name="pipeline", description="pipeline")
+        AllowedFileType.objects.create(mime="application/pdf").pipeline.add(self.pipeline)
+        AllowedFileType.objects.create(mime="image/*").pipeline.add(self.pipeline)
+        self.uploader = self.create_uploader("uploader", self.pipeline)
+        self.upload = self.create_upload(self.uploader, self.pipeline, files=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.uploader)
+
+    def post_file(self, name, content):
+        file = io.BytesIO(content)
+        file.name = name
+        return self.client.post("/file_repo/api/file/", {"upload": self.upload.id, "uploaded_file": file, "type": "text/plain"}, format="multipart")
+
+    def test_detected_type_is_stored_apart_from_the_claimed_one(self):
+        response = self.post_file("document.txt", self.PDF)
+        self.assertEqual(response.status_code, 201)
+        self.assertWithinQueryBudget(response)
+        self.assertEqual((response.json()["type"], response.json()["detected_type"]), ("text/plain", "application/pdf"))
+        self.assertEqual(self.post_file("image.gif", b"GIF89a\x01\x00\x01\x00\x00\x00\x00;").json()["detected_type"], "image/gif")
+
+    def test_type_not_allowed_is_refused_after_the_first_bytes(self):
+        with mock.patch("file_repo.uploads.magic.from_buffer", wraps=magic.from_buffer) as from_buffer:
+            response = self.post_file("document.pdf", self.XML + b" " * 1000000)
+        self.assertEqual(response.status_code, 415)
+        self.assertIn("document.pdf is text/xml", response.json()["detail"])
+        self.assertEqual(len(from_buffer.call_args[0][0]), FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE)
+        self.assertEqual(self.post_file("small.pdf", self.XML).status_code, 415)
+        self.assertFalse(self.upload.files.exists())
+
+    def test_allowed_types_follow_the_pipeline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedFileType.objects.create(mime="text/xml").pipeline.add(self.pipeline)
+        self.assertEqual(self.post_file("document.xml", self.XML).status_code, 201)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            AllowedFileType.objects.all().delete()
+        self.assertEqual(self.post_file("other.xml", self.XML).status_code, 201)
+
+    def test_batch_and_sessions(self):
+        files = [io.BytesIO(content) for content in [self.PDF, self.XML]]
+        for i, file in enumerate(files):
+            file.name = f"file_{i}.pdf"
+        response = self.client.post("/file_repo/api/file/batch/", {"upload": self.upload.id, "uploaded_file": files}, format="multipart")
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([file["detected_type"] for file in response.json()["files"]], ["application/pdf"])
+        self.assertEqual([error["index"] for error in response.json()["errors"]], [1])
+
+        session = FileUploadSession.objects.create(upload=self.upload, filename="session.pdf", size=len(self.XML))
+        response = self.client.put(f"/file_repo/api/file-session/{session.id}/part/0/", self.XML, content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 415)
+        session.refresh_from_db()
+        self.assertEqual(session.status, FileUploadSession.Status.ABORTED)
+        self.assertFalse(os.path.exists(session.part_dir()))
+
+        session = FileUploadSession.objects.create(upload=self.upload, filename="session.pdf", size=len(self.PDF))
+        self.client.put(f"/file_repo/api/file-session/{session.id}/part/0/", self.PDF, content_type="application/octet-stream")
+        response = self.client.post(f"/file_repo/api/file-session/{session.id}/finalize/")
+        self.assertEqual((response.status_code, response.json()["detected_type"]), (201, "application/pdf"))
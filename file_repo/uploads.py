@@ -0,0 +1,233 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload, StopFutureHandlers
+from .apps import FileRepoConfig
+from .cache import cached_allowed_mimes
+import hashlib
+import magic
+import os
+import shutil
+import tempfile
+
+COPY_BUFFER_SIZE = 65536
+
+
+class IncomingFile(UploadedFile):
+    """
+    Uploaded file written in a temporary file on the same filesystem as MEDIA_ROOT.
+    The storage moves it in place with a rename instead of copying it.
+    """
+    def __init__(self, name, content_type, size, charset=None, dir=None):
+        os.makedirs(dir, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload', dir=dir)
+        super().__init__(file, name, content_type, size, charset)
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def close(self):
+        try:
+            return self.file.close()
+        except FileNotFoundError:
+            # the file was moved in place, nothing left to delete
+            pass
+
+
+def get_size_limit(user):
+    """
+    the uploader's pipeline limit, or the FILE_SIZE_LIMIT_IN_BYTE Config, or the default limit
+    """
+    from .models import Config
+    if hasattr(user, 'custom') and user.custom.pipeline:
+        return user.custom.pipeline.max_size_in_byte
+    config = Config.objects.filter(key="FILE_SIZE_LIMIT_IN_BYTE").first()
+    return int(config.value) if config else FileRepoConfig.DEFAULT_SIZE_LIMIT_IN_BYTE
+
+
+def get_allowed_mimes(pipeline_id):
+    """
+    the MIME types allowed by a pipeline (AllowedFileType), None when it has none and allows any file
+    """
+    from .models import AllowedFileType
+    if pipeline_id is None:
+        return None
+    mimes = cached_allowed_mimes(pipeline_id, lambda: sorted(mime.strip().lower() for mime in AllowedFileType.objects.filter(pipeline=pipeline_id).values_list('mime', flat=True)))
+    return set(mimes) or None
+
+def get_user_allowed_mimes(user):
+    """
+    the MIME types allowed by the uploader's pipeline, as get_size_limit
+    """
+    return get_allowed_mimes(user.custom.pipeline_id if hasattr(user, 'custom') else None)
+
+def sniff_mime(head):
+    """
+    the MIME type of a content detected by libmagic from its first MIME_SNIFF_SIZE_IN_BYTE bytes
+    """
+    return magic.from_buffer(head[:FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE], mime=True) if head else None
+
+def mime_error(name, mime, allowed):
+    """
+    the reason to refuse a file of the detected type mime, None when allowed
+    ("image/*" allows all the images)
+    """
+    if allowed is None or mime is None or mime in allowed or f"{mime.split('/')[0]}/*" in allowed:
+        return None
+    return f"{name} is {mime}, the allowed types are {', '.join(sorted(allowed))}"
+
+
+class StreamingIngestUploadHandler(FileUploadHandler):
+    """
+    Write each uploaded file straight into INGEST_TEMP_DIR while computing its SHA-256,
+    and stop reading the request as soon as the size limit is passed or as soon as the type
+    detected from the first bytes is not one of allowed_mimes.
+    With skip_rejected, only the rest of the file is skipped and the file has a rejected
+    attribute, so the other files of the request are received.
+    """
+    def __init__(self, request=None, max_size=None, allowed_mimes=None, skip_rejected=False):
+        super().__init__(request)
+        self.max_size = max_size
+        self.allowed_mimes = allowed_mimes
+        self.skip_rejected = skip_rejected
+        self.rejected = None
+        # "size" or "type"
+        self.rejected_reason = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = IncomingFile(self.file_name, self.content_type, 0, self.charset, dir=settings.INGEST_TEMP_DIR)
+        self.file.rejected = None
+        self.file.detected_type = None
+        self.sha256 = hashlib.sha256()
+        self.received = 0
+        self.head = b""
+        # the default handlers must not buffer the file a second time
+        raise StopFutureHandlers()
+
+    def reject(self, reason, message, stop=True):
+        self.rejected = message
+        self.rejected_reason = reason
+        if stop and not self.skip_rejected:
+            raise StopUpload(connection_reset=True)
+        self.file.rejected = message
+        self.file.truncate(0)
+
+    def detect_type(self):
+        self.file.detected_type = sniff_mime(self.head)
+        self.head = None
+        return mime_error(self.file_name, self.file.detected_type, self.allowed_mimes)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.file.rejected:
+            return
+        # the type is known once the first bytes are received, before the file is written
+        if self.head is not None:
+            self.head += raw_data[:FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE - len(self.head)]
+            if len(self.head) >= FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE:
+                error = self.detect_type()
+                if error:
+                    self.reject("type", error)
+                    return
+        self.received += len(raw_data)
+        if self.max_size is not None and self.received > self.max_size:
+            self.reject("size", f"{self.file_name} exceeds the limit of {self.max_size} bytes")
+            return
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        # a file smaller than MIME_SNIFF_SIZE_IN_BYTE, the request is already read
+        if self.head is not None and not self.file.rejected:
+            error = self.detect_type()
+            if error:
+                self.reject("type", error, stop=False)
+        self.file.flush()
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.sha256.hexdigest()
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+def write_part(session, number, stream):
+    """
+    Write one part of a FileUploadSession, the part is only visible once complete
+    so a part being received is never taken for a received part.
+    Return the number of bytes written.
+    """
+    os.makedirs(session.part_dir(), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=session.part_dir())
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                data = stream.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                written += len(data)
+                if written > session.part_length(number):
+                    break
+                f.write(data)
+        if written != session.part_length(number):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, session.part_path(number))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+
+def part_head(session):
+    """
+    the first bytes of the part 0 of a FileUploadSession, enough to detect its type
+    """
+    with open(session.part_path(0), 'rb') as part:
+        return part.read(FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE)
+
+
+def assemble_parts(session):
+    """
+    Concatenate the parts of a FileUploadSession into an IncomingFile, compute its SHA-256
+    and detect its type
+    """
+    incoming = IncomingFile(session.filename, session.type, session.size, dir=session.part_dir())
+    sha256 = hashlib.sha256()
+    head = b""
+    for number in range(session.part_count()):
+        with open(session.part_path(number), 'rb') as part:
+            while True:
+                data = part.read(COPY_BUFFER_SIZE)
+                if not data:
+                    break
+                if len(head) < FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE:
+                    head += data[:FileRepoConfig.MIME_SNIFF_SIZE_IN_BYTE - len(head)]
+                sha256.update(data)
+                incoming.file.write(data)
+    incoming.file.flush()
+    incoming.sha256 = sha256.hexdigest()
+    incoming.detected_type = sniff_mime(head)
+    incoming.seek(0)
+    return incoming
+
+
+def remove_parts(session):
+    shutil.rmtree(session.part_dir(), ignore_errors=True)
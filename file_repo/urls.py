@@ -29,18 +29,23 @@ router.register(r'pipeline', api_views.PipelineViewSet, basename="pipeline")
 router.register(r'pipeline-minimal', api_views.PipelineMinimalViewSet, basename="pipeline-minimal")
 router.register(r'upload', api_views.UploadViewSet, basename="upload")
 router.register(r'file', api_views.FileUploadViewSet, basename="file")
+router.register(r'file-session', api_views.FileUploadSessionViewSet, basename="file-session")
 router.register(r'note', api_views.NoteViewSet, basename="note")
 router.register(r'upload-validation', api_views.UploadValidationViewSet, basename="upload-validation")
 
 urlpatterns = [
     re_path(r'^v1/users/export/$', views.export_users, name='export_users'),
     re_path(r'^v1/users/import/$', views.import_users, name='import_users'),
+    path('v1/users/import/<int:id>/', views.import_users_status, name='import_users_status'),
+    path('v1/jobs/<int:id>/file/', views.job_file, name='job_file'),
     path('api/', include(router.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/pipeline-uploads/<int:pipeline_id>/', api_views.UploadsByPipeline.as_view(), name='pipeline-uploads'),
     path('api/user-by-token/<str:token>/',  api_views.UserByToken.as_view(), name='user-by-token'),
     path('api/file/<int:file_id>/metadata/',  api_views.file_metadata, name='file-metadata'),
+    path('api/files-metadata/',  api_views.files_metadata, name='files-metadata'),
     path('api/download-file/<int:id>/',  api_views.download_file, name='download-file'),
     path('api/api-token-auth/', obtain_auth_token, name='api_token_auth'),
     path('api/validated-upload/<int:pipeline_id>/', api_views.validated_upload, name='validated-upload'),
+    path('api/metrics/', api_views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
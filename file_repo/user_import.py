@@ -0,0 +1,174 @@
+"""
+Copyright (c) BCU Fribourg
+
+This file is part of eUploader.
+eUploader is free software: you can redistribute it and/or modify 
+it under the terms of the GNU General Public License as published by the 
+Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+eUploader is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; 
+without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. 
+See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with eUploader. 
+If not, see <https://www.gnu.org/licenses/>.
+"""
+
+"""
+Import of the users of the spreadsheets of USER_IMPORT_DIR (EMAIL and optional TOKEN columns).
+The rows are read as a stream and imported by batches of USER_IMPORT_BATCH_SIZE: one lookup
+of the existing users and tokens, then the new users and tokens are inserted with bulk_create
+in one transaction. The rows which can't be imported are stored in UserImportError.
+"""
+
+from django.conf import settings
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from .apps import FileRepoConfig
+from .db import immediate_atomic
+from .jobs import enqueue
+from .models import UserImport, UserImportError
+import datetime
+import logging
+import os
+import pyexcel
+import secrets
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = [UserImport.Status.PENDING, UserImport.Status.RUNNING]
+
+
+def start_import(user):
+    """
+    create a UserImport and the job running it, return (user_import, started);
+    when an import is already active it is returned instead
+    """
+    stale = timezone.now() - datetime.timedelta(seconds=FileRepoConfig.USER_IMPORT_STALE_AFTER_IN_SECOND)
+    with immediate_atomic():
+        UserImport.objects.filter(status__in=ACTIVE_STATES, updated_at__lt=stale).update(
+            status=UserImport.Status.FAILED, message="stopped without finishing", finished_at=timezone.now())
+        active = UserImport.objects.filter(status__in=ACTIVE_STATES).first()
+        if active:
+            return active, False
+        user_import = UserImport.objects.create(user=user)
+        enqueue("import_users", user=user, user_import_id=user_import.id)
+    return user_import, True
+
+def run_import(user_import_id):
+    """
+    the import_users job, see tasks.py
+    """
+    with immediate_atomic():
+        # an import marked as stale isn't run, a new attempt starts from the first row again
+        if not UserImport.objects.filter(id=user_import_id, status__in=ACTIVE_STATES).update(
+                status=UserImport.Status.RUNNING, file=None, rows=0, created_users=0, created_tokens=0, updated_tokens=0, errors_count=0, updated_at=timezone.now()):
+            return
+        UserImportError.objects.filter(user_import_id=user_import_id).delete()
+    try:
+        for name in sorted(os.listdir(settings.USER_IMPORT_DIR)):
+            batch = []
+            for row in read_rows(os.path.join(settings.USER_IMPORT_DIR, name)):
+                batch.append(row)
+                if len(batch) == FileRepoConfig.USER_IMPORT_BATCH_SIZE:
+                    import_batch(user_import_id, name, batch)
+                    batch = []
+            if batch:
+                import_batch(user_import_id, name, batch)
+    except Exception as e:
+        logger.exception(f"user import {user_import_id} failed")
+        UserImport.objects.filter(id=user_import_id).update(status=UserImport.Status.FAILED, message=str(e), finished_at=timezone.now())
+    else:
+        UserImport.objects.filter(id=user_import_id).update(status=UserImport.Status.COMPLETED, finished_at=timezone.now())
+
+def read_rows(path):
+    """
+    (row number, email, token) of each row of a spreadsheet, read as a stream
+    """
+    try:
+        # the header is the row 1
+        for number, record in enumerate(pyexcel.iget_records(file_name=path), start=2):
+            record = {str(key).upper(): value for key, value in record.items()}
+            yield number, str(record.get("EMAIL") or "").strip(), str(record.get("TOKEN") or "").strip()
+    finally:
+        pyexcel.free_resources()
+
+def import_batch(user_import_id, name, rows):
+    """
+    create the users of the rows and their token, or replace the token of an existing user
+    """
+    errors = []
+    valid = {}
+    for number, email, key in rows:
+        # rows without email are skipped
+        if not email:
+            continue
+        error = check_row(email, key)
+        if error:
+            errors.append(UserImportError(user_import_id=user_import_id, file=name, row=number, email=email, error=error))
+        else:
+            # the last row of an email wins
+            valid[email] = (number, key)
+
+    created_users = []
+    new_tokens = []
+    replaced_tokens = []
+    with immediate_atomic():
+        users = {user.username: user for user in User.objects.filter(username__in=list(valid)).select_related('auth_token')}
+        token_users = dict(Token.objects.filter(key__in=[key for _, key in valid.values() if key]).values_list('key', 'user_id'))
+
+        for email, (number, key) in list(valid.items()):
+            user = users.get(email)
+            # a new user has its email instead of an id, a token can also be given twice in the batch
+            owner = user.id if user else email
+            if key and token_users.setdefault(key, owner) != owner:
+                errors.append(UserImportError(user_import_id=user_import_id, file=name, row=number, email=email, error="token already used by another user"))
+                del valid[email]
+            elif not user:
+                # as make_password(None) which spends its time in get_random_string
+                created_users.append(User(username=email, email=email, password=UNUSABLE_PASSWORD_PREFIX + secrets.token_hex(20)))
+
+        User.objects.bulk_create(created_users)
+        # bulk_create doesn't set the ids on SQLite
+        users.update((user.username, user) for user in User.objects.filter(username__in=[user.username for user in created_users]).select_related('auth_token'))
+
+        for email, (number, key) in valid.items():
+            user = users[email]
+            try:
+                token = user.auth_token
+            except Token.DoesNotExist:
+                token = None
+            if token is None:
+                # Token.save() isn't called by bulk_create
+                new_tokens.append(Token(user=user, key=key or Token.generate_key()))
+            elif key and token.key != key:
+                replaced_tokens.append(token.key)
+                new_tokens.append(Token(user=user, key=key))
+
+        # the key is the primary key, the tokens are replaced
+        if replaced_tokens:
+            Token.objects.filter(key__in=replaced_tokens).delete()
+        Token.objects.bulk_create(new_tokens)
+        UserImportError.objects.bulk_create(errors)
+        UserImport.objects.filter(id=user_import_id).update(
+            file=name,
+            rows=F('rows') + len(rows),
+            created_users=F('created_users') + len(created_users),
+            created_tokens=F('created_tokens') + len(new_tokens) - len(replaced_tokens),
+            updated_tokens=F('updated_tokens') + len(replaced_tokens),
+            errors_count=F('errors_count') + len(errors),
+            updated_at=timezone.now())
+
+def check_row(email, key):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return "invalid email"
+    if len(email) > User._meta.get_field('username').max_length:
+        return "email too long"
+    if len(key) > Token._meta.get_field('key').max_length:
+        return "token too long"
+    return None
@@ -19,21 +19,25 @@ from rest_framework.response import Response
 
 from django.utils import translation, timezone, dateformat
 from django.utils.translation import gettext as _
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse, Http404
 from django.shortcuts import render
 from django.template import loader
 from django.conf import settings
 
-from . models import FileUpload, AllowedFileType, Config, Upload, MetadataValue, UploadValidation
+from . models import FileUpload, AllowedFileType, Config, Upload, MetadataValue, UploadValidation, UserImport, UserImportError, Job
+from . serializers import UserImportSerializer
+from . user_import import start_import
+from . instrumentation import query_budget
+from . streaming import csv_stream, spreadsheet_file, file_response
 from . apps import FileRepoConfig as FC
 from rest_framework import status
 
 from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
-from django.db import IntegrityError
+from django.db.models import Prefetch
+from django.urls import reverse
 
-import pyexcel
-import csv
+import itertools
 import os
 import logging
 
@@ -48,57 +52,94 @@ class HomePageView(TemplateView):
 
 
 
+EXPORT_FILE_TYPES = {"csv": "text/csv", "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"}
+
+@query_budget(2)
 @api_view(['GET'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAdminUser ])
 def export_users(request):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="eUploader_users.csv"'
-    
-    users = User.objects.all()
-    writer = csv.writer(response)
-    writer.writerow(['Email', 'Token'])
-    for user in users:
-        try:
-            token = Token.objects.get(user=user)
-        except:
-            token = ""
-        if user.email:
-            writer.writerow([user.email, str(token)])
-    return response
+    """
+    The email and token of the users in CSV, written while the users are read, or in XLSX with ?file_type=xlsx.
+    Filters: ?pipeline=<id>, ?group=<id or name>, ?has_email=true (default), false or all
+    """
+    file_type = request.query_params.get('file_type', 'csv')
+    if file_type not in EXPORT_FILE_TYPES:
+        return Response({"file_type": f"one of {', '.join(EXPORT_FILE_TYPES)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-@api_view(['GET'])
+    users = User.objects.all()
+    has_email = request.query_params.get('has_email', 'true')
+    if has_email == 'true':
+        users = users.exclude(email='')
+    elif has_email == 'false':
+        users = users.filter(email='')
+    elif has_email != 'all':
+        return Response({"has_email": "true, false or all"}, status=status.HTTP_400_BAD_REQUEST)
+    pipeline = request.query_params.get('pipeline')
+    if pipeline:
+        if not pipeline.isdigit():
+            return Response({"pipeline": "a pipeline id"}, status=status.HTTP_400_BAD_REQUEST)
+        users = users.filter(custom__pipeline_id=pipeline)
+    group = request.query_params.get('group')
+    if group:
+        users = users.filter(groups__id=group) if group.isdigit() else users.filter(groups__name=group)
+
+    # one query with the token joined, read by chunks
+    rows = users.order_by('id').values_list('email', 'auth_token__key').iterator(chunk_size=FC.USER_EXPORT_CHUNK_SIZE)
+    rows = itertools.chain([['Email', 'Token']], ([email, key or ""] for email, key in rows))
+
+    filename = f"eUploader_users.{file_type}"
+    if file_type == "csv":
+        response = StreamingHttpResponse(csv_stream(rows), content_type=EXPORT_FILE_TYPES[file_type])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    return FileResponse(spreadsheet_file(rows, file_type), as_attachment=True, filename=filename, content_type=EXPORT_FILE_TYPES[file_type])
+
+@query_budget(7)
+@api_view(['GET', 'POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAdminUser ])
 def import_users(request):
-    excel_dir = f'{os.getcwd()}/file_repo/import/users/'
-    files = os.listdir(excel_dir)
-
-    for f in files:
-        data = pyexcel.iget_records(file_name=f'{excel_dir}{f}')
-        for row in data:
-            user_data = {k.upper():v for k,v in row.items()}
-            if 'EMAIL' not in user_data:
-                continue
-            
-            if not user_data["EMAIL"]:
-                continue
-            
-            email = user_data["EMAIL"]
-
-            try:
-                user = User.objects.create_user(username=email, email=email)
-            except IntegrityError:
-                user = User.objects.get(username=email)
-
-            if 'TOKEN' not in user_data or not user_data["TOKEN"]:
-                try:
-                    Token.objects.create(user=user)
-                except IntegrityError:
-                    continue
-            else:
-                try:
-                    Token.objects.create(user=user, key=user_data["TOKEN"])
-                except IntegrityError:
-                    Token.objects.filter(user=user).update(key=user_data["TOKEN"])
-    return Response("Users imported")
+    """
+    start the import of the spreadsheets of USER_IMPORT_DIR in the background,
+    its progress and errors are returned by import_users_status
+    """
+    user_import, started = start_import(request.user)
+    data = UserImportSerializer(user_import, context={'request': request}).data
+    data["url"] = request.build_absolute_uri(reverse('file_repo:import_users_status', kwargs={'id': user_import.id}))
+    if not started:
+        data["detail"] = "an import is already running"
+        return Response(data, status=status.HTTP_409_CONFLICT)
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+@query_budget(2)
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAdminUser ])
+def import_users_status(request, id):
+    try:
+        user_import = UserImport.objects.prefetch_related(Prefetch('errors', UserImportError.objects.order_by('file', 'row'))).get(id=id)
+    except UserImport.DoesNotExist:
+        raise Http404
+    return Response(UserImportSerializer(user_import).data)
+
+# the session, the admin user and the job: the link is opened from the admin
+@query_budget(3)
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAdminUser ])
+def job_file(request, id):
+    """
+    the file written by a job, linked from the admin
+    """
+    try:
+        job = Job.objects.get(id=id, status=Job.Status.DONE)
+    except Job.DoesNotExist:
+        raise Http404
+    if not isinstance(job.result, dict) or not job.result.get('file'):
+        raise Http404
+    filename = os.path.basename(job.result['file'])
+    path = os.path.join(settings.JOB_OUTPUT_DIR, filename)
+    if not os.path.exists(path):
+        raise Http404
+    return file_response(request, path, filename=filename, root=settings.JOB_OUTPUT_DIR, offload_location=settings.JOB_OUTPUT_OFFLOAD_LOCATION)